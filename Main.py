@@ -2,12 +2,17 @@ import streamlit as st
 from streamlit_login_auth_ui.widgets import __login__
 # from sheets import DrawAi, Deepseek, KiMi, MultiModelAI, PPTAi, Yi, Tiangong, Baichuan, CopilotAi, Research
 from streamlit_option_menu import option_menu
+from tools.metrics import show_metrics_sidebar
+from tools.recovery import run_recovery_scan
 from sheet import a, CharactersAi, MultiModelAI, PPTAi, NetworkAi, ToolAi, Customize_character, Workflows, Knowledge, VideoGeneration, program, Doctor
 
 # 从secrets.toml文件中读取邮箱账号和密码
 sender_email = st.secrets["smtp"]["email"]
 sender_password = st.secrets["smtp"]["password"]
 
+# 启动后第一次运行时修复或隔离崩溃遗留的损坏文件（账号文件在登录前检查）
+run_recovery_scan()
+
 # 实例化登录对象
 __login__obj = __login__(sender_email=sender_email,
                          sender_password=sender_password,
@@ -35,6 +40,8 @@ if LOGGED_IN:
             default_index=0,
         )
 
+    show_metrics_sidebar()
+
     # 将 __login__obj 传递给各个模块
     if selected == "============基本功能============":
         a.main(__login__obj)
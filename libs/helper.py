@@ -2,18 +2,22 @@ import json
 import os
 import streamlit as st
 
-def get_history_chats(path: str) -> list:
+from tools.atomic_io import atomic_write_json, file_lock
+from tools.chat_manifest import ChatManifest
+
+# 各会话目录的清单索引，会话列表不再逐个 stat 文件
+_manifest = ChatManifest()
+
+def get_history_chats(path: str, offset: int = 0, limit: int = None) -> list:
     os.makedirs(path, exist_ok=True)
-    files = [f for f in os.listdir(path) if f.endswith('.json')]
-    files_with_time = [(f, os.stat(os.path.join(path, f)).st_ctime) for f in files]
-    sorted_files = sorted(files_with_time, key=lambda x: x[1], reverse=True)
-    chat_names = [os.path.splitext(f[0])[0] for f in sorted_files]
-    return chat_names
+    return [info.chat for info in _manifest.list(path, offset, limit)]
 
 def save_data(path: str, file_name: str, history: list, paras: dict, contexts: dict, **kwargs):
     os.makedirs(path, exist_ok=True)
-    with open(os.path.join(path, f"{file_name}.json"), 'w', encoding='utf-8') as f:
-        json.dump({"history": history, "paras": paras, "contexts": contexts, **kwargs}, f)
+    file_path = os.path.join(path, f"{file_name}.json")
+    with file_lock(file_path):
+        atomic_write_json(file_path, {"history": history, "paras": paras, "contexts": contexts, **kwargs})
+    _manifest.update(path, file_name, history, os.path.getsize(file_path))
 
 def load_data(path: str, file_name: str) -> dict:
     try:
@@ -28,6 +32,7 @@ def remove_data(path: str, chat_name: str):
         os.remove(os.path.join(path, f"{chat_name}.json"))
     except FileNotFoundError:
         pass
+    _manifest.remove(path, chat_name)
 
     # 清除缓存
     try:
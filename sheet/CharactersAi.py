@@ -1,9 +1,14 @@
 import os
 import json
-import requests
+from tools import http_client
 import streamlit as st
 import threading
 from tools.chat_histor import save_data, load_data, get_history_chats, remove_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages, continue_button
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
+from tools.atomic_io import atomic_write_json, file_lock
 
 API_KEY = st.secrets["api"]["Baichuan_key"]
 BASE_URL = "https://api.baichuan-ai.com/v1"
@@ -16,47 +21,32 @@ def load_characters():
     return {}
 
 def save_characters(characters):
-    with open(CHARACTERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(characters, f, ensure_ascii=False, indent=4)
+    with file_lock(CHARACTERS_FILE):
+        atomic_write_json(CHARACTERS_FILE, characters, backup=True, ensure_ascii=False, indent=4)
 
 def stream_response(api_key, model, character_id, message_history, username):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     data = {
         "model": model,
         "character_profile": {"character_id": character_id},
-        "messages": message_history,
+        "messages": api_messages(message_history),
         "temperature": st.session_state.get("temperature", 0.9),  # 默认值设置为0.9
         "top_p": st.session_state.get("top_p", 0.3),
         "stream": True
     }
-    response = requests.post(f"{BASE_URL}/chat/completions", headers=headers, json=data, stream=True)
+    timer = start_completion("Baichuan", model, "CharactersAi", username)
+    response = http_client.post(f"{BASE_URL}/chat/completions", headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-
-        for chunk in response.iter_lines(decode_unicode=False):
-            if chunk:
-                chunk = chunk.decode('utf-8')
-                if chunk.startswith("data: "):
-                    chunk_data = chunk[len("data: "):].strip()
-                    if chunk_data == "[DONE]":
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        chunk_message = chunk_json['choices'][0]['delta']
-                        if 'content' in chunk_message and chunk_message['content']:
-                            assistant_content += chunk_message['content']
-                            assistant_response.markdown(assistant_content)
-                    except json.JSONDecodeError as e:
-                        st.error(f"JSONDecodeError: {e}")
-                        continue
+        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
 def main(__login__obj):
@@ -122,10 +112,12 @@ def main(__login__obj):
     for msg in st.session_state["messages"]:
         st.chat_message(msg["role"]).write(msg["content"])
 
-    if prompt := st.chat_input("输入你的消息："):
-        if prompt.strip():
-            st.session_state["messages"].append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
+    resume = continue_button()
+    if (prompt := st.chat_input("输入你的消息：")) or resume:
+        if resume or prompt.strip():
+            if not resume:
+                st.session_state["messages"].append({"role": "user", "content": prompt})
+                st.chat_message("user").write(prompt)
 
             headers = {
                 "Authorization": f"Bearer {api_key}",
@@ -135,39 +127,24 @@ def main(__login__obj):
             data = {
                 "model": model,
                 "character_profile": {"character_id": character_id},
-                "messages": st.session_state["messages"],
+                "messages": api_messages(st.session_state["messages"]),
                 "temperature": st.session_state.get("temperature", 0.9),  # 确保设置了默认温度值
                 "stream": True
             }
 
-            response = requests.post(f"{base_url}/chat/completions", headers=headers, json=data, stream=True)
+            timer = start_completion("Baichuan", model, "CharactersAi", username)
+            response = http_client.post(f"{base_url}/chat/completions", headers=headers, json=data, stream=True)
 
             if response.status_code == 200:
                 assistant_response = st.empty()
-                assistant_content = ""
-
-                for chunk in response.iter_lines(decode_unicode=False):
-                    if chunk:
-                        chunk = chunk.decode('utf-8')
-                        if chunk.startswith("data: "):
-                            chunk_data = chunk[len("data: "):].strip()
-                            if chunk_data == "[DONE]":
-                                break
-                            try:
-                                chunk_json = json.loads(chunk_data)
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    assistant_content += chunk_message['content']
-                                    assistant_response.markdown(assistant_content)
-                            except json.JSONDecodeError as e:
-                                st.error(f"JSONDecodeError: {e}")
-                                continue
+                assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer)
                 if assistant_content.strip():
                     st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                     if st.session_state["chat_name"]:
                         save_data(username, st.session_state["chat_name"], st.session_state["messages"])
                     st.experimental_rerun()  # 重新加载页面以确保组件正确渲染
             else:
+                timer.fail(response.status_code)
                 st.error(f"Error: {response.status_code}, {response.text}")
 
             if st.session_state["chat_name"]:
@@ -1,5 +1,6 @@
 import streamlit as st
-import requests
+from tools import http_client
+from tools.atomic_io import atomic_write_json, file_lock
 import json
 
 # 设置 API Key 和 URL
@@ -14,7 +15,7 @@ def create_npc(data):
         "Content-Type": "application/json",
         "Authorization": f"Bearer {API_KEY}"
     }
-    response = requests.post(API_URL, data=json.dumps(data), headers=headers, timeout=60)
+    response = http_client.post(API_URL, data=json.dumps(data), headers=headers, timeout=60)
     return response
 
 
@@ -30,18 +31,18 @@ def display_response(response):
 
 # 将新角色信息写入到 JSON 文件
 def write_to_json(file_path, character_name, character_id, character_description):
-    with open(file_path, 'r+', encoding='utf-8') as file:
+    # 读改写期间持有文件锁，多个页面同时创建角色时不会互相覆盖
+    with file_lock(file_path):
         # 加载现有的 JSON 数据
-        data = json.load(file)
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
         # 更新自定义角色部分
         data['自定义角色'][character_name] = {
             "id": character_id,
             "description": character_description
         }
-        # 将更新后的数据写回到文件
-        file.seek(0)
-        json.dump(data, file, ensure_ascii=False, indent=4)
-        file.truncate()
+        # 先写临时文件再替换，写到一半崩溃也不会留下残缺的文件
+        atomic_write_json(file_path, data, backup=True, ensure_ascii=False, indent=4)
 
 
 # Streamlit 页面
@@ -1,12 +1,15 @@
 import os
 from PIL import Image
-import requests
-import json
+from tools import http_client
 import streamlit as st
 import threading
 import sounddevice as sd
 import wavio
 from tools.chat_histor import save_data, load_data, get_history_chats, remove_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages, continue_button
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
 import re
 
 def strip_sup_tags(text):
@@ -34,7 +37,7 @@ def transcribe_audio(file_path):
         "model": (None, "whisper-1")
     }
 
-    response = requests.post(url, headers=headers, files=files)
+    response = http_client.post(url, headers=headers, files=files)
 
     if response.status_code == 200:
         return response.json().get('text', '')
@@ -43,37 +46,20 @@ def transcribe_audio(file_path):
 
 def yi_stream_response(api_key, model, message_history, username):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {"model": model, "messages": message_history, "temperature": st.session_state.get("temperature", 0.9), "top_p": st.session_state.get("top_p", 0.3), "stream": True}
-    response = requests.post(f"https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data, stream=True)
+    data = {"model": model, "messages": api_messages(message_history), "temperature": st.session_state.get("temperature", 0.9), "top_p": st.session_state.get("top_p", 0.3), "stream": True}
+    timer = start_completion("Yi", model, "Doctor", username)
+    response = http_client.post(f"https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-
-        for chunk in response.iter_lines(decode_unicode=False):
-            if chunk:
-                chunk = chunk.decode('utf-8')
-                if chunk.startswith("data: "):
-                    chunk_data = chunk[len("data: "):].strip()
-                    if chunk_data == "[DONE]":
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        chunk_message = chunk_json['choices'][0]['delta']
-                        if 'content' in chunk_message and chunk_message['content']:
-                            assistant_content += chunk_message['content']
-                            # Remove <sup> tags
-                            cleaned_content = strip_sup_tags(assistant_content)
-                            assistant_response.markdown(cleaned_content)
-                    except json.JSONDecodeError as e:
-                        st.error(f"JSONDecodeError: {e}")
-                        continue
+        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, transform=strip_sup_tags, timer=timer)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": strip_sup_tags(assistant_content)})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
 def handle_audio_input(api_key, message_history, username):
@@ -123,39 +109,25 @@ def handle_ai_task(prompt, task_type, messages, stream=True):
 
     data = {
         "model": "yi-large-rag",
-        "messages": messages + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
+        "messages": api_messages(messages) + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
         "temperature": 0.9,
         "top_p": 0.3,
         "stream": stream,
         "max_tokens": 4096  # 设置最大输出长度为4096
     }
 
-    response = requests.post("https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data, stream=stream)
+    timer = start_completion("Yi", data["model"], "Doctor")
+    response = http_client.post("https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data, stream=stream)
 
     if response.status_code == 200:
         if stream:
-            assistant_content = ""
             assistant_response = st.empty()
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            chunk_message = chunk_json['choices'][0]['delta']
-                            if 'content' in chunk_message and chunk_message['content']:
-                                assistant_content += chunk_message['content']
-                                assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer)
             return assistant_content
         else:
             return response.json()['choices'][0]['message']['content']
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
         return None
 
@@ -258,10 +230,12 @@ def main(__login__obj):
     for msg in st.session_state["messages"]:
         st.chat_message(msg["role"]).write(msg["content"])
 
-    if prompt := st.chat_input("输入你的消息："):
-        if prompt.strip():  # 确保输入内容非空
-            st.session_state["messages"].append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
+    resume = continue_button()
+    if (prompt := st.chat_input("输入你的消息：")) or resume:
+        if resume or prompt.strip():  # 确保输入内容非空
+            if not resume:
+                st.session_state["messages"].append({"role": "user", "content": prompt})
+                st.chat_message("user").write(prompt)
             yi_stream_response(YI_API_KEY, "yi-large-rag", st.session_state["messages"], username)
             save_data(username, st.session_state["chat_name"], st.session_state["messages"])
 
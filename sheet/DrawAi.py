@@ -1,6 +1,5 @@
 import streamlit as st
 import time
-import requests
 from datetime import datetime
 from wsgiref.handlers import format_date_time
 from time import mktime
@@ -9,7 +8,7 @@ import base64
 import hmac
 from urllib.parse import urlencode
 import json
-import requests
+from tools import http_client
 from barfi import Block
 from io import BytesIO
 from PIL import Image
@@ -34,7 +33,7 @@ def generate_image_agi_sky(api_key, api_secret, prompt):
         "content": prompt
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -153,7 +152,7 @@ def request_image(text, appid, apikey, apisecret):
     host = 'http://spark-api.cn-huabei-1.xf-yun.com/v2.1/tti'
     url = assemble_ws_auth_url(host, method='POST', api_key=apikey, api_secret=apisecret)
     content = getBody(appid, text)
-    response = requests.post(url, json=content, headers={'content-type': "application/json"}).text
+    response = http_client.post(url, json=content, headers={'content-type': "application/json"}).text
     return response
 
 
@@ -178,7 +177,7 @@ def generate_image_agi_sky(api_key, api_secret, prompt):
         "content": prompt
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -202,7 +201,7 @@ def generate_image_cogview(api_key, model_name, prompt):
         "prompt": prompt
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = http_client.post(url, headers=headers, data=json.dumps(payload))
 
     if response.status_code == 200:
         response_data = response.json()
@@ -273,7 +272,7 @@ def main(__login__obj):
                     st.image(image_url, caption=f"生成的图片 (使用 {api_choice})", use_column_width=True)
 
                     # 下载图片
-                    response = requests.get(image_url)
+                    response = http_client.get(image_url)
                     img = Image.open(BytesIO(response.content))
                     buffered = BytesIO()
                     img.save(buffered, format="JPEG")
@@ -293,7 +292,7 @@ def main(__login__obj):
                     st.image(image_url, caption=f"生成的图片 (使用 {api_choice})", use_column_width=True)
 
                     # 下载图片
-                    response = requests.get(image_url)
+                    response = http_client.get(image_url)
                     img = Image.open(BytesIO(response.content))
                     buffered = BytesIO()
                     img.save(buffered, format="JPEG")
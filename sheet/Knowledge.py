@@ -1,10 +1,17 @@
 import os
 import json
 import requests
+from tools import http_client
 import streamlit as st
 import threading
 import re
 from tools.chat_histor import save_data, load_data, get_history_chats, remove_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
+from tools.response_cache import replay
+from tools.semantic_cache import get_semantic_cache
 from tools.audio_recognition import transcribe_audio, record_audio
 
 API_KEY = st.secrets["api"]["Baichuan_key"]
@@ -17,7 +24,7 @@ def list_knowledge_bases():
     headers = {
         "Authorization": f"Bearer {API_KEY}"
     }
-    response = requests.get(KNOWLEDGE_BASES_URL, headers=headers)
+    response = http_client.get(KNOWLEDGE_BASES_URL, headers=headers)
     if response.status_code == 200:
         return response.json().get("data", [])
     else:
@@ -33,7 +40,7 @@ def upload_file(file, purpose):
         "file": file,
         "purpose": (None, purpose)
     }
-    response = requests.post(UPLOAD_FILE_URL, headers=headers, files=files)
+    response = http_client.post(UPLOAD_FILE_URL, headers=headers, files=files)
     if response.status_code == 200:
         return response.json()
     else:
@@ -45,7 +52,7 @@ def get_parsed_content(file_id):
     headers = {
         "Authorization": f"Bearer {API_KEY}"
     }
-    response = requests.get(f"{UPLOAD_FILE_URL}/{file_id}/parsed-content", headers=headers)
+    response = http_client.get(f"{UPLOAD_FILE_URL}/{file_id}/parsed-content", headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -59,7 +66,7 @@ def create_kb(data):
         "Authorization": f"Bearer {API_KEY}"
     }
     try:
-        response = requests.post(KNOWLEDGE_BASES_URL, data=json.dumps(data), headers=headers, timeout=30)
+        response = http_client.post(KNOWLEDGE_BASES_URL, data=json.dumps(data), headers=headers, timeout=30)
         return response
     except requests.exceptions.RequestException as e:
         st.error(f"创建知识库时发生错误: {e}")
@@ -74,7 +81,7 @@ def associate_file_with_kb(kb_id, file_ids):
     url = f"{KNOWLEDGE_BASES_URL}/{kb_id}/files"
     data = {"file_ids": file_ids}
     try:
-        response = requests.post(url, data=json.dumps(data), headers=headers, timeout=30)
+        response = http_client.post(url, data=json.dumps(data), headers=headers, timeout=30)
         return response
     except requests.exceptions.RequestException as e:
         st.error(f"关联文件到知识库时发生错误: {e}")
@@ -115,7 +122,7 @@ def ask_question(question, kb_ids, use_knowledge_base_only, use_web_search):
         "stream": True
     }
 
-    response = requests.post(CHAT_COMPLETION_URL, json=data, headers=headers, stream=True)
+    response = http_client.post(CHAT_COMPLETION_URL, json=data, headers=headers, stream=True)
     return response
 
 
@@ -147,35 +154,20 @@ def handle_audio_input(api_key, chosen_model, message_history, username):
 
 def stream_response(api_key, model, message_history, username):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {"model": model, "messages": message_history, "stream": True}
-    response = requests.post(CHAT_COMPLETION_URL, headers=headers, json=data, stream=True)
+    data = {"model": model, "messages": api_messages(message_history), "stream": True}
+    timer = start_completion("Baichuan", model, "Knowledge", username)
+    response = http_client.post(CHAT_COMPLETION_URL, headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-
-        for chunk in response.iter_lines(decode_unicode=False):
-            if chunk:
-                chunk = chunk.decode('utf-8')
-                if chunk.startswith("data: "):
-                    chunk_data = chunk[len("data: "):].strip()
-                    if chunk_data == "[DONE]":
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        chunk_message = chunk_json['choices'][0]['delta']
-                        if 'content' in chunk_message and chunk_message['content']:
-                            assistant_content += chunk_message['content']
-                            assistant_response.markdown(assistant_content)
-                    except json.JSONDecodeError as e:
-                        st.error(f"JSONDecodeError: {e}")
-                        continue
+        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
 
@@ -306,9 +298,9 @@ def main(__login__obj):
                     associate_response = associate_file_with_kb(kb_id, [file_id])
                     if associate_response and associate_response.status_code == 200:
                         st.success("文件成功关联到知识库！")
-                    else:
+                    elif associate_response is not None:
                         st.error(f"文件关联到知识库失败: {associate_response.status_code}, {associate_response.text}")
-                else:
+                elif response is not None:
                     st.error(f"知识库创建失败: {response.status_code}, {response.text}")
             else:
                 st.error(f"文件上传失败: {result['status_code']}, {result['text']}")
@@ -320,36 +312,41 @@ def main(__login__obj):
 
             kb_ids = [st.session_state["selected_kb"]] if st.session_state["selected_kb"] else []
 
+            # 问题只和模型、知识库与检索开关一起发给服务商，相同设置下的相似问题可以复用回答
+            scope = "|".join(map(str, [st.session_state["current_model_Bai"], kb_ids,
+                                       st.session_state["use_knowledge_base_only"],
+                                       st.session_state["use_web_search"]]))
+            cache = get_semantic_cache("Knowledge", scope)
+            hit = cache.lookup(prompt)
+            if hit is not None:
+                st.caption(f"⚡ 与之前的问题“{hit.question}”相似（相似度 {hit.score:.2f}），直接使用已有回答")
+                assistant_content = render_deltas(replay(hit.answer), st.empty(), resumable=False)
+                if assistant_content.strip():
+                    st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
+                    if st.session_state["chat_name"]:
+                        save_data(username, st.session_state["chat_name"], st.session_state["messages"])
+                    st.experimental_rerun()
+                st.stop()
+
+            timer = start_completion("Baichuan", st.session_state["current_model_Bai"], "Knowledge", username)
             response = ask_question(prompt, kb_ids,
                                     st.session_state["use_knowledge_base_only"],
                                     st.session_state["use_web_search"])
 
             if response and response.status_code == 200:
                 assistant_response = st.empty()
-                assistant_content = ""
-
-                for chunk in response.iter_lines(decode_unicode=False):
-                    if chunk:
-                        chunk = chunk.decode('utf-8')
-                        if chunk.startswith("data: "):
-                            chunk_data = chunk[len("data: "):].strip()
-                            if chunk_data == "[DONE]":
-                                break
-                            try:
-                                chunk_json = json.loads(chunk_data)
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    assistant_content += chunk_message['content']
-                                    assistant_response.markdown(assistant_content)
-                            except json.JSONDecodeError as e:
-                                st.error(f"JSONDecodeError: {e}")
-                                continue
+                assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
                 if assistant_content.strip():
+                    cache.add(prompt, assistant_content)
                     st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                     if st.session_state["chat_name"]:
                         save_data(username, st.session_state["chat_name"], st.session_state["messages"])
                     st.experimental_rerun()  # 重新加载页面以确保组件正确渲染
+            elif response is None:
+                timer.fail("connect_error")
+                st.error("Error: 请求失败，未收到服务器响应")
             else:
+                timer.fail(response.status_code)
                 st.error(f"Error: {response.status_code}, {response.text}")
 
         if st.session_state["chat_name"]:
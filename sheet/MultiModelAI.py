@@ -1,11 +1,17 @@
-import json
 import os
 import streamlit as st
-import requests
+from tools import http_client
 import threading
 
 from libs.contexts import set_context
 from tools.chat_histor import get_history_chats, save_data, load_data, remove_data
+from tools.failover import assistant_message, stream_with_failover
+from tools.hedging import HedgeTarget, hedge
+from tools.model_router import get_model_registry, route, show_decision
+from tools.prompt_router import (choose_model, classify, last_user_content, light_routing_enabled,
+                                 light_routing_toggle, show_choice)
+from tools.stream_control import api_messages, continue_button
+from tools.stream_render import render_deltas
 from tools.file_upload import handle_file_upload
 from tools.audio_recognition import transcribe_audio, record_audio
 
@@ -27,6 +33,46 @@ MODEL_API_KEYS = {
     "Baichuan": st.secrets["api"]["Baichuan_key"]
 }
 
+# 各模型类别请求失败时依次切换的服务商，可在 secrets.toml 的 [failover] chains 中覆盖
+FALLBACK_CHAINS = {
+    "GPT": ["Deepseek", "Moonshot"],
+    "Deepseek": ["Yi", "Moonshot"],
+    "Yi": ["Deepseek", "Moonshot"],
+    "Moonshot": ["Deepseek", "Yi"],
+    "Baichuan": ["Deepseek", "Yi"]
+}
+FALLBACK_CHAINS.update(st.secrets.get("failover", {}).get("chains", {}))
+
+# 模型类别中的“自动”选项：按场景档位、上下文长度与实时延迟选择模型
+AUTO_ROUTE = "自动"
+
+# 切换到其他服务商时使用的模型
+FALLBACK_MODELS = {
+    "GPT": "gpt-4o",
+    "Deepseek": "deepseek-chat",
+    "Yi": "yi-large",
+    "Moonshot": "moonshot-v1-32k",
+    "Baichuan": "Baichuan4"
+}
+
+
+def failover_candidates(category, model):
+    """所选模型排在最前，其后是该类别的备用服务商"""
+    chain = [(category, model)] + [(c, FALLBACK_MODELS[c]) for c in FALLBACK_CHAINS.get(category, []) if c != category]
+    return [(c, m, MODEL_API_URLS[c], MODEL_API_KEYS[c]) for c, m in chain if c in MODEL_API_URLS and MODEL_API_KEYS.get(c)]
+
+
+def hedge_targets(candidates, result, payload):
+    """对冲请求依次选用实际建立连接的服务商之后的备用服务商"""
+    providers = [c[0] for c in candidates]
+    rest = candidates[providers.index(result.provider) + 1:]
+    return [HedgeTarget(provider, model, url, key, payload) for provider, model, url, key in rest]
+
+
+def show_failover(result):
+    if result.reasons and result.provider:
+        st.info(f"已切换到 {result.provider} - {result.model}（{'；'.join(result.reasons)}）")
+
 def handle_audio_input(api_key, message_history, username):
     if 'is_recording' not in st.session_state:
         st.session_state['is_recording'] = False
@@ -56,43 +102,27 @@ def handle_audio_input(api_key, message_history, username):
 
 def stream_response(api_key, chosen_model, message_history, username):
     try:
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        data = {"model": chosen_model, "messages": message_history, "stream": True}
-
-        url = MODEL_API_URLS.get("Deepseek")
-        if not url:
-            raise ValueError(f"无效的模型: {chosen_model}")
-
-        response = requests.post(url, headers=headers, json=data, stream=True)
-
-        if response.status_code == 200:
+        data = {"messages": api_messages(message_history), "stream": True}
+        candidates = [("Deepseek", chosen_model, MODEL_API_URLS["Deepseek"], api_key)]
+        candidates += failover_candidates("Deepseek", chosen_model)[1:]
+        result = stream_with_failover(candidates, data, "MultiModelAI", username)
+        response = result.response
+
+        if response is not None and response.status_code == 200:
+            if st.session_state.get("hedging"):
+                result = hedge(result, hedge_targets(candidates, result, data), "MultiModelAI", username)
+            show_failover(result)
             assistant_response = st.empty()
-            assistant_content = ""
-
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            if 'choices' in chunk_json and chunk_json['choices']:
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    assistant_content += chunk_message['content']
-                                    assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(result.response, assistant_response, timer=result.timer)
             if assistant_content.strip():
-                st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
+                st.session_state["messages"].append(assistant_message(assistant_content, result))
                 if st.session_state["chat_name"]:
                     save_data(username, st.session_state["chat_name"], message_history)
                 st.experimental_rerun()
-        else:
+        elif response is not None:
             st.error(f"Error: {response.status_code}, {response.text}")
+        else:
+            st.error(f"所有服务商均不可用: {'；'.join(result.reasons)}")
     except Exception as e:
         st.error(f"请求过程中出现错误: {e}")
 
@@ -107,7 +137,7 @@ def transcribe_audio(file_path):
         "model": (None, "whisper-1")
     }
 
-    response = requests.post(url, headers=headers, files=files)
+    response = http_client.post(url, headers=headers, files=files)
 
     if response.status_code == 200:
         return response.json().get('text', '')
@@ -125,6 +155,8 @@ def main(__login__obj):
         st.session_state["preset_sent"] = False
 
     message_history = st.session_state["messages"]
+    # 尽早创建模型注册表，让它从第一条补全记录开始统计延迟
+    get_model_registry()
 
     with st.sidebar:
         st.title("聊天设置")
@@ -170,37 +202,37 @@ def main(__login__obj):
                          "Baichuan2-Turbo-192k"]
         }
 
+        category_names = list(model_options.keys()) + [AUTO_ROUTE]
         if "current_model_category" not in st.session_state or st.session_state[
-            "current_model_category"] not in model_options:
+            "current_model_category"] not in category_names:
             st.session_state["current_model_category"] = "GPT"
-        if "current_model_chat" not in st.session_state or st.session_state["current_model_chat"] not in model_options[
-            st.session_state["current_model_category"]]:
-            st.session_state["current_model_chat"] = model_options[st.session_state["current_model_category"]][0]
 
-        chosen_category = st.selectbox("选择模型类别", list(model_options.keys()),
-                                       index=list(model_options.keys()).index(
-                                           st.session_state["current_model_category"]))
+        chosen_category = st.selectbox("选择模型类别", category_names,
+                                       index=category_names.index(st.session_state["current_model_category"]))
 
-        if st.session_state["current_model_chat"] not in model_options[chosen_category]:
-            st.session_state["current_model_chat"] = model_options[chosen_category][0]
+        if chosen_category == AUTO_ROUTE:
+            chosen_model = AUTO_ROUTE
+        else:
+            if st.session_state.get("current_model_chat") not in model_options[chosen_category]:
+                st.session_state["current_model_chat"] = model_options[chosen_category][0]
 
-        chosen_model = st.selectbox("选择型号", model_options[chosen_category],
-                                    index=model_options[chosen_category].index(st.session_state["current_model_chat"]))
+            chosen_model = st.selectbox("选择型号", model_options[chosen_category],
+                                        index=model_options[chosen_category].index(st.session_state["current_model_chat"]))
 
         st.session_state["current_model_category"] = chosen_category
         st.session_state["current_model_chat"] = chosen_model
 
         scene_options = {
-            "日常对话": {"max_tokens": 512, "top_p": 0.8, "temperature": 0.7},
-            "写代码": {"max_tokens": 2048, "top_p": 0.3, "temperature": 0.2},
-            "短文本生成": {"max_tokens": 1024, "top_p": 0.5, "temperature": 0.5},
-            "文章生成": {"max_tokens": 2048, "top_p": 0.7, "temperature": 0.6},
-            "创作诗歌或故事": {"max_tokens": 2048, "top_p": 0.9, "temperature": 1.0},
-            "长篇小说": {"max_tokens": 4096, "top_p": 0.9, "temperature": 1.2},
-            "技术问答": {"max_tokens": 1024, "top_p": 0.4, "temperature": 0.3},
-            "产品推荐": {"max_tokens": 1024, "top_p": 0.6, "temperature": 0.5},
-            "新闻摘要": {"max_tokens": 1024, "top_p": 0.7, "temperature": 0.6},
-            "客户支持": {"max_tokens": 1024, "top_p": 0.5, "temperature": 0.4}
+            "日常对话": {"max_tokens": 512, "top_p": 0.8, "temperature": 0.7, "tier": 1},
+            "写代码": {"max_tokens": 2048, "top_p": 0.3, "temperature": 0.2, "tier": 3},
+            "短文本生成": {"max_tokens": 1024, "top_p": 0.5, "temperature": 0.5, "tier": 1},
+            "文章生成": {"max_tokens": 2048, "top_p": 0.7, "temperature": 0.6, "tier": 2},
+            "创作诗歌或故事": {"max_tokens": 2048, "top_p": 0.9, "temperature": 1.0, "tier": 2},
+            "长篇小说": {"max_tokens": 4096, "top_p": 0.9, "temperature": 1.2, "tier": 2},
+            "技术问答": {"max_tokens": 1024, "top_p": 0.4, "temperature": 0.3, "tier": 3},
+            "产品推荐": {"max_tokens": 1024, "top_p": 0.6, "temperature": 0.5, "tier": 1},
+            "新闻摘要": {"max_tokens": 1024, "top_p": 0.7, "temperature": 0.6, "tier": 2},
+            "客户支持": {"max_tokens": 1024, "top_p": 0.5, "temperature": 0.4, "tier": 1}
         }
 
         chosen_scene = st.selectbox("选择应用场景", list(scene_options.keys()), index=0)
@@ -209,6 +241,10 @@ def main(__login__obj):
         top_p = scene_options[chosen_scene]["top_p"]
         temperature = scene_options[chosen_scene]["temperature"]
 
+        light_routing_toggle()
+        st.session_state["hedging"] = st.checkbox("对冲请求", value=st.session_state.get("hedging", False),
+                                                  help="首字迟迟未到时同时向备用服务商发送一份请求，先返回的一路胜出")
+
         use_preset = st.checkbox("使用预设角色")
         if use_preset:
             chosen_role = st.selectbox("选择预设角色", ["请选择"] + list(set_context.keys()))
@@ -225,64 +261,75 @@ def main(__login__obj):
         st.chat_message(msg["role"]).write(msg["content"])
 
 
-    if prompt := st.chat_input("输入您的消息:"):
+    resume = continue_button()
+    if (prompt := st.chat_input("输入您的消息:")) or resume:
         chosen_category = st.session_state["current_model_category"]
         chosen_model = st.session_state["current_model_chat"]
+        decision = None
+        complexity = None
+        pending = message_history if resume else message_history + [{"role": "user", "content": prompt}]
+        if chosen_category == AUTO_ROUTE:
+            available = [(c, m) for c, models in model_options.items() if MODEL_API_KEYS.get(c) for m in models]
+            tier = scene_options[chosen_scene]["tier"]
+            if light_routing_enabled():
+                # 简单问题只要求基础档位，让路由在更快的小模型中挑选
+                complexity = classify(last_user_content(pending), chosen_scene, pending)
+                if complexity.level == "simple":
+                    tier = 1
+            decision = route(available, tier, pending, max_tokens)
+            if decision is None:
+                st.error("没有可用的模型")
+                st.stop()
+            chosen_category, chosen_model = decision.category, decision.model
+        elif light_routing_enabled() and chosen_model == model_options[chosen_category][0]:
+            # 只替换类别的默认模型，用户手动选择的型号原样使用
+            routed, complexity = choose_model(chosen_category, chosen_model, last_user_content(pending),
+                                              chosen_scene, pending)
+            if routed in model_options[chosen_category]:
+                chosen_model = routed
         api_key = MODEL_API_KEYS[chosen_category]
 
         if not api_key:
             st.stop()
 
         with st.spinner("处理中..."):
-            message_history.append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
+            if not resume:
+                message_history.append({"role": "user", "content": prompt})
+                st.chat_message("user").write(prompt)
+            if complexity is not None:
+                show_choice(chosen_model, complexity)
+            if decision is not None:
+                show_decision(decision)
 
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
 
-            chat_url = MODEL_API_URLS[chosen_category]
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}'
-            }
             data = {
-                "model": chosen_model,
-                "messages": message_history,
+                "messages": api_messages(message_history),
                 "max_tokens": max_tokens,
                 "top_p": top_p,
                 "temperature": temperature,
                 "stream": True
             }
-            response = requests.post(chat_url, json=data, headers=headers, stream=True)
-
-            if response.status_code == 200:
+            candidates = failover_candidates(chosen_category, chosen_model)
+            result = stream_with_failover(candidates, data, "MultiModelAI", username)
+            response = result.response
+
+            if response is not None and response.status_code == 200:
+                if st.session_state.get("hedging"):
+                    result = hedge(result, hedge_targets(candidates, result, data), "MultiModelAI", username)
+                show_failover(result)
                 assistant_response = st.empty()
-                assistant_content = ""
-
-                for chunk in response.iter_lines(decode_unicode=False):
-                    if chunk:
-                        chunk = chunk.decode('utf-8')
-                        if chunk.startswith("data: "):
-                            chunk_data = chunk[len("data: "):].strip()
-                            if chunk_data == "[DONE]":
-                                break
-                            try:
-                                chunk_json = json.loads(chunk_data)
-                                if 'choices' in chunk_json and chunk_json['choices']:
-                                    chunk_message = chunk_json['choices'][0]['delta']
-                                    if 'content' in chunk_message and chunk_message['content']:
-                                        assistant_content += chunk_message['content']
-                                        assistant_response.markdown(assistant_content)
-                            except json.JSONDecodeError as e:
-                                st.error(f"JSONDecodeError: {e}")
-                                continue
+                assistant_content = render_deltas(result.response, assistant_response, timer=result.timer)
                 if assistant_content.strip():
-                    st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
+                    st.session_state["messages"].append(assistant_message(assistant_content, result))
                     if st.session_state["chat_name"]:
                         save_data(username, st.session_state["chat_name"], st.session_state["messages"])
                     st.experimental_rerun()
-            else:
+            elif response is not None:
                 st.error(f"Failed to fetch response from AI API: {response.status_code}, {response.text}")
+            else:
+                st.error(f"所有服务商均不可用: {'；'.join(result.reasons)}")
 
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
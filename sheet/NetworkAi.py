@@ -2,13 +2,18 @@ import hashlib
 import os
 import time
 
-import requests
-import json
+from tools import http_client
 import streamlit as st
 import threading
 import sounddevice as sd
 import wavio
 from tools.chat_histor import save_data, load_data, get_history_chats, remove_data
+from tools.sse_stream import iter_deltas, tiangong_extractor
+from tools.stream_control import api_messages, continue_button
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
+from tools.failover import assistant_message, stream_with_failover
+from tools.hedging import HedgeTarget, hedge
 
 # 设置 API Key
 API_KEY = st.secrets["api"]["bianxie_key"]
@@ -17,6 +22,7 @@ TIANGONG_APP_SECRET = st.secrets["api"]["Tiangong_secret"]
 YI_API_KEY = st.secrets["api"]["Yi_key"]
 BAICHUAN_API_KEY = st.secrets["api"]["Baichuan_key"]
 BAICHUAN_API_URL = "https://api.baichuan-ai.com/v1/"
+YI_API_URL = "https://api.lingyiwanwu.com/v1/chat/completions"
 
 def record_audio(file_path, duration=10, fs=44100):
     """录音函数，将录音保存到指定文件路径"""
@@ -35,7 +41,7 @@ def transcribe_audio(file_path):
         "model": (None, "whisper-1")
     }
 
-    response = requests.post(url, headers=headers, files=files)
+    response = http_client.post(url, headers=headers, files=files)
 
     if response.status_code == 200:
         return response.json().get('text', '')
@@ -67,7 +73,7 @@ def stream_response(app_key, app_secret, message_history, username, prompt):
     }
 
     data = {
-        "messages": message_history,
+        "messages": api_messages(message_history),
         "intent": "",
         "max_tokens": st.session_state.get("max_tokens", 2048),
         "top_p": st.session_state.get("top_p", 0.9),
@@ -75,119 +81,111 @@ def stream_response(app_key, app_secret, message_history, username, prompt):
     }
 
     url = 'https://api-maas.singularity-ai.com/sky-work/api/v1/chat'
-    response = requests.post(url, headers=headers, json=data, stream=True)
+    timer = start_completion("Tiangong", "SkyChat-3.0", "NetworkAi", username)
+    response = http_client.post(url, headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-        seen_texts = set()
-
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8').strip()
-                if line.startswith("data: "):
-                    line = line[len("data: "):].strip()
-                if line == "[DONE]":
-                    break
-                if not line:
-                    continue
-                try:
-                    chunk_json = json.loads(line)
-                    if 'arguments' in chunk_json and 'messages' in chunk_json['arguments'][0]:
-                        for message in chunk_json['arguments'][0]['messages']:
-                            if 'text' in message:
-                                if message['text'] not in seen_texts:
-                                    seen_texts.add(message['text'])
-                                    assistant_content += message['text']
-                                    formatted_content = format_response(assistant_content)
-                                    assistant_response.markdown(formatted_content)
-                except json.JSONDecodeError as e:
-                    st.error(f"JSONDecodeError: {e}")
-                    st.write(line)
+        assistant_content = render_deltas(iter_deltas(response, extract=tiangong_extractor(), lenient=True, timer=timer), assistant_response, transform=format_response, timer=timer)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
+def yi_payload(model, message_history):
+    return {"model": model, "messages": api_messages(message_history), "temperature": st.session_state.get("temperature", 0.9), "top_p": st.session_state.get("top_p", 0.3), "stream": True}
+
+BAICHUAN_WEB_SEARCH = [{
+    "type": "web_search",
+    "web_search": {
+        "enable": True,
+        "search_mode": "performance_first"
+    }
+}]
+
+def baichuan_payload(model, message_history):
+    return {
+        "model": model,
+        "messages": api_messages(message_history),
+        "temperature": st.session_state.get("temperature", 0.3),
+        "stream": True,
+        "tools": BAICHUAN_WEB_SEARCH
+    }
+
+def backup_target(provider, model, url, api_key, data):
+    """对冲请求与首选请求发送相同的消息与采样参数，只换模型，并按服务商补上联网方式
+    （百川需要 web_search 工具，yi-large-rag 自带检索）"""
+    payload = {k: v for k, v in data.items() if k != "tools"}
+    payload["model"] = model
+    if provider == "Baichuan":
+        payload["tools"] = BAICHUAN_WEB_SEARCH
+    return HedgeTarget(provider, model, url, api_key, payload)
+
+def hedged_stream_response(primary, backup, message_history, username):
+    """开启对冲请求时走异步客户端：首字超过预算后同时请求另一个联网模型，先返回的一路胜出"""
+    result = stream_with_failover([primary[:4]], primary.payload, "NetworkAi", username)
+    response = result.response
+
+    if response is not None and response.status_code == 200:
+        result = hedge(result, [backup], "NetworkAi", username)
+        assistant_response = st.empty()
+        assistant_content = render_deltas(result.response, assistant_response, timer=result.timer)
+        if assistant_content.strip():
+            st.session_state["messages"].append(assistant_message(assistant_content, result))
+            if st.session_state["chat_name"]:
+                save_data(username, st.session_state["chat_name"], message_history)
+            st.experimental_rerun()
+    elif response is not None:
+        st.error(f"Error: {response.status_code}, {response.text}")
+    else:
+        st.error(f"请求失败: {'；'.join(result.reasons)}")
+
 def yi_stream_response(api_key, model, message_history, username):
+    data = yi_payload(model, message_history)
+    if st.session_state.get("hedging"):
+        backup = backup_target("Baichuan", "Baichuan4", BAICHUAN_API_URL + "chat/completions", BAICHUAN_API_KEY, data)
+        return hedged_stream_response(HedgeTarget("Yi", model, YI_API_URL, api_key, data), backup, message_history, username)
+
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {"model": model, "messages": message_history, "temperature": st.session_state.get("temperature", 0.9), "top_p": st.session_state.get("top_p", 0.3), "stream": True}
-    response = requests.post(f"https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data, stream=True)
+    timer = start_completion("Yi", model, "NetworkAi", username)
+    response = http_client.post(YI_API_URL, headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-
-        for chunk in response.iter_lines(decode_unicode=False):
-            if chunk:
-                chunk = chunk.decode('utf-8')
-                if chunk.startswith("data: "):
-                    chunk_data = chunk[len("data: "):].strip()
-                    if chunk_data == "[DONE]":
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        chunk_message = chunk_json['choices'][0]['delta']
-                        if 'content' in chunk_message and chunk_message['content']:
-                            assistant_content += chunk_message['content']
-                            assistant_response.markdown(assistant_content)
-                    except json.JSONDecodeError as e:
-                        st.error(f"JSONDecodeError: {e}")
-                        continue
+        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
 def baichuan_stream_response(api_key, model, message_history, username):
+    data = baichuan_payload(model, message_history)
+    if st.session_state.get("hedging"):
+        backup = backup_target("Yi", "yi-large-rag", YI_API_URL, YI_API_KEY, data)
+        return hedged_stream_response(HedgeTarget("Baichuan", model, BAICHUAN_API_URL + "chat/completions", api_key, data), backup, message_history, username)
+
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {
-        "model": model,
-        "messages": message_history,
-        "temperature": st.session_state.get("temperature", 0.3),
-        "stream": True,
-        "tools": [{
-            "type": "web_search",
-            "web_search": {
-                "enable": True,
-                "search_mode": "performance_first"
-            }
-        }]
-    }
-    response = requests.post(BAICHUAN_API_URL + "chat/completions", headers=headers, json=data, stream=True)
+    timer = start_completion("Baichuan", model, "NetworkAi", username)
+    response = http_client.post(BAICHUAN_API_URL + "chat/completions", headers=headers, json=data, stream=True)
 
     if response.status_code == 200:
         assistant_response = st.empty()
-        assistant_content = ""
-
-        for chunk in response.iter_lines(decode_unicode=False):
-            if chunk:
-                chunk = chunk.decode('utf-8')
-                if chunk.startswith("data: "):
-                    chunk_data = chunk[len("data: "):].strip()
-                    if chunk_data == "[DONE]":
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        chunk_message = chunk_json['choices'][0]['delta']
-                        if 'content' in chunk_message and chunk_message['content']:
-                            assistant_content += chunk_message['content']
-                            assistant_response.markdown(assistant_content)
-                    except json.JSONDecodeError as e:
-                        st.error(f"JSONDecodeError: {e}")
-                        continue
+        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer)
         if assistant_content.strip():
             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
             if st.session_state["chat_name"]:
                 save_data(username, st.session_state["chat_name"], message_history)
             st.experimental_rerun()
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
 
 def handle_audio_input(app_key, app_secret, message_history, username):
@@ -267,6 +265,10 @@ def main(__login__obj):
 
         st.session_state["selected_model"] = model
 
+        if model != "SkyChat-3.0":
+            st.session_state["hedging"] = st.checkbox("对冲请求", value=st.session_state.get("hedging", False),
+                                                      help="首字迟迟未到时同时请求另一个联网模型（yi-large-rag / Baichuan4），先返回的一路胜出")
+
         # 显示历史聊天记录
         existing_chats = get_history_chats(username)
         selected_chat = st.selectbox("选择聊天记录", [""] + existing_chats)
@@ -344,10 +346,12 @@ def main(__login__obj):
     for msg in st.session_state["messages"]:
         st.chat_message(msg["role"]).write(msg["content"])
 
-    if prompt := st.chat_input("输入你的消息："):
-        if prompt.strip():  # 确保输入内容非空
-            st.session_state["messages"].append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
+    resume = continue_button()
+    if (prompt := st.chat_input("输入你的消息：")) or resume:
+        if resume or prompt.strip():  # 确保输入内容非空
+            if not resume:
+                st.session_state["messages"].append({"role": "user", "content": prompt})
+                st.chat_message("user").write(prompt)
 
             if st.session_state["selected_model"] == "SkyChat-3.0":
                 stream_response(app_key, app_secret, st.session_state["messages"], username, prompt)
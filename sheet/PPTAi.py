@@ -3,8 +3,12 @@ import hmac
 import base64
 import json
 import time
-import requests
+from tools import http_client
 import streamlit as st
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
 
 
 class AIPPT:
@@ -50,7 +54,7 @@ class AIPPT:
             "Content-Type": "application/json; charset=utf-8"
         }
         self.header = headers
-        response = requests.post(url, json=body, headers=headers).text
+        response = http_client.post(url, json=body, headers=headers).text
         resp = json.loads(response)
         if resp['code'] == 0:
             return resp['data']['sid']
@@ -73,7 +77,7 @@ class AIPPT:
     # 轮询任务进度，返回完整响应信息
     def get_process(self, sid):
         if sid is not None:
-            response = requests.get(f"https://zwapi.xfyun.cn/api/aippt/progress?sid={sid}", headers=self.header).text
+            response = http_client.get(f"https://zwapi.xfyun.cn/api/aippt/progress?sid={sid}", headers=self.header).text
             return response
         else:
             return None
@@ -105,39 +109,25 @@ def handle_ai_task(prompt, task_type, messages, stream=True):
 
     data = {
         "model": "yi-large",
-        "messages": messages + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
+        "messages": api_messages(messages) + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
         "temperature": 0.9,
         "top_p": 0.3,
         "stream": stream
     }
 
-    response = requests.post(f"https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data,
+    timer = start_completion("Yi", data["model"], "PPTAi")
+    response = http_client.post(f"https://api.lingyiwanwu.com/v1/chat/completions", headers=headers, json=data,
                              stream=stream)
 
     if response.status_code == 200:
         if stream:
-            assistant_content = ""
             assistant_response = st.empty()
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            chunk_message = chunk_json['choices'][0]['delta']
-                            if 'content' in chunk_message and chunk_message['content']:
-                                assistant_content += chunk_message['content']
-                                assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
             return assistant_content
         else:
             return response.json()['choices'][0]['message']['content']
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
         return None
 
@@ -201,7 +191,7 @@ def main(__login__obj):
                     st.success("PPT生成成功！")
                     st.download_button(
                         label="下载PPT",
-                        data=requests.get(ppt_url).content,
+                        data=http_client.get(ppt_url).content,
                         file_name="generated_ppt.pptx",
                         mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
                     )
@@ -1,81 +1,112 @@
-import json
 import streamlit as st
-import requests
+from tools import http_client
 
 from tools.chat_histor import get_history_chats, save_data, load_data, remove_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
+from tools.response_cache import cache_key, lookup, replay, store
+from tools.single_flight import get_single_flight
+from tools.prompt_router import choose_model, last_user_content, light_routing_enabled, light_routing_toggle, show_choice
 
 MODEL_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
 ZHIPU_API_KEY = st.secrets["api"]["Zhipu_key"]
-
-
-def stream_response(message_history, username):
-    try:
-        headers = {"Authorization": f"Bearer {ZHIPU_API_KEY}", "Content-Type": "application/json"}
-        data = {
-            "model": "glm-4-alltools",
-            "messages": message_history,
-            "stream": True,
-            "max_tokens": st.session_state["max_tokens"],
-            "top_p": st.session_state["top_p"],
-            "temperature": st.session_state["temperature"],
-            "tools": [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "example_function",
-                        "description": "这是一个示例函数。",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "param1": {
-                                    "description": "示例参数1",
-                                    "type": "string"
-                                },
-                                "param2": {
-                                    "description": "示例参数2",
-                                    "type": "string"
-                                }
-                            },
-                            "required": ["param1", "param2"]
-                        }
+# 翻译与数学题的相同输入多半来自不同的学生，回答可以直接复用
+CACHEABLE_TASKS = ("AI翻译", "数学")
+
+
+# glm-4-alltools 的内置工具，轻量模型 glm-4-flash 不支持这些工具
+ALLTOOLS_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "example_function",
+            "description": "这是一个示例函数。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "param1": {
+                        "description": "示例参数1",
+                        "type": "string"
+                    },
+                    "param2": {
+                        "description": "示例参数2",
+                        "type": "string"
                     }
                 },
-                {"type": "code_interpreter"},
-                {"type": "web_browser"},
-                {"type": "drawing_tool"}
-            ]
+                "required": ["param1", "param2"]
+            }
         }
+    },
+    {"type": "code_interpreter"},
+    {"type": "web_browser"},
+    {"type": "drawing_tool"}
+]
+
+
+def chat_payload(message_history, task=None):
+    """按问题复杂度选择 glm-4-alltools 或轻量模型，组装请求体"""
+    model = "glm-4-alltools"
+    if light_routing_enabled():
+        model, complexity = choose_model("Zhipu", model, last_user_content(message_history), task, message_history)
+        show_choice(model, complexity)
+    data = {
+        "model": model,
+        "messages": api_messages(message_history),
+        "stream": True,
+        "max_tokens": st.session_state["max_tokens"],
+        "top_p": st.session_state["top_p"],
+        "temperature": st.session_state["temperature"]
+    }
+    if model == "glm-4-alltools":
+        data["tools"] = ALLTOOLS_TOOLS
+    return data
+
+
+def stream_response(message_history, username, task=None):
+    try:
+        headers = {"Authorization": f"Bearer {ZHIPU_API_KEY}", "Content-Type": "application/json"}
+        data = chat_payload(message_history, task)
 
-        response = requests.post(MODEL_API_URL, headers=headers, json=data, stream=True)
-
-        if response.status_code == 200:
+        key, cached = lookup(data, cacheable=bool(task) and task.startswith(CACHEABLE_TASKS))
+        if cached is not None:
+            st.caption("⚡ 相同的请求已有回答，直接使用缓存")
+            assistant_content = render_deltas(replay(cached), st.empty(), resumable=False)
+            if assistant_content.strip():
+                st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
+                if st.session_state["chat_name"]:
+                    save_data(username, st.session_state["chat_name"], message_history)
+                st.experimental_rerun()
+            return
+
+        timers = []
+
+        def open_stream():
+            timer = start_completion("Zhipu", data["model"], "ToolAi", username)
+            timers.append(timer)
+            response = http_client.post(MODEL_API_URL, headers=headers, json=data, stream=True)
+            if response.status_code != 200:
+                timer.fail(response.status_code)
+                st.error(f"Error: {response.status_code}, {response.text}")
+                return None
+            return iter_deltas(response, timer=timer)
+
+        # 同一时刻其他会话发出的相同请求只向上游发送一次，后到的会话订阅同一条回答流
+        deltas, leader = get_single_flight().join(cache_key(data), open_stream)
+        if deltas is not None:
+            if not leader:
+                st.caption("⚡ 相同的请求正在生成，已加入共享的回答流")
+            timer = timers[0] if timers else None
             assistant_response = st.empty()
-            assistant_content = ""
-
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            if 'choices' in chunk_json and chunk_json['choices']:
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    assistant_content += chunk_message['content']
-                                    assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(deltas, assistant_response, timer=timer, resumable=False)
+            if leader:
+                store(key, data, assistant_content)
             if assistant_content.strip():
                 st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                 if st.session_state["chat_name"]:
                     save_data(username, st.session_state["chat_name"], message_history)
                 st.experimental_rerun()
-        else:
-            st.error(f"Error: {response.status_code}, {response.text}")
     except Exception as e:
         st.error(f"请求过程中出现错误: {e}")
 
@@ -97,6 +128,7 @@ def main(__login__obj):
     st.sidebar.title("选择功能")
     function_option = ["AI写作", "AI翻译", "数学", "化学", "生物", "地理", "历史"]
     chosen_function = st.sidebar.selectbox("功能", function_option)
+    light_routing_toggle()
 
     with st.sidebar:
         st.title("聊天设置")
@@ -146,7 +178,7 @@ def main(__login__obj):
                 "content": f"请作为内容写作专家，帮我写一份文章，主题为{theme}，内容类型为{content_type}，要求作文文风符合{stage}阶段，字数在800字以上。"
             }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task="AI写作")
 
     elif chosen_function == "AI翻译":
         st.title("AI翻译")
@@ -158,7 +190,7 @@ def main(__login__obj):
                 "content": f"请作为翻译专家，帮我翻译以下内容: {content_to_translate}，要求翻译方向为{target_language}。"
             }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task="AI翻译")
 
     elif chosen_function == "数学":
         st.title("数学助手")
@@ -181,7 +213,7 @@ def main(__login__obj):
                     "content": f"请作为数学专家，帮我解释以下数学概念：{math_problem}"
                 }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task=f"数学-{math_task}")
 
     elif chosen_function == "化学":
         st.title("化学助手")
@@ -213,7 +245,7 @@ def main(__login__obj):
                     "content": f"请作为化学专家，帮我解释以下化学概念：{chemistry_question}"
                 }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task=f"化学-{chemistry_task}")
 
     elif chosen_function == "生物":
         st.title("生物助手")
@@ -244,7 +276,7 @@ def main(__login__obj):
                     "content": f"请作为生物专家，帮我解释以下生物概念：{biology_question}"
                 }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task=f"生物-{biology_task}")
 
     elif chosen_function == "地理":
         st.title("地理助手")
@@ -273,7 +305,7 @@ def main(__login__obj):
                     "content": f"请作为地理专家，帮我解释以下地理概念：{geography_question}"
                 }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task=f"地理-{geography_task}")
 
     elif chosen_function == "历史":
         st.title("历史助手")
@@ -302,7 +334,7 @@ def main(__login__obj):
                     "content": f"请作为历史专家，帮我解释以下历史概念：{history_question}"
                 }
             message_history.append(preset_message)
-            stream_response(message_history, username)
+            stream_response(message_history, username, task=f"历史-{history_task}")
 
     else:
         if prompt := st.chat_input("输入您的消息:"):
@@ -317,69 +349,20 @@ def main(__login__obj):
                     'Content-Type': 'application/json',
                     'Authorization': f'Bearer {ZHIPU_API_KEY}'
                 }
-                data = {
-                    "model": "glm-4-alltools",
-                    "messages": message_history,
-                    "max_tokens": st.session_state["max_tokens"],
-                    "top_p": st.session_state["top_p"],
-                    "temperature": st.session_state["temperature"],
-                    "stream": True,
-                    "tools": [
-                        {
-                            "type": "function",
-                            "function": {
-                                "name": "example_function",
-                                "description": "这是一个示例函数。",
-                                "parameters": {
-                                    "type": "object",
-                                    "properties": {
-                                        "param1": {
-                                            "description": "示例参数1",
-                                            "type": "string"
-                                        },
-                                        "param2": {
-                                            "description": "示例参数2",
-                                            "type": "string"
-                                        }
-                                    },
-                                    "required": ["param1", "param2"]
-                                }
-                            }
-                        },
-                        {"type": "code_interpreter"},
-                        {"type": "web_browser"},
-                        {"type": "drawing_tool"}
-                    ]
-                }
-                response = requests.post(MODEL_API_URL, json=data, headers=headers, stream=True)
+                data = chat_payload(message_history)
+                timer = start_completion("Zhipu", data["model"], "ToolAi", username)
+                response = http_client.post(MODEL_API_URL, json=data, headers=headers, stream=True)
 
                 if response.status_code == 200:
                     assistant_response = st.empty()
-                    assistant_content = ""
-
-                    for chunk in response.iter_lines(decode_unicode=False):
-                        if chunk:
-                            chunk = chunk.decode('utf-8')
-                            if chunk.startswith("data: "):
-                                chunk_data = chunk[len("data: "):].strip()
-                                if chunk_data == "[DONE]":
-                                    break
-                                try:
-                                    chunk_json = json.loads(chunk_data)
-                                    if 'choices' in chunk_json and chunk_json['choices']:
-                                        chunk_message = chunk_json['choices'][0]['delta']
-                                        if 'content' in chunk_message and chunk_message['content']:
-                                            assistant_content += chunk_message['content']
-                                            assistant_response.markdown(assistant_content)
-                                except json.JSONDecodeError as e:
-                                    st.error(f"JSONDecodeError: {e}")
-                                    continue
+                    assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
                     if assistant_content.strip():
                         st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                         if st.session_state["chat_name"]:
                             save_data(username, st.session_state["chat_name"], st.session_state["messages"])
                         st.experimental_rerun()
                 else:
+                    timer.fail(response.status_code)
                     st.error(f"Failed to fetch response from AI API: {response.status_code}, {response.text}")
 
                 if st.session_state["chat_name"]:
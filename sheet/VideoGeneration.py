@@ -1,6 +1,6 @@
 import streamlit as st
 import time
-import requests
+from tools import http_client
 from datetime import datetime
 from wsgiref.handlers import format_date_time
 from time import mktime
@@ -35,7 +35,7 @@ def generate_image_agi_sky(api_key, api_secret, prompt):
         "content": prompt
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -148,7 +148,7 @@ def request_image(text, appid, apikey, apisecret):
     host = 'http://spark-api.cn-huabei-1.xf-yun.com/v2.1/tti'
     url = assemble_ws_auth_url(host, method='POST', api_key=apikey, api_secret=apisecret)
     content = getBody(appid, text)
-    response = requests.post(url, json=content, headers={'content-type': "application/json"}).text
+    response = http_client.post(url, json=content, headers={'content-type': "application/json"}).text
     return response
 
 # AGI Sky-Saas-Image API 请求
@@ -172,7 +172,7 @@ def generate_image_agi_sky(api_key, api_secret, prompt):
         "content": prompt
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -195,7 +195,7 @@ def generate_image_cogview(api_key, model_name, prompt):
         "prompt": prompt
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = http_client.post(url, headers=headers, data=json.dumps(payload))
 
     if response.status_code == 200:
         response_data = response.json()
@@ -269,7 +269,7 @@ def generate_video_cogvideox(api_key, prompt, image_base64=None):
     if image_base64:
         payload["image_base64"] = image_base64
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = http_client.post(url, headers=headers, data=json.dumps(payload))
 
     if response.status_code == 200:
         response_data = response.json()
@@ -289,7 +289,7 @@ def check_video_status(api_key, video_id):
         "Authorization": f"Bearer {api_key}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -341,7 +341,7 @@ def main(__login__obj):
                         image_url = generate_image_cogview(API_KEY, model_name, desc)
                         st.image(image_url, caption="生成的图片", use_column_width=True)
 
-                        response = requests.get(image_url)
+                        response = http_client.get(image_url)
                         img = Image.open(BytesIO(response.content))
                         buffered = BytesIO()
                         img.save(buffered, format="JPEG")
@@ -361,7 +361,7 @@ def main(__login__obj):
                         image_url = generate_image_agi_sky(APP_KEY, APP_SECRET, desc)
                         st.image(image_url, caption="生成的图片", use_column_width=True)
 
-                        response = requests.get(image_url)
+                        response = http_client.get(image_url)
                         img = Image.open(BytesIO(response.content))
                         buffered = BytesIO()
                         img.save(buffered, format="JPEG")
@@ -392,7 +392,7 @@ def main(__login__obj):
                             st.success("视频生成成功!")
 
                             # 下载视频
-                            response = requests.get(video_url)
+                            response = http_client.get(video_url)
                             video_bytes = response.content
                             st.download_button(
                                 label="下载视频",
@@ -1,6 +1,6 @@
 from io import BytesIO
 
-import requests
+from tools import http_client
 import streamlit as st
 from PIL import Image
 from barfi import st_barfi, Block, barfi_schemas
@@ -80,7 +80,7 @@ def main(__login__obj):
                 if answer.startswith("http"):
                     try:
                         # 尝试获取并显示图片
-                        response = requests.get(answer)
+                        response = http_client.get(answer)
                         response.raise_for_status()  # 检查请求是否成功
                         if 'image' in response.headers.get('Content-Type', ''):
                             img = Image.open(BytesIO(response.content))
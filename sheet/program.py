@@ -1,50 +1,40 @@
-import json
 import streamlit as st
-import requests
+from tools import http_client
 from tools.chat_histor import get_history_chats, save_data, load_data, remove_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
+from tools.response_cache import lookup, replay, store
 
 ZHIPU_API_KEY = st.secrets["api"]["Zhipu_key"]
 MODEL_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+# 输入相同则输出基本确定的任务，即使温度较高也使用回答缓存
+CACHEABLE_TASKS = ("生成注释", "翻译成其他编程语言")
 
 def stream_response(api_key, message_history, username, model="codegeex-4"):
     try:
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
         data = {
             "model": model,
-            "messages": message_history,
+            "messages": api_messages(message_history),
             "stream": True,
             "max_tokens": 4096  # 设置最大输出长度为4096
         }
 
-        response = requests.post(MODEL_API_URL, headers=headers, json=data, stream=True)
+        timer = start_completion("Zhipu", model, "program", username)
+        response = http_client.post(MODEL_API_URL, headers=headers, json=data, stream=True)
 
         if response.status_code == 200:
             assistant_response = st.empty()
-            assistant_content = ""
-
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            if 'choices' in chunk_json and chunk_json['choices']:
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    assistant_content += chunk_message['content']
-                                    assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
             if assistant_content.strip():
                 st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                 if st.session_state["chat_name"]:
                     save_data(username, st.session_state["chat_name"], st.session_state["messages"])
                 st.experimental_rerun()
         else:
+            timer.fail(response.status_code)
             st.error(f"Error: {response.status_code}, {response.text}")
     except Exception as e:
         st.error(f"请求过程中出现错误: {e}")
@@ -63,28 +53,14 @@ def run_code_in_sandbox(api_key, code):
             "max_tokens": 4096  # 设置最大输出长度为4096
         }
 
-        response = requests.post(MODEL_API_URL, headers=headers, json=data, stream=True)
+        timer = start_completion("Zhipu", data["model"], "program")
+        response = http_client.post(MODEL_API_URL, headers=headers, json=data, stream=True)
 
         if response.status_code == 200:
-            result = ""
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            if 'choices' in chunk_json and chunk_json['choices']:
-                                chunk_message = chunk_json['choices'][0]['delta']
-                                if 'content' in chunk_message and chunk_message['content']:
-                                    result += chunk_message['content']
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            result = render_deltas(iter_deltas(response, timer=timer), None, timer=timer)
             st.markdown(result)
         else:
+            timer.fail(response.status_code)
             st.error(f"Error: {response.status_code}, {response.text}")
     except Exception as e:
         st.error(f"请求过程中出现错误: {e}")
@@ -106,39 +82,31 @@ def handle_ai_task(prompt, task_type, messages, stream=True):
 
     data = {
         "model": "codegeex-4",
-        "messages": messages + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
+        "messages": api_messages(messages) + [{"role": "user", "content": f"{task_prompts[task_type]} {prompt}"}],
         "temperature": 0.9,
         "top_p": 0.3,
         "stream": stream,
         "max_tokens": 4096  # 设置最大输出长度为4096
     }
 
-    response = requests.post(MODEL_API_URL, headers=headers, json=data, stream=stream)
+    cache_key, cached = lookup(data, cacheable=task_type in CACHEABLE_TASKS)
+    if cached is not None:
+        st.caption("⚡ 相同的请求已有回答，直接使用缓存")
+        return render_deltas(replay(cached), st.empty(), resumable=False)
+
+    timer = start_completion("Zhipu", data["model"], "program")
+    response = http_client.post(MODEL_API_URL, headers=headers, json=data, stream=stream)
 
     if response.status_code == 200:
         if stream:
-            assistant_content = ""
             assistant_response = st.empty()
-            for chunk in response.iter_lines(decode_unicode=False):
-                if chunk:
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith("data: "):
-                        chunk_data = chunk[len("data: "):].strip()
-                        if chunk_data == "[DONE]":
-                            break
-                        try:
-                            chunk_json = json.loads(chunk_data)
-                            chunk_message = chunk_json['choices'][0]['delta']
-                            if 'content' in chunk_message and chunk_message['content']:
-                                assistant_content += chunk_message['content']
-                                assistant_response.markdown(assistant_content)
-                        except json.JSONDecodeError as e:
-                            st.error(f"JSONDecodeError: {e}")
-                            continue
+            assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
+            store(cache_key, data, assistant_content)
             return assistant_content
         else:
             return response.json()['choices'][0]['message']['content']
     else:
+        timer.fail(response.status_code)
         st.error(f"Error: {response.status_code}, {response.text}")
         return None
 
@@ -9,6 +9,7 @@ import requests
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from tools.atomic_io import atomic_write_json, file_lock
 
 ph = PasswordHasher()
 
@@ -119,12 +120,12 @@ def register_new_usr(name_sign_up: str, email_sign_up: str, username_sign_up: st
     new_usr_data = {'username': username_sign_up, 'name': name_sign_up, 'email': email_sign_up,
                     'password': ph.hash(password_sign_up)}
 
-    with open("_secret_auth_.json", "r") as auth_json:
-        authorized_user_data = json.load(auth_json)
+    with file_lock("_secret_auth_.json"):
+        with open("_secret_auth_.json", "r") as auth_json:
+            authorized_user_data = json.load(auth_json)
 
-    with open("_secret_auth_.json", "w") as auth_json_write:
         authorized_user_data.append(new_usr_data)
-        json.dump(authorized_user_data, auth_json_write)
+        atomic_write_json("_secret_auth_.json", authorized_user_data, backup=True)
 
     # 为新用户创建聊天目录
     user_chat_dir = f"chats/{username_sign_up}"
@@ -205,14 +206,14 @@ def change_passwd(email_: str, random_password: str) -> None:
     """
     将旧密码替换为新生成的密码。
     """
-    with open("_secret_auth_.json", "r") as auth_json:
-        authorized_users_data = json.load(auth_json)
+    with file_lock("_secret_auth_.json"):
+        with open("_secret_auth_.json", "r") as auth_json:
+            authorized_users_data = json.load(auth_json)
 
-    with open("_secret_auth_.json", "w") as auth_json_:
         for user in authorized_users_data:
             if user['email'] == email_:
                 user['password'] = ph.hash(random_password)
-        json.dump(authorized_users_data, auth_json_)
+        atomic_write_json("_secret_auth_.json", authorized_users_data, backup=True)
 
 def check_current_passwd(email_reset_passwd: str, current_passwd: str) -> bool:
     """
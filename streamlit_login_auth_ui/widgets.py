@@ -1,5 +1,4 @@
 import streamlit as st
-import json
 import os
 from streamlit_lottie import st_lottie
 from streamlit_option_menu import option_menu
@@ -15,6 +14,7 @@ from .utils import generate_random_passwd
 from .utils import send_passwd_in_email
 from .utils import change_passwd
 from .utils import check_current_passwd
+from tools.atomic_io import atomic_write_json
 
 class __login__:
     """
@@ -285,8 +285,7 @@ class __login__:
         auth_json_exists_bool = self.check_auth_json_file_exists('_secret_auth_.json')
 
         if auth_json_exists_bool == False:
-            with open("_secret_auth_.json", "w") as auth_json:
-                json.dump([], auth_json)
+            atomic_write_json("_secret_auth_.json", [])
 
         main_page_sidebar, selected_option = self.nav_sidebar()
 
@@ -3,7 +3,7 @@ import hmac
 import base64
 import json
 import time
-import requests
+from tools import http_client
 import streamlit as st
 from barfi import Block
 
@@ -27,7 +27,7 @@ def generate_image_agi_sky(api_key, api_secret, prompt):
         "content": prompt
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
 
     if response.status_code == 200:
         response_data = response.json()
@@ -93,7 +93,7 @@ class AIPPT:
             "Content-Type": "application/json; charset=utf-8"
         }
         self.header = headers
-        response = requests.post(url, json=body, headers=headers).text
+        response = http_client.post(url, json=body, headers=headers).text
         resp = json.loads(response)
         if resp['code'] == 0:
             return resp['data']['sid']
@@ -114,7 +114,7 @@ class AIPPT:
 
     def get_process(self, sid):
         if sid is not None:
-            response = requests.get(f"https://zwapi.xfyun.cn/api/aippt/progress?sid={sid}", headers=self.header).text
+            response = http_client.get(f"https://zwapi.xfyun.cn/api/aippt/progress?sid={sid}", headers=self.header).text
             return response
         else:
             return None
@@ -168,7 +168,7 @@ def create_ai_response_block(api_key):
         input_text = self.get_interface(name='Input 2') or "默认输入内容"
         full_input = f"{task_description}: {input_text}"
         # 调用 Deepseek API 获取回应
-        response = requests.post(
+        response = http_client.post(
             "https://api.deepseek.com/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -200,7 +200,7 @@ def create_yi_large_rag_block(api_key):
         input_text = self.get_interface(name='Input 2') or "默认输入内容"
         full_input = f"{task_description}: {input_text}"
         # 调用 Yi API 获取回应
-        response = requests.post(
+        response = http_client.post(
             "https://api.lingyiwanwu.com/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -232,7 +232,7 @@ def create_yi_medium_200k_block(api_key):
         input_text = self.get_interface(name='Input 2') or "默认输入内容"
         full_input = f"{task_description}: {input_text}"
         # 调用 Yi API 获取回应
-        response = requests.post(
+        response = http_client.post(
             "https://api.lingyiwanwu.com/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -0,0 +1,184 @@
+import asyncio
+import queue
+import threading
+
+import httpx
+import streamlit as st
+
+from tools import cassette, rate_limit
+from tools.http_client import POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, rewrite_url
+from tools.retry import call_with_retry_async
+from tools.sse_stream import SSEDecoder, StreamDelta, openai_delta, parse_event
+
+_END = object()
+
+
+class StreamHandle:
+    """后台事件循环上一次流式请求的句柄，页面线程通过线程安全队列消费增量事件"""
+
+    def __init__(self):
+        self.status_code = None
+        self.headers = {}
+        self._text = ""
+        self._error = None
+        self._future = None
+        self._slot = None
+        self._queue = queue.Queue()
+        self._headers_ready = threading.Event()
+        self._finished = threading.Event()
+
+    def wait_status(self, timeout=None):
+        """等待响应头到达，返回状态码；请求在拿到响应头之前失败时抛出原异常"""
+        self._headers_ready.wait(timeout)
+        if self._error is not None and self.status_code is None:
+            raise self._error
+        return self.status_code
+
+    @property
+    def text(self):
+        self._finished.wait()
+        return self._text
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def get(self, timeout=None):
+        """取出下一个事件，超时返回 None；流结束后返回 done 事件"""
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is _END:
+            self._queue.put(_END)
+            return StreamDelta("done", "", None)
+        return item
+
+    def __iter__(self):
+        self.wait_status()
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                self._queue.put(_END)
+                break
+            yield item
+        yield StreamDelta("done", "", None)
+
+    def close(self):
+        """取消上游请求，事件循环会随之关闭 HTTP 连接"""
+        if self._future is not None and not self._future.done():
+            self._future.cancel()
+            # 协程可能尚未开始执行，直接结束队列，避免消费方一直阻塞
+            self._finish()
+
+    def _set_headers(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._headers_ready.set()
+
+    def _fail(self, error):
+        self._error = error
+        self._text = str(error)
+        self._headers_ready.set()
+
+    def _finish(self):
+        if self._slot is not None:
+            self._slot.release()
+        self._queue.put(_END)
+        self._headers_ready.set()
+        self._finished.set()
+
+
+class AsyncProviderClient:
+    """在独立的后台线程上运行 asyncio 事件循环，由一个 httpx.AsyncClient 驱动所有上游流"""
+
+    def __init__(self, max_connections=POOL_SIZE * 4, timeout=None):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="provider-event-loop", daemon=True)
+        self.thread.start()
+        timeout = timeout or httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=POOL_SIZE)
+        self.client = self.run(self._create_client(timeout, limits)).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _create_client(self, timeout, limits):
+        return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+    def run(self, coro):
+        """把协程提交到后台事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def request(self, method, url, **kwargs):
+        """非流式请求，返回 Future，结果为 httpx.Response；调用线程先经过服务商限流"""
+        slot = rate_limit.acquire(url, rate_limit.model_of(kwargs))
+        future = self.run(call_with_retry_async(method, url, lambda: cassette.send_async(
+            method, url, kwargs, lambda: self.client.request(method, rewrite_url(url), **kwargs), stream=False)))
+        future.add_done_callback(lambda _: slot.release())
+        return future
+
+    def stream(self, method, url, extract=openai_delta, lenient=False, timer=None, **kwargs):
+        """发起流式请求，立即返回 StreamHandle，解析后的增量事件通过队列送回调用线程
+
+        调用线程先经过服务商限流（排队时页面上显示排队位置），流结束后归还并发配额。
+        """
+        handle = StreamHandle()
+        handle._slot = rate_limit.acquire(url, rate_limit.model_of(kwargs))
+        handle._future = self.run(self._stream(handle, method, url, extract, lenient, timer, kwargs))
+        return handle
+
+    @staticmethod
+    def _dispatch(handle, events, extract):
+        for data in events:
+            if data == "[DONE]":
+                return True
+            for delta in parse_event(data, extract):
+                handle._queue.put(delta)
+        return False
+
+    async def _open(self, method, url, kwargs):
+        """录制与回放按原始地址记录，只有真正发出的请求才改写地址"""
+        async def send():
+            request = self.client.build_request(method, rewrite_url(url), **kwargs)
+            return await self.client.send(request, stream=True)
+
+        return await cassette.send_async(method, url, kwargs, send)
+
+    async def _stream(self, handle, method, url, extract, lenient, timer, kwargs):
+        try:
+            # 只在拿到响应头之前重试，一旦开始产出内容就不再重发
+            response = await call_with_retry_async(method, url, lambda: self._open(method, url, kwargs))
+            try:
+                handle._set_headers(response)
+                if response.status_code != 200:
+                    handle._text = (await response.aread()).decode("utf-8", errors="replace")
+                    return
+                decoder = SSEDecoder(lenient=lenient)
+                finished = False
+                async for chunk in response.aiter_bytes():
+                    # [DONE] 之后继续读完剩余字节，连接才能回到 keep-alive 池
+                    if finished:
+                        continue
+                    if timer is not None:
+                        timer.mark_first_byte()
+                    finished = self._dispatch(handle, decoder.feed(chunk), extract)
+                if not finished:
+                    self._dispatch(handle, decoder.flush(), extract)
+            finally:
+                await response.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if handle.status_code is not None:
+                handle._queue.put(StreamDelta("error", "", f"连接中断: {e}"))
+            handle._fail(e)
+        finally:
+            handle._finish()
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_client():
+    """进程内唯一的异步客户端，所有会话共享同一个后台事件循环"""
+    return AsyncProviderClient()
@@ -0,0 +1,163 @@
+"""崩溃安全的文件写入与跨进程的建议锁。
+
+atomic_write 先写同目录下的临时文件并 fsync，再 os.replace 到目标路径并 fsync 所在目录，进程在任何
+时刻崩溃，目标文件要么是旧内容、要么是完整的新内容。file_lock 在 <路径>.lock 上加建议锁
+（POSIX 用 fcntl.flock，Windows 用 msvcrt.locking），同一进程内的线程与其他进程（同一用户开的
+多个标签页可能落在不同的服务进程上）对同一文件的读改写因此串行进行。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 取锁的最长等待时间（秒），超时抛出 TimeoutError
+LOCK_TIMEOUT = 30.0
+LOCK_POLL = 0.05
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _fsync_directory(directory):
+    """rename 本身的持久化依赖目录的 fsync；Windows 不支持打开目录，跳过"""
+    if fcntl is None:
+        return
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, backup=False):
+    """原子地把 data（str 按 UTF-8 编码，或 bytes）写到 path。
+
+    backup=True 时先把现有文件保留为 <路径>.bak，供恢复扫描在主文件损坏时还原。
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if backup and os.path.exists(path):
+            _keep_backup(path)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+def _keep_backup(path):
+    bak = path + ".bak"
+    try:
+        os.remove(bak)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(path, bak)
+    except OSError:
+        shutil.copyfile(path, bak)
+
+
+def atomic_write_json(path, obj, backup=False, **dump_kwargs):
+    atomic_write(path, json.dumps(obj, **dump_kwargs), backup=backup)
+
+
+def append_durable(path, data):
+    """追加并 fsync，追加日志用"""
+    with open(path, "ab") as f:
+        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class _PathLock:
+    """同一个锁文件在进程内的线程锁与重入深度，只有最外层持有者去拿文件锁"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+
+
+def _path_lock(path):
+    with _path_locks_guard:
+        entry = _path_locks.get(path)
+        if entry is None:
+            entry = _path_locks[path] = _PathLock()
+        return entry
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """在 <path>.lock 上持有排他建议锁；同一线程可以重入"""
+    lock_path = os.path.abspath(path) + ".lock"
+    entry = _path_lock(lock_path)
+    if not entry.lock.acquire(timeout=timeout):
+        raise TimeoutError(f"lock {lock_path} timed out")
+    entry.depth += 1
+    try:
+        if entry.depth > 1:
+            yield
+            return
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            deadline = time.monotonic() + timeout
+            while not _try_lock(fd):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"lock {lock_path} timed out")
+                time.sleep(LOCK_POLL)
+            try:
+                yield
+            finally:
+                _unlock(fd)
+        finally:
+            os.close(fd)
+    finally:
+        entry.depth -= 1
+        entry.lock.release()
+
+
+def quarantine(path):
+    """把损坏的文件改名为 <路径>.corrupt-<时间戳>，返回新路径；不以原扩展名结尾，不会再被当作数据读取"""
+    target = f"{path}.corrupt-{time.strftime('%Y%m%d%H%M%S')}"
+    os.replace(path, target)
+    return target
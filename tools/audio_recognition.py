@@ -1,7 +1,7 @@
 import streamlit as st
 import sounddevice as sd
 import wavio
-import requests
+from tools import http_client
 
 # 在这里设置您的 API Key
 API_KEY = st.secrets["api"]["bianxie_key"],
@@ -25,7 +25,7 @@ def transcribe_audio(file_path):
         "model": (None, "whisper-1")
     }
 
-    response = requests.post(url, headers=headers, files=files)
+    response = http_client.post(url, headers=headers, files=files)
 
     if response.status_code == 200:
         return response.json().get('text', '')
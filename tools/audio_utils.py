@@ -116,34 +116,30 @@ import os
 import threading
 import streamlit as st
 import requests
-import json
+from tools import http_client
 
 from tools.audio_recognition import record_audio
 from tools.chat_histor import save_data
+from tools.sse_stream import iter_deltas
+from tools.stream_control import api_messages
+from tools.stream_render import render_deltas
+from tools.metrics import start_completion
 
-def upload_audio_for_transcription(api_key, file_path, url, retries=3):
-    for attempt in range(retries):
-        try:
-            with open(file_path, 'rb') as audio_file:
-                response = requests.post(
-                    url,
-                    headers={'Authorization': f'Bearer {api_key}'},
-                    files={'file': audio_file},
-                    data={'model': 'whisper-1'}
-                )
-                response.raise_for_status()
-                return response.json()
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 502:
-                st.warning(f"502 Bad Gateway Error: 重试 {attempt + 1}/{retries}")
-                continue
-            else:
-                raise e
-        except Exception as e:
-            st.error(f"请求失败: {e}")
-            raise e
-    st.error("多次重试后仍然失败，请稍后再试。")
-    return None
+def upload_audio_for_transcription(api_key, file_path, url):
+    """502 等网关错误由 http_client 统一退避重试，这里只处理最终结果"""
+    try:
+        with open(file_path, 'rb') as audio_file:
+            response = http_client.post(
+                url,
+                headers={'Authorization': f'Bearer {api_key}'},
+                files={'file': audio_file},
+                data={'model': 'whisper-1'}
+            )
+            response.raise_for_status()
+            return response.json()
+    except Exception as e:
+        st.error(f"请求失败: {e}")
+        raise e
 
 def handle_audio_input(api_key, chosen_model, message_history, username):
     if 'is_recording' not in st.session_state:
@@ -187,12 +183,13 @@ def handle_audio_input(api_key, chosen_model, message_history, username):
 
                     data = {
                         "model": chosen_model,
-                        "messages": message_history,
+                        "messages": api_messages(message_history),
                         "stream": True
                     }
 
                     try:
-                        response = requests.post(chat_url, json=data, headers=headers, stream=True)
+                        timer = start_completion("bianxie", chosen_model, "audio_utils", username)
+                        response = http_client.post(chat_url, json=data, headers=headers, stream=True)
                         # st.write("请求数据:", json.dumps(data, indent=4))
                         # st.write("响应状态码:", response.status_code)
                         # st.write("响应内容:", response.text)
@@ -202,31 +199,12 @@ def handle_audio_input(api_key, chosen_model, message_history, username):
 
                     if response.status_code == 200:
                         assistant_response = st.empty()
-                        assistant_content = ""
-
-                        for chunk in response.iter_lines(decode_unicode=False):
-                            if chunk:
-                                chunk = chunk.decode('utf-8')
-                                if chunk.startswith("data: "):
-                                    chunk_data = chunk[len("data: "):].strip()
-                                    if chunk_data == "[DONE]":
-                                        break
-                                    try:
-                                        chunk_json = json.loads(chunk_data)
-                                        chunk_message = chunk_json['choices'][0]['delta']
-                                        if 'content' in chunk_message and chunk_message['content']:
-                                            assistant_content += chunk_message['content']
-                                            assistant_response.markdown(assistant_content)
-                                    except json.JSONDecodeError as e:
-                                        st.error(f"JSON解析错误: {e}")
-                                        continue
-                                    except IndexError as e:
-                                        st.error(f"索引错误: {e}")
-                                        continue
+                        assistant_content = render_deltas(iter_deltas(response, timer=timer), assistant_response, timer=timer, resumable=False)
                         if assistant_content.strip():
                             st.session_state["messages"].append({"role": "assistant", "content": assistant_content})
                             st.experimental_rerun()
                     else:
+                        timer.fail(response.status_code)
                         st.error(f"获取AI API响应失败: {response.status_code}, {response.text}")
 
                     if st.session_state["chat_name"]:
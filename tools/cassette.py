@@ -0,0 +1,352 @@
+"""服务商响应的录制与回放。
+
+录制模式下，经 http_client 与 async_client 发出的每个请求都把响应状态、响应头以及响应体的原始字节块连同到达时间
+写入 cassettes/ 下的 JSON 文件；回放模式下不访问网络，按请求的方法、地址与请求体找到对应的文件，
+以原始速度或加速后的速度把字节块重新送给页面的解析代码。各服务商的 SSE 格式（OpenAI 的 delta、
+天工的 arguments[0].messages[].text、星火文生图的 header/payload、百川角色的 character_profile）
+都按原样保存，可以离线做回归测试与性能测试。
+
+通过环境变量或 secrets.toml 的 [http] 段开启：
+    PROVIDER_CASSETTE_MODE=record|replay   cassette_mode
+    PROVIDER_CASSETTE_DIR=cassettes        cassette_dir
+    PROVIDER_CASSETTE_SPEED=1              cassette_speed（回放倍速，0 表示不等待）
+
+命令行：python -m tools.cassette list | play <文件> [--speed 10] [--format tiangong]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODE_ENV = "PROVIDER_CASSETTE_MODE"
+DIR_ENV = "PROVIDER_CASSETTE_DIR"
+SPEED_ENV = "PROVIDER_CASSETTE_SPEED"
+RECORD = "record"
+REPLAY = "replay"
+# 回放时不需要还原的响应头：响应体已经是解码后的字节，长度也可能不同
+DROPPED_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+
+
+class CassetteMissing(RuntimeError):
+    """回放模式下找不到与请求对应的录制文件"""
+
+
+def _setting(env, name, default):
+    if os.environ.get(env):
+        return os.environ[env]
+    from tools.http_client import _http_setting
+    return _http_setting(name, default)
+
+
+def mode():
+    return _setting(MODE_ENV, "cassette_mode", None)
+
+
+def cassette_dir():
+    return _setting(DIR_ENV, "cassette_dir", "cassettes")
+
+
+def replay_speed():
+    return float(_setting(SPEED_ENV, "cassette_speed", 1.0))
+
+
+def _body_fingerprint(kwargs):
+    """请求体的稳定表示：JSON 按键排序，文件上传只取字段名与文件名"""
+    if kwargs.get("json") is not None:
+        return json.dumps(kwargs["json"], ensure_ascii=False, sort_keys=True)
+    data = kwargs.get("data")
+    if isinstance(data, bytes):
+        return data.decode("utf-8", errors="replace")
+    if data is not None:
+        return str(data)
+    files = kwargs.get("files")
+    if files:
+        return json.dumps(sorted((k, v[0] if isinstance(v, tuple) else None) for k, v in files.items()),
+                          ensure_ascii=False)
+    return ""
+
+
+def cassette_path(method, url, kwargs, directory=None):
+    """按服务商主机分目录，文件名为方法、地址与请求体的哈希"""
+    key = hashlib.sha256(f"{method.upper()} {url}\n{_body_fingerprint(kwargs)}".encode("utf-8")).hexdigest()[:24]
+    return os.path.join(directory or cassette_dir(), urlsplit(url).netloc, f"{key}.json")
+
+
+class _RecordingRaw:
+    """包装 urllib3 响应，在解析代码读取字节块的同时记下到达时间，读完或关闭时写出录制文件"""
+
+    def __init__(self, raw, on_complete):
+        self._raw = raw
+        self._on_complete = on_complete
+        self._started = time.monotonic()
+        self.chunks = []
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self.chunks.append((time.monotonic() - self._started, chunk))
+            yield chunk
+        self._complete()
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if data:
+            self.chunks.append((time.monotonic() - self._started, data))
+        return data
+
+    def close(self):
+        self._complete()
+        self._raw.close()
+
+    def _complete(self):
+        on_complete, self._on_complete = self._on_complete, None
+        if on_complete is not None:
+            on_complete(self.chunks)
+
+
+class _ReplayRaw:
+    """按录制的时间间隔（除以倍速）依次吐出字节块，接口满足 requests.Response 的读取需要"""
+
+    def __init__(self, chunks, speed):
+        self._chunks = chunks
+        self._speed = speed
+        self._closed = threading.Event()
+        self._connection = None
+
+    def stream(self, amt=None, decode_content=None):
+        started = time.monotonic()
+        for offset, chunk in self._chunks:
+            if self._speed > 0:
+                # 可以被 close() 打断，和真实连接被取消时一样立即结束
+                if self._closed.wait(max(offset / self._speed - (time.monotonic() - started), 0)):
+                    return
+            elif self._closed.is_set():
+                return
+            yield chunk
+
+    def read(self, *args, **kwargs):
+        return b"".join(self.stream())
+
+    def close(self):
+        self._closed.set()
+
+    def release_conn(self):
+        pass
+
+
+class _AsyncRecording:
+    """包装 httpx 流式响应，在解析代码经 aiter_bytes/aread 读取解码后的字节块时记下到达时间，关闭时写出录制文件"""
+
+    def __init__(self, response, on_complete):
+        self._response = response
+        self._on_complete = on_complete
+        self._started = time.monotonic()
+        self.chunks = []
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    async def aiter_bytes(self, chunk_size=None):
+        async for chunk in self._response.aiter_bytes(chunk_size):
+            self.chunks.append((time.monotonic() - self._started, chunk))
+            yield chunk
+
+    async def aread(self):
+        data = await self._response.aread()
+        if data:
+            self.chunks.append((time.monotonic() - self._started, data))
+        return data
+
+    async def aclose(self):
+        on_complete, self._on_complete = self._on_complete, None
+        if on_complete is not None:
+            on_complete(self.chunks)
+        await self._response.aclose()
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    """_ReplayRaw 的异步版本，取消请求时 asyncio.sleep 随之被打断"""
+
+    def __init__(self, chunks, speed):
+        self._chunks = chunks
+        self._speed = speed
+
+    async def __aiter__(self):
+        started = time.monotonic()
+        for offset, chunk in self._chunks:
+            if self._speed > 0:
+                await asyncio.sleep(max(offset / self._speed - (time.monotonic() - started), 0))
+            yield chunk
+
+    async def aclose(self):
+        pass
+
+
+def _writer(method, url, kwargs, response, headers_at):
+    """返回把响应体字节块连同响应状态与响应头写成录制文件的函数"""
+    path = cassette_path(method, url, kwargs)
+
+    def write(chunks):
+        entry = {
+            "request": {"method": method.upper(), "url": url, "body": _body_fingerprint(kwargs)},
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS},
+            "headers_at": round(headers_at, 4),
+            "chunks": [[round(offset, 4), base64.b64encode(chunk).decode("ascii")] for offset, chunk in chunks],
+            "recorded_at": time.time(),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    return write
+
+
+def record(method, url, kwargs, send):
+    """发出请求并录制响应；响应体读完（或被关闭）后写出文件"""
+    started = time.monotonic()
+    response = send()
+    write = _writer(method, url, kwargs, response, time.monotonic() - started)
+    if not kwargs.get("stream"):
+        # 非流式请求在 send() 内已经读完响应体，直接按一个字节块写出
+        write([(0.0, response.content)])
+    else:
+        response.raw = _RecordingRaw(response.raw, write)
+    return response
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_response(entry, url, speed):
+    """由录制文件构造 requests.Response，响应头延迟按倍速等待，响应体由 _ReplayRaw 按时间吐出"""
+    if speed > 0:
+        time.sleep(entry.get("headers_at", 0) / speed)
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.reason = "REPLAYED"
+    # 字节块的时间是相对收到响应头的时刻记录的
+    chunks = [(offset, base64.b64decode(data)) for offset, data in entry["chunks"]]
+    response.raw = _ReplayRaw(chunks, speed)
+    return response
+
+
+def _find(method, url, kwargs):
+    path = cassette_path(method, url, kwargs)
+    if not os.path.exists(path):
+        raise CassetteMissing(f"没有与 {method.upper()} {url} 对应的录制文件: {path}")
+    return load(path)
+
+
+def replay(method, url, kwargs):
+    return build_response(_find(method, url, kwargs), url, replay_speed())
+
+
+async def replay_async(method, url, kwargs, stream=True):
+    """由录制文件构造 httpx.Response；stream=False 时先读完响应体，与 AsyncClient.request 的返回值一致"""
+    entry = _find(method, url, kwargs)
+    speed = replay_speed()
+    if speed > 0:
+        await asyncio.sleep(entry.get("headers_at", 0) / speed)
+    chunks = [(offset, base64.b64decode(data)) for offset, data in entry["chunks"]]
+    response = httpx.Response(entry["status"], headers=entry["headers"], stream=_AsyncReplayStream(chunks, speed),
+                              request=httpx.Request(method, url))
+    if not stream:
+        await response.aread()
+    return response
+
+
+def send(method, url, kwargs, send_request):
+    """http_client 发请求的入口：按当前模式录制、回放或直接发送"""
+    current = mode()
+    if current == REPLAY:
+        return replay(method, url, kwargs)
+    if current == RECORD:
+        return record(method, url, kwargs, send_request)
+    return send_request()
+
+
+async def send_async(method, url, kwargs, send_request, stream=True):
+    """async_client 发请求的入口：send_request 为返回 httpx.Response 的协程函数，stream=False 表示响应体已读完"""
+    current = mode()
+    if current == REPLAY:
+        return await replay_async(method, url, kwargs, stream)
+    if current == RECORD:
+        started = time.monotonic()
+        response = await send_request()
+        write = _writer(method, url, kwargs, response, time.monotonic() - started)
+        if not stream:
+            write([(0.0, response.content)])
+            return response
+        return _AsyncRecording(response, write)
+    return await send_request()
+
+
+def _play(path, speed, fmt):
+    """离线回放单个录制文件，经 iter_deltas 解析并统计首字与总耗时"""
+    from tools.sse_stream import iter_deltas, openai_delta, tiangong_extractor
+
+    entry = load(path)
+    started = time.monotonic()
+    response = build_response(entry, entry["request"]["url"], speed)
+    if fmt == "raw":
+        content = response.text
+        first = time.monotonic() - started
+    else:
+        extract = tiangong_extractor() if fmt == "tiangong" else openai_delta
+        first = None
+        parts = []
+        for delta in iter_deltas(response, extract=extract, lenient=fmt == "tiangong"):
+            if delta.kind == "content":
+                first = first if first is not None else time.monotonic() - started
+                parts.append(delta.content)
+        content = "".join(parts)
+    total = time.monotonic() - started
+    print(content)
+    print(f"\n-- {entry['request']['method']} {entry['request']['url']} status={entry['status']} "
+          f"chunks={len(entry['chunks'])} first={first if first is None else round(first, 3)}s total={total:.3f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="服务商响应录制文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    listing = sub.add_parser("list", help="列出录制文件")
+    listing.add_argument("--dir", default=None)
+    play = sub.add_parser("play", help="回放一个录制文件并解析")
+    play.add_argument("path")
+    play.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示不等待")
+    play.add_argument("--format", default="openai", choices=["openai", "tiangong", "raw"])
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        root = args.dir or cassette_dir()
+        for folder, _, names in sorted(os.walk(root)):
+            for name in sorted(names):
+                if name.endswith(".json"):
+                    entry = load(os.path.join(folder, name))
+                    duration = entry["chunks"][-1][0] if entry["chunks"] else 0
+                    print(f"{os.path.join(folder, name)}\t{entry['status']}\t{len(entry['chunks'])} chunks\t"
+                          f"{duration:.2f}s\t{entry['request']['method']} {entry['request']['url']}")
+    else:
+        _play(args.path, args.speed, args.format)
+
+
+if __name__ == "__main__":
+    main()
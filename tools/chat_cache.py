@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+
+def _chat_cache_setting(name, default):
+    """读取 secrets.toml 中 [chat_cache] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("chat_cache", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 缓存的会话数与估算内存占用（字节）上限，超出时按最近最少使用淘汰
+MAX_ENTRIES = int(_chat_cache_setting("max_entries", 256))
+MAX_BYTES = int(_chat_cache_setting("max_bytes", 64 * 1024 * 1024))
+# 每条消息除字符串内容以外的固定开销估算
+MESSAGE_OVERHEAD = 256
+
+
+def _copy(history):
+    """页面会直接修改 session_state 中的消息列表，缓存内外各持有一份列表与消息字典"""
+    return [dict(m) if isinstance(m, dict) else m for m in history]
+
+
+def estimate_bytes(history):
+    """按消息中字符串的长度粗略估算会话占用的内存"""
+    total = 0
+    for message in history:
+        total += MESSAGE_OVERHEAD
+        if isinstance(message, dict):
+            total += sum(len(v) if isinstance(v, str) else MESSAGE_OVERHEAD for v in message.values())
+    return total
+
+
+class ConversationCache:
+    """所有会话共享的已解析会话 LRU 缓存，键为 (用户, 会话)。
+
+    每个条目记录放入时存储给出的版本（文件的修改时间与大小，或数据库中的更新时间），读取时版本
+    不一致即视为失效；经 save_data 写入的内容直接替换缓存条目。
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+        return entry
+
+    def get(self, key, version):
+        """版本一致时返回会话历史的副本，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (version is None or entry[0] != version):
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            history = entry[1]
+        return _copy(history)
+
+    def put(self, key, version, history):
+        history = _copy(history)
+        size = estimate_bytes(history)
+        with self._lock:
+            self._drop(key)
+            if version is None or size > self.max_bytes:
+                return
+            self._entries[key] = (version, history, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._drop(key) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_conversation_cache():
+    return ConversationCache()
@@ -0,0 +1,259 @@
+"""SQLite 会话存储。
+
+数据库使用 WAL 模式，多个线程与进程可以同时读，写操作用 BEGIN IMMEDIATE 串行化并等待忙锁，
+不会互相覆盖。chats 表每个会话一行，带标题、消息数与字节数，按 (username, updated_at) 建索引，
+会话列表的排序与分页直接走索引；messages 表
+每条消息一行，主键为 (username, chat, seq)，同时保存消息序列化结果的摘要，保存时只比较摘要，
+追加一条消息只插入一行。
+
+导入已有的 JSON 会话文件：python -m tools.chat_db migrate [--dir chats] [--db chats/chats.db]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from tools.chat_histor import CHATS_DB, CHATS_DIR, FileChatStore, merge_plan
+from tools.chat_manifest import ChatInfo, chat_title
+
+# 等待其他写入者释放锁的最长时间（毫秒）
+BUSY_TIMEOUT_MS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    username TEXT NOT NULL,
+    chat TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    messages INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, chat)
+);
+CREATE INDEX IF NOT EXISTS chats_by_recency ON chats (username, updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    username TEXT NOT NULL,
+    chat TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (username, chat, seq)
+) WITHOUT ROWID;
+"""
+# 早期版本的 chats 表没有会话信息与版本号列，打开时补上并按消息表回填
+SUMMARY_COLUMNS = {
+    "title": "TEXT NOT NULL DEFAULT ''",
+    "messages": "INTEGER NOT NULL DEFAULT 0",
+    "bytes": "INTEGER NOT NULL DEFAULT 0",
+    "version": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def _serialize(message):
+    return json.dumps(message, ensure_ascii=False, sort_keys=True)
+
+
+def _digest(body):
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SqliteChatStore:
+    """与 FileChatStore 接口相同的 SQLite 存储，每个线程使用自己的连接"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        self._upgrade(conn)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 事务由下面的 BEGIN IMMEDIATE 显式控制
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    def _upgrade(self, conn):
+        """给旧数据库补上缺少的列并回填"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chats)")}
+        missing = [name for name in SUMMARY_COLUMNS if name not in columns]
+        if not missing:
+            return
+
+        def work(conn):
+            for name in missing:
+                conn.execute(f"ALTER TABLE chats ADD COLUMN {name} {SUMMARY_COLUMNS[name]}")
+            if "title" not in missing:
+                return
+            conn.execute(
+                "UPDATE chats SET title = chat, "
+                "messages = (SELECT COUNT(*) FROM messages m WHERE m.username = chats.username AND m.chat = chats.chat), "
+                "bytes = (SELECT COALESCE(SUM(LENGTH(CAST(body AS BLOB))), 0) FROM messages m "
+                "WHERE m.username = chats.username AND m.chat = chats.chat)")
+
+        self._write(work)
+
+    def _write(self, work):
+        """在写事务中执行 work(conn)；BEGIN IMMEDIATE 一开始就拿写锁，读取摘要与写入之间不会被插队"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def save(self, username, chat_name, data, base=None, updated_at=None):
+        """保存会话，base 为写入方上次读到或写入的历史（见 chat_histor.merge_plan）。
+
+        返回 (写入后的版本, 存储中的历史)；与其他写入者合并时历史不同于 data。
+        """
+        bodies = [_serialize(m) for m in data]
+        digests = [_digest(body) for body in bodies]
+        base = None if base is None else [_digest(_serialize(m)) for m in base]
+        now = time.time() if updated_at is None else updated_at
+
+        def work(conn):
+            stored = [row[0] for row in conn.execute(
+                "SELECT digest FROM messages WHERE username = ? AND chat = ? ORDER BY seq",
+                (username, chat_name))]
+            conn.execute(
+                "INSERT INTO chats (username, chat, created_at, updated_at, title) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (username, chat) DO NOTHING", (username, chat_name, now, now, chat_name))
+            keep, appended = merge_plan(stored, base, digests)
+            if keep == len(stored) and not appended:
+                if stored == digests:
+                    return self._version(conn, username, chat_name), data
+                # 没有写入但数据库中的内容与 data 不同（如过期的标签页带着旧的 base 保存），返回数据库中的历史
+                rows = conn.execute("SELECT body FROM messages WHERE username = ? AND chat = ? ORDER BY seq",
+                                    (username, chat_name)).fetchall()
+                return self._version(conn, username, chat_name), [json.loads(body) for body, in rows]
+            if keep < len(stored):
+                conn.execute("DELETE FROM messages WHERE username = ? AND chat = ? AND seq >= ?",
+                             (username, chat_name, keep))
+            conn.executemany(
+                "INSERT INTO messages (username, chat, seq, digest, body) VALUES (?, ?, ?, ?, ?)",
+                [(username, chat_name, position, digests[i], bodies[i]) for position, i in enumerate(appended, keep)])
+            if appended == list(range(keep, len(bodies))):
+                history, size = data, sum(len(body.encode("utf-8")) for body in bodies)
+            else:
+                # 与其他写入者合并：以数据库中合并后的内容为准
+                rows = conn.execute("SELECT body FROM messages WHERE username = ? AND chat = ? ORDER BY seq",
+                                    (username, chat_name)).fetchall()
+                history = [json.loads(body) for body, in rows]
+                size = sum(len(body.encode("utf-8")) for body, in rows)
+            conn.execute("UPDATE chats SET updated_at = ?, title = ?, messages = ?, bytes = ?, version = version + 1 "
+                         "WHERE username = ? AND chat = ?",
+                         (now, chat_title(chat_name, history), len(history), size, username, chat_name))
+            return self._version(conn, username, chat_name), history
+
+        return self._write(work)
+
+    @staticmethod
+    def _version(conn, username, chat_name):
+        return conn.execute("SELECT created_at, version FROM chats WHERE username = ? AND chat = ?",
+                            (username, chat_name)).fetchone()
+
+    def version(self, username, chat_name):
+        """会话的 (创建时间, 版本号)，版本号每次写入加一，供进程内缓存判断是否失效；会话不存在时返回 None"""
+        return self._version(self._connect(), username, chat_name)
+
+    def load(self, username, chat_name):
+        conn = self._connect()
+        # 同一个读事务内读取，保证会话存在性与消息内容是同一时刻的
+        conn.execute("BEGIN")
+        try:
+            exists = conn.execute("SELECT 1 FROM chats WHERE username = ? AND chat = ?",
+                                  (username, chat_name)).fetchone()
+            rows = conn.execute("SELECT body FROM messages WHERE username = ? AND chat = ? ORDER BY seq",
+                                (username, chat_name)).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        if exists is None:
+            raise FileNotFoundError(f"chat not found: {username}/{chat_name}")
+        return [json.loads(body) for body, in rows]
+
+    def usernames(self):
+        return [name for name, in self._connect().execute("SELECT DISTINCT username FROM chats ORDER BY username")]
+
+    def chat_index(self, username, offset=0, limit=None):
+        rows = self._connect().execute(
+            "SELECT chat, title, created_at, updated_at, messages, bytes FROM chats "
+            "WHERE username = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (username, -1 if limit is None else limit, offset))
+        return [ChatInfo(*row) for row in rows]
+
+    def count_chats(self, username):
+        return self._connect().execute("SELECT COUNT(*) FROM chats WHERE username = ?", (username,)).fetchone()[0]
+
+    def remove(self, username, chat_name):
+        def work(conn):
+            conn.execute("DELETE FROM messages WHERE username = ? AND chat = ?", (username, chat_name))
+            deleted = conn.execute("DELETE FROM chats WHERE username = ? AND chat = ?",
+                                   (username, chat_name)).rowcount
+            if not deleted:
+                raise FileNotFoundError(f"chat not found: {username}/{chat_name}")
+
+        self._write(work)
+
+
+def migrate(chats_dir, db_path, overwrite=False):
+    """把 chats/{用户}/{会话}.json（含追加日志）导入数据库，修改时间沿用文件的修改时间。
+
+    数据库中已存在的会话默认跳过，overwrite=True 时用文件内容覆盖。返回 (导入数, 跳过数, 失败数)。
+    """
+    files = FileChatStore(chats_dir)
+    store = SqliteChatStore(db_path)
+    imported = skipped = failed = 0
+    for username in sorted(os.listdir(chats_dir)):
+        user_dir = os.path.join(chats_dir, username)
+        if not os.path.isdir(user_dir):
+            continue
+        existing = {info.chat for info in store.chat_index(username)}
+        for chat_name in sorted(info.chat for info in files.chat_index(username)):
+            if chat_name in existing and not overwrite:
+                skipped += 1
+                continue
+            try:
+                history = files.load(username, chat_name)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"failed  {username}/{chat_name}: {e}")
+                failed += 1
+                continue
+            snapshot, log = files._paths(username, chat_name)
+            mtime = max(os.path.getmtime(p) for p in (snapshot, log) if os.path.exists(p))
+            store.save(username, chat_name, history, updated_at=mtime)
+            imported += 1
+            print(f"imported {username}/{chat_name}: {len(history)} messages")
+    return imported, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite 会话存储")
+    sub = parser.add_subparsers(dest="command", required=True)
+    command = sub.add_parser("migrate", help="导入已有的 JSON 会话文件")
+    command.add_argument("--dir", default=CHATS_DIR)
+    command.add_argument("--db", default=CHATS_DB)
+    command.add_argument("--overwrite", action="store_true", help="覆盖数据库中已存在的同名会话")
+    args = parser.parse_args(argv)
+    imported, skipped, failed = migrate(args.dir, args.db, args.overwrite)
+    print(f"{imported} imported, {skipped} skipped, {failed} failed -> {args.db}")
+    print('在 secrets.toml 的 [chat_store] 段设置 backend = "sqlite" 后生效')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,377 @@
-import os
+"""会话历史的持久化。
+
+每个会话由快照 chats/{用户}/{会话}.json 与追加日志 chats/{用户}/{会话}.log 组成。保存时只把与上次
+持久化内容相比新增或改动的消息逐行追加到日志，日志记录数或体积超过阈值时再合并成新的快照；
+读取时先读快照，再按顺序重放快照之后的日志记录。
+
+日志每行一条记录 {"seq": 序号, "i": 下标, "m": 消息}，含义是把历史截断到下标 i 后追加消息 m；
+没有 "m" 的记录只做截断。快照里的 "seq" 是已合并进快照的最后一条记录序号，重放时跳过不大于它的
+记录，因此合并过程中在任何一步崩溃都不会重复应用日志。
+
+secrets.toml 的 [chat_store] 段设置 backend = "sqlite" 时改用 tools/chat_db 中的 SQLite 存储，
+页面使用的 save_data/load_data/get_history_chats/remove_data 接口不变。
+"""
 import json
+import os
+import threading
+
+import streamlit as st
+
+from tools.atomic_io import append_durable, atomic_write, file_lock
+from tools.chat_cache import _copy, get_conversation_cache
+from tools.chat_manifest import ChatManifest
+from tools.chat_writer import WriteBehindQueue
+
+
+def _store_setting(name, default):
+    """读取 secrets.toml 中 [chat_store] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("chat_store", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 存储后端：files 为下面的快照加日志文件，sqlite 为 tools/chat_db 中的 WAL 模式数据库
+STORE_BACKEND = _store_setting("backend", "files")
+CHATS_DIR = _store_setting("dir", "chats")
+CHATS_DB = _store_setting("db", os.path.join(CHATS_DIR, "chats.db"))
+# 日志记录数达到该值，或日志体积超过快照且超过下限（字节）时合并成新的快照
+COMPACT_RECORDS = int(_store_setting("compact_records", 64))
+COMPACT_MIN_BYTES = int(_store_setting("compact_min_bytes", 64 * 1024))
+# 保存在后台线程中进行，合并窗口（秒）内对同一会话的多次保存只写一次；关闭后 save_data 同步写入
+WRITE_BEHIND = bool(_store_setting("write_behind", True))
+WRITE_WINDOW = float(_store_setting("write_window", 1.0))
+
+
+class _LogState:
+    """一个会话已持久化内容的摘要：每条消息序列化结果的哈希、最后的记录序号与日志规模，
+    以及读取或写入时文件的版本，用来发现其他进程的写入"""
+
+    def __init__(self, digests, seq, records, log_bytes, snapshot_bytes, version=None):
+        self.digests = digests
+        self.seq = seq
+        self.records = records
+        self.log_bytes = log_bytes
+        self.snapshot_bytes = snapshot_bytes
+        self.version = version
+
+
+def _chat_name(chat_name):
+    return chat_name[:-5] if chat_name.endswith(".json") else chat_name
+
+
+def _serialize(message):
+    return json.dumps(message, ensure_ascii=False, sort_keys=True)
+
+
+def _common_prefix(left, right):
+    common = 0
+    for a, b in zip(left, right):
+        if a != b:
+            break
+        common += 1
+    return common
+
+
+def merge_plan(current, base, digests):
+    """决定如何把新内容写到已持久化的会话上，参数都是消息摘要列表。
+
+    current 是存储中的内容，base 是写入方上次读到或写入的内容，digests 是要写入的内容。返回
+    (保留 current 的前几条, 需要依次追加的 digests 下标)。base 为 None 或与 current 一致时按公共前缀
+    替换尾部；否则期间有其他写入者（例如同一用户的另一个标签页），不删除任何已持久化的消息，只把
+    写入方相对 base 新增或改动、且 current 中还没有的消息追加在后面。
+    """
+    if base is None or base == current:
+        keep = _common_prefix(current, digests)
+        return keep, list(range(keep, len(digests)))
+    fork = _common_prefix(base, digests)
+    present = set(current)
+    return len(current), [i for i in range(fork, len(digests)) if digests[i] not in present]
+
+
+class FileChatStore:
+    """快照加追加日志的文件存储"""
+
+    def __init__(self, root=CHATS_DIR):
+        self.root = root
+        # (用户, 会话) -> _LogState，所有会话页面共享
+        self._states = {}
+        self._lock = threading.Lock()
+        self.manifest = ChatManifest(lambda directory, chat: self._read(
+            os.path.basename(directory), chat, repair=False)[0])
+
+    def _paths(self, username, chat_name):
+        base = os.path.join(self.root, username, _chat_name(chat_name))
+        return base + ".json", base + ".log"
+
+    def _lock_path(self, username, chat_name):
+        """跨进程锁文件放在用户目录的 .locks 下，不和会话文件混在一起"""
+        return os.path.join(self.root, username, ".locks", _chat_name(chat_name))
+
+    def _read(self, username, chat_name, repair=True):
+        """读取快照并重放日志，返回 (历史, _LogState)；快照与日志都不存在时抛出 FileNotFoundError。
+
+        repair 为 True 时截掉日志末尾写了一半的行，只能在持有 self._lock 时使用。
+        """
+        snapshot_path, log_path = self._paths(username, chat_name)
+        history, seq, snapshot_bytes = [], 0, 0
+        try:
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                raw = f.read()
+            snapshot = json.loads(raw)
+            history, seq, snapshot_bytes = snapshot["history"], snapshot.get("seq", 0), len(raw.encode("utf-8"))
+        except FileNotFoundError:
+            if not os.path.exists(log_path):
+                raise
+        records, log_bytes = 0, 0
+        try:
+            with open(log_path, "r", encoding="utf-8", newline="") as f:
+                for line in f:
+                    try:
+                        # 没有换行结尾的记录没有写完整
+                        record = json.loads(line) if line.endswith("\n") else None
+                    except ValueError:
+                        record = None
+                    if record is None:
+                        # 写到一半被中断的最后一行：截掉它，后续追加才不会接在残行后面
+                        if repair:
+                            os.truncate(log_path, log_bytes)
+                        break
+                    log_bytes += len(line.encode("utf-8"))
+                    records += 1
+                    if record["seq"] <= seq:
+                        continue
+                    seq = record["seq"]
+                    del history[record["i"]:]
+                    if "m" in record:
+                        history.append(record["m"])
+        except FileNotFoundError:
+            pass
+        digests = [hash(_serialize(m)) for m in history]
+        return history, _LogState(digests, seq, records, log_bytes, snapshot_bytes)
+
+    def _compact(self, username, chat_name, data, state):
+        """把完整历史原子地写成新的快照，随后删除已合并的日志"""
+        snapshot_path, log_path = self._paths(username, chat_name)
+        raw = json.dumps({"history": data, "seq": state.seq})
+        atomic_write(snapshot_path, raw)
+        try:
+            os.remove(log_path)
+        except FileNotFoundError:
+            pass
+        state.records, state.log_bytes, state.snapshot_bytes = 0, 0, len(raw.encode("utf-8"))
+
+    def save(self, username, chat_name, data, base=None):
+        """保存会话，base 为写入方上次读到或写入的历史（见 merge_plan）。
+
+        返回 (写入后的版本, 存储中的历史)；与其他写入者合并时历史不同于 data。
+        """
+        os.makedirs(os.path.join(self.root, username), exist_ok=True)
+        lines = [_serialize(m) for m in data]
+        digests = [hash(line) for line in lines]
+        base = None if base is None else [hash(_serialize(m)) for m in base]
+        with self._lock, file_lock(self._lock_path(username, chat_name)):
+            history = self._save(username, chat_name, data, lines, digests, base)
+            version = self.version(username, chat_name)
+            state = self._states[(username, _chat_name(chat_name))]
+            state.version = version
+            if history is not None:
+                size = sum(stamp[1] for stamp in version if stamp)
+                self.manifest.update(os.path.join(self.root, username), _chat_name(chat_name), history, size)
+            elif state.digests == digests:
+                history = data
+            else:
+                # 没有写入但存储中的内容与 data 不同（如过期的标签页带着旧的 base 保存），返回存储中的历史
+                history = self._read(username, chat_name)[0]
+            return version, history
+
+    def _state(self, username, chat_name):
+        """持有锁时调用：内存中的摘要，文件版本与记录的不一致（其他进程写过）时重新读取"""
+        key = (username, _chat_name(chat_name))
+        state = self._states.get(key)
+        if state is not None and state.version == self.version(username, chat_name):
+            return state, None
+        try:
+            history, state = self._read(username, chat_name)
+        except FileNotFoundError:
+            self._states.pop(key, None)
+            return None, None
+        self._states[key] = state
+        return state, history
+
+    def _save(self, username, chat_name, data, lines, digests, base):
+        """持有锁时调用：按 merge_plan 只追加差异；返回写入后的完整历史，没有写入时返回 None"""
+        state, current = self._state(username, chat_name)
+        if state is None:
+            # 新会话直接写快照，会话列表只需要看快照文件
+            state = self._states[(username, _chat_name(chat_name))] = _LogState(digests, 0, 0, 0, 0)
+            self._compact(username, chat_name, data, state)
+            return data
+        keep, appended = merge_plan(state.digests, base, digests)
+        if keep == len(state.digests) and not appended:
+            return None
+        if keep < len(state.digests) or appended != list(range(keep, len(digests))):
+            # 合并或截断时需要完整的当前历史来更新清单与缓存
+            if current is None:
+                current = self._read(username, chat_name)[0]
+            history = current[:keep] + [data[i] for i in appended]
+        else:
+            history = data
+        records = []
+        if not appended:
+            state.seq += 1
+            records.append(json.dumps({"seq": state.seq, "i": keep}))
+        for position, i in enumerate(appended, keep):
+            state.seq += 1
+            records.append(f'{{"seq": {state.seq}, "i": {position}, "m": {lines[i]}}}')
+        payload = "".join(record + "\n" for record in records)
+        append_durable(self._paths(username, chat_name)[1], payload)
+        state.digests = state.digests[:keep] + [digests[i] for i in appended]
+        state.records += len(records)
+        state.log_bytes += len(payload.encode("utf-8"))
+        if state.records >= COMPACT_RECORDS or state.log_bytes > max(state.snapshot_bytes, COMPACT_MIN_BYTES):
+            self._compact(username, chat_name, history, state)
+        return history
+
+    def version(self, username, chat_name):
+        """快照与日志的 (修改时间, 大小)；会话不存在时返回 None"""
+        stamps = []
+        for path in self._paths(username, chat_name):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stamps.append(None)
+                continue
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps) if any(stamps) else None
+
+    def load(self, username, chat_name):
+        with self._lock, file_lock(self._lock_path(username, chat_name)):
+            history, state = self._read(username, chat_name)
+            state.version = self.version(username, chat_name)
+            self._states[(username, _chat_name(chat_name))] = state
+        return history
+
+    def usernames(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in sorted(os.listdir(self.root))
+                if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))]
+
+    def chat_index(self, username, offset=0, limit=None):
+        return self.manifest.list(os.path.join(self.root, username), offset, limit)
+
+    def count_chats(self, username):
+        return self.manifest.count(os.path.join(self.root, username))
+
+    def remove(self, username, chat_name):
+        snapshot_path, log_path = self._paths(username, chat_name)
+        with self._lock, file_lock(self._lock_path(username, chat_name)):
+            self._states.pop((username, _chat_name(chat_name)), None)
+            try:
+                os.remove(log_path)
+            except FileNotFoundError:
+                pass
+            os.remove(snapshot_path)
+            self.manifest.remove(os.path.join(self.root, username), _chat_name(chat_name))
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_store():
+    """按 [chat_store] backend 选择会话存储：files（默认）或 sqlite"""
+    if STORE_BACKEND == "sqlite":
+        from tools.chat_db import SqliteChatStore
+        return SqliteChatStore(CHATS_DB)
+    return FileChatStore(CHATS_DIR)
+
+
+@st.cache_resource(show_spinner=False)
+def get_write_queue():
+    """后台写入队列，写完后用写入的版本更新会话缓存；未开启 write_behind 时返回 None"""
+    if not WRITE_BEHIND:
+        return None
+    cache = get_conversation_cache()
+    return WriteBehindQueue(get_chat_store().save, lambda key, result: cache.put(key, *result), WRITE_WINDOW)
+
+
+def _session_bases():
+    """当前浏览器会话上次读到或保存的各聊天内容，作为下一次保存的 base；不在脚本线程中时返回 None"""
+    try:
+        return st.session_state.setdefault("_chat_bases", {})
+    except Exception:
+        return None
+
 
 def save_data(username, chat_name, data):
-    path = f"chats/{username}"
-    if not chat_name.endswith(".json"):
-        chat_name += ".json"
-    os.makedirs(path, exist_ok=True)
-    with open(os.path.join(path, chat_name), 'w') as f:
-        json.dump({"history": data}, f)
+    chat_name = _chat_name(chat_name)
+    bases = _session_bases()
+    base = bases.get((username, chat_name)) if bases is not None else None
+    queue = get_write_queue()
+    if queue is not None:
+        saved = queue.put(username, chat_name, data, base)
+    else:
+        version, history = get_chat_store().save(username, chat_name, data, base)
+        get_conversation_cache().put((username, chat_name), version, history)
+        saved = _copy(data)
+    if bases is not None:
+        bases[(username, chat_name)] = saved
+
 
 def load_data(username, chat_name):
-    path = f"chats/{username}"
-    if not chat_name.endswith(".json"):
-        chat_name += ".json"
-    with open(os.path.join(path, chat_name), 'r') as f:
-        return json.load(f)["history"]
+    """优先返回进程内缓存的会话，存储中的版本变化后重新读取"""
+    chat_name = _chat_name(chat_name)
+    queue = get_write_queue()
+    pending = queue.pending(username, chat_name) if queue is not None else None
+    if pending is None:
+        store = get_chat_store()
+        cache = get_conversation_cache()
+        # 先取版本再读取：读取期间有写入时缓存的是旧版本号，下次读取会重新加载
+        version = store.version(username, chat_name)
+        history = cache.get((username, chat_name), version)
+        if history is None:
+            history = store.load(username, chat_name)
+            cache.put((username, chat_name), version, history)
+    else:
+        history = pending
+    bases = _session_bases()
+    if bases is not None:
+        bases[(username, chat_name)] = _copy(history)
+    return history
+
+
+def get_history_chats(username, offset=0, limit=None):
+    """按最近更新时间倒序的会话名，offset/limit 用于分页"""
+    store = get_chat_store()
+    names = [info.chat for info in store.chat_index(username, offset, limit)]
+    queue = get_write_queue()
+    if queue is not None and offset == 0:
+        # 刚新建、还在队列里没有写入的会话排在最前面
+        new = [chat for chat in queue.pending_chats(username)
+               if chat not in names and store.version(username, chat) is None]
+        names = new + names
+    return names
+
+
+def get_chat_index(username, offset=0, limit=None):
+    """按最近更新时间倒序的会话信息（ChatInfo：标题、创建与更新时间、消息数、字节数）"""
+    return get_chat_store().chat_index(username, offset, limit)
+
+
+def count_chats(username):
+    return get_chat_store().count_chats(username)
 
-def get_history_chats(username):
-    path = f"chats/{username}"
-    return [f[:-5] for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)) and f.endswith(".json")]
 
 def remove_data(username, chat_name):
-    path = f"chats/{username}"
-    if not chat_name.endswith(".json"):
-        chat_name += ".json"
-    os.remove(os.path.join(path, chat_name))
+    chat_name = _chat_name(chat_name)
+    queue = get_write_queue()
+    dropped = queue.discard(username, chat_name) if queue is not None else False
+    try:
+        get_chat_store().remove(username, chat_name)
+    except FileNotFoundError:
+        # 只在队列里、从未写入过的会话
+        if not dropped:
+            raise
+    get_conversation_cache().invalidate((username, chat_name))
+    bases = _session_bases()
+    if bases is not None:
+        bases.pop((username, chat_name), None)
@@ -0,0 +1,152 @@
+"""会话目录的清单索引。
+
+每个会话目录（chats/{用户}）下有一个 .manifest 文件，记录各会话的标题、创建与更新时间、消息数与
+占用字节数，保存与删除会话时增量更新，侧边栏的会话列表只需要读这一个小文件。内存中按目录缓存
+清单与排好序的列表，每次列出时只 stat 一次目录：目录的修改时间变化（有会话文件被创建、替换或删除）
+时才 listdir 一次，与清单对账，补上清单之外新出现的会话并去掉已不存在的会话。清单文件由其他进程
+改写过时重新读取；更新清单时持有清单文件的建议锁，并原子地替换文件。
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from tools.atomic_io import atomic_write_json, file_lock
+
+MANIFEST_NAME = ".manifest"
+# 会话标题取第一条用户消息的前若干个字符
+TITLE_CHARS = 30
+
+ChatInfo = namedtuple("ChatInfo", ["chat", "title", "created_at", "updated_at", "messages", "bytes"])
+
+
+def chat_title(chat, history):
+    for message in history:
+        if isinstance(message, dict) and message.get("role") == "user" and isinstance(message.get("content"), str):
+            line = message["content"].strip().split("\n", 1)[0]
+            if line:
+                return line[:TITLE_CHARS]
+    return chat
+
+
+def _chat_files(directory, chat):
+    """会话对应的文件：快照与可能存在的追加日志"""
+    base = os.path.join(directory, chat)
+    return [path for path in (base + ".json", base + ".log") if os.path.exists(path)]
+
+
+def _read_history(directory, chat):
+    with open(os.path.join(directory, chat + ".json"), "r", encoding="utf-8") as f:
+        return json.load(f)["history"]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class _DirectoryIndex:
+    def __init__(self, entries, manifest_mtime):
+        self.entries = entries
+        self.manifest_mtime = manifest_mtime
+        self.dir_mtime = None
+        self.ordered = None
+
+
+class ChatManifest:
+    """按目录维护的会话清单。load_history(目录, 会话) 用于对账时读取清单中没有的会话"""
+
+    def __init__(self, load_history=_read_history):
+        self._load_history = load_history
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, directory):
+        return os.path.join(directory, MANIFEST_NAME)
+
+    def _write(self, directory, index):
+        path = self._manifest_path(directory)
+        atomic_write_json(path, {"chats": {chat: info._asdict() for chat, info in index.entries.items()}},
+                          ensure_ascii=False)
+        index.manifest_mtime = _mtime(path)
+        index.ordered = None
+
+    def _scan(self, directory, chat):
+        """读取一个会话生成清单条目，会话无法读取时返回 None"""
+        files = _chat_files(directory, chat)
+        try:
+            history = self._load_history(directory, chat)
+            stats = [os.stat(path) for path in files]
+        except (OSError, ValueError, KeyError):
+            return None
+        updated = max(stat.st_mtime for stat in stats)
+        return ChatInfo(chat, chat_title(chat, history), updated, updated, len(history),
+                        sum(stat.st_size for stat in stats))
+
+    def _index(self, directory):
+        """返回与目录当前内容对账后的索引；持有 self._lock 时调用"""
+        dir_mtime = _mtime(directory)
+        if dir_mtime is None:
+            return _DirectoryIndex({}, None)
+        index = self._indexes.get(directory)
+        if index is not None and index.dir_mtime == dir_mtime:
+            return index
+        manifest_mtime = _mtime(self._manifest_path(directory))
+        if index is None or index.manifest_mtime != manifest_mtime:
+            try:
+                with open(self._manifest_path(directory), "r", encoding="utf-8") as f:
+                    entries = {chat: ChatInfo(**info) for chat, info in json.load(f)["chats"].items()}
+            except (OSError, ValueError, KeyError, TypeError):
+                entries = {}
+            index = self._indexes[directory] = _DirectoryIndex(entries, manifest_mtime)
+        names = {f[:-5] for f in os.listdir(directory) if f.endswith(".json")}
+        changed = False
+        for chat in list(index.entries):
+            if chat not in names:
+                del index.entries[chat]
+                changed = True
+        for chat in names - index.entries.keys():
+            info = self._scan(directory, chat)
+            if info is not None:
+                index.entries[chat] = info
+                changed = True
+        if changed:
+            with file_lock(self._manifest_path(directory)):
+                self._write(directory, index)
+        # 清单自身的写入也会改变目录的修改时间，记录写入之后的值
+        index.dir_mtime = os.stat(directory).st_mtime_ns
+        return index
+
+    def update(self, directory, chat, history, size, updated_at=None):
+        """会话内容有变化的保存之后调用，size 为会话文件的总字节数"""
+        now = time.time() if updated_at is None else updated_at
+        with self._lock, file_lock(self._manifest_path(directory)):
+            index = self._index(directory)
+            old = index.entries.get(chat)
+            index.entries[chat] = ChatInfo(chat, chat_title(chat, history), old.created_at if old else now, now,
+                                           len(history), size)
+            self._write(directory, index)
+            index.dir_mtime = os.stat(directory).st_mtime_ns
+
+    def remove(self, directory, chat):
+        with self._lock, file_lock(self._manifest_path(directory)):
+            index = self._index(directory)
+            if index.entries.pop(chat, None) is not None:
+                self._write(directory, index)
+                index.dir_mtime = os.stat(directory).st_mtime_ns
+
+    def list(self, directory, offset=0, limit=None):
+        """按更新时间倒序返回 ChatInfo，offset/limit 用于分页"""
+        with self._lock:
+            index = self._index(directory)
+            if index.ordered is None:
+                index.ordered = sorted(index.entries.values(), key=lambda info: info.updated_at, reverse=True)
+            ordered = index.ordered
+        return ordered[offset:] if limit is None else ordered[offset:offset + limit]
+
+    def count(self, directory):
+        with self._lock:
+            return len(self._index(directory).entries)
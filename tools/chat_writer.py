@@ -0,0 +1,197 @@
+"""会话的后台写入队列。
+
+save_data 只把会话的副本放进队列后立即返回，后台线程在首次入队后等待一个合并窗口，把窗口内同一
+浏览器会话对同一聊天的多次保存合并成一次写入；不同浏览器会话（同一用户的多个标签页）的保存分别
+写入，由存储按各自读到的内容合并。尚未写入的会话仍可以通过 pending() 读到最新内容。浏览器会话断开后，
+属于它的待写会话不再等待窗口，立即写入；进程退出时（atexit）写完全部待写会话再退出。
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from tools.chat_cache import _copy
+from tools.metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# 写入失败后重试的间隔（秒）
+RETRY_DELAY = 2.0
+# 统计写入耗时与延迟时保留的最近样本数
+SAMPLE_SIZE = 500
+
+
+def _session_context():
+    """(当前会话 id, 判断会话是否在线的函数)；stream_control 依赖 chat_histor，这里延迟导入"""
+    from tools.stream_control import _session_alive, current_session_id
+    return current_session_id(), _session_alive
+
+
+class _Pending:
+    def __init__(self, data, base, session_id, now):
+        self.data = data
+        # 合并窗口内第一次保存时写入方读到的内容，窗口内后续的保存都基于它
+        self.base = base
+        self.session_id = session_id
+        self.enqueued_at = now
+        self.updated_at = now
+        self.due = now
+        self.saves = 1
+
+
+class WriteBehindQueue:
+    """按 (用户, 会话) 合并保存请求的后台写入队列。
+
+    write(用户, 会话, 历史, base) 在后台线程中执行实际写入，返回值与 (用户, 会话) 一起交给 on_written。
+    """
+
+    def __init__(self, write, on_written=None, window=1.0):
+        self.window = window
+        self._write = write
+        self._on_written = on_written
+        self._pending = {}
+        self._writing = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self.enqueued = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.failures = 0
+        self._write_ms = deque(maxlen=SAMPLE_SIZE)
+        self._lag_ms = deque(maxlen=SAMPLE_SIZE)
+        self._worker = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def put(self, username, chat_name, data, base=None):
+        """复制会话内容并入队，不等待磁盘；返回入队的副本，调用方可以把它作为下一次保存的 base"""
+        data = _copy(data)
+        session_id, _ = _session_context()
+        now = time.monotonic()
+        key = (username, chat_name, session_id)
+        with self._cond:
+            self.enqueued += 1
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry.data = data
+                entry.updated_at = now
+                entry.saves += 1
+                self.coalesced += 1
+                return data
+            entry = self._pending[key] = _Pending(data, base, session_id, now)
+            entry.due = now + self.window
+            self._cond.notify_all()
+        return data
+
+    def pending(self, username, chat_name):
+        """尚未写入的会话内容副本（当前浏览器会话的优先，否则取最近一次保存的），没有时返回 None"""
+        session_id, _ = _session_context()
+        with self._cond:
+            entries = [(key[2] == session_id, entry.updated_at, entry)
+                       for key, entry in self._pending.items() if key[:2] == (username, chat_name)]
+            data = max(entries, key=lambda item: item[:2])[2].data if entries else None
+        return _copy(data) if data is not None else None
+
+    def pending_chats(self, username):
+        with self._cond:
+            return list(dict.fromkeys(chat for user, chat, _ in self._pending if user == username))
+
+    def discard(self, username, chat_name):
+        """删除会话前调用：丢弃待写内容并等待进行中的写入结束，返回是否丢弃了待写内容"""
+        with self._cond:
+            keys = [key for key in self._pending if key[:2] == (username, chat_name)]
+            for key in keys:
+                del self._pending[key]
+            self._cond.wait_for(lambda: self._writing is None or self._writing[:2] != (username, chat_name))
+        return bool(keys)
+
+    def _next(self):
+        """持有锁时调用：返回已到期的 (键, 条目)，没有时返回 (None, 最早到期前需要等待的秒数)"""
+        if not self._pending:
+            return None, None
+        now = time.monotonic()
+        _, alive = _session_context()
+        soonest = None
+        for key, entry in self._pending.items():
+            if self._closed or entry.due <= now:
+                return key, entry
+            if entry.session_id is not None and not alive(entry.session_id):
+                logger.info("session %s ended, flushing chat %s", entry.session_id, key[1])
+                return key, entry
+            soonest = entry.due if soonest is None else min(soonest, entry.due)
+        return None, soonest - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    key, entry = self._next()
+                    if key is not None:
+                        break
+                    if self._closed:
+                        return
+                    self._cond.wait(entry)
+                del self._pending[key]
+                self._writing = key
+            started = time.monotonic()
+            try:
+                result = self._write(key[0], key[1], entry.data, entry.base)
+            except Exception as e:
+                logger.exception("write chat %s/%s failed: %s", key[0], key[1], e)
+                with self._cond:
+                    self.failures += 1
+                    self._writing = None
+                    # 期间没有新的保存时放回队列稍后重试
+                    if key not in self._pending and not self._closed:
+                        entry.due = time.monotonic() + RETRY_DELAY
+                        self._pending[key] = entry
+                    self._cond.notify_all()
+                continue
+            finished = time.monotonic()
+            if self._on_written is not None:
+                self._on_written(key[:2], result)
+            with self._cond:
+                self.writes += 1
+                self._write_ms.append((finished - started) * 1000)
+                self._lag_ms.append((finished - entry.enqueued_at) * 1000)
+                self._writing = None
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """把全部待写会话立即写入并等待完成，返回是否在超时前写完"""
+        with self._cond:
+            now = time.monotonic()
+            for entry in self._pending.values():
+                entry.due = min(entry.due, now)
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and self._writing is None, timeout)
+
+    def close(self, timeout=30.0):
+        """写完待写会话后停止后台线程（进程退出时调用）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            write_ms = list(self._write_ms)
+            lag_ms = list(self._lag_ms)
+            return {
+                "depth": len(self._pending),
+                "oldest_ms": round(max((now - e.enqueued_at for e in self._pending.values()), default=0) * 1000),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "writes": self.writes,
+                "failures": self.failures,
+                "write_p50_ms": _round(percentile(write_ms, 50)),
+                "write_p95_ms": _round(percentile(write_ms, 95)),
+                "lag_p50_ms": _round(percentile(lag_ms, 50)),
+                "lag_p95_ms": _round(percentile(lag_ms, 95)),
+            }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
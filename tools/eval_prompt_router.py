@@ -0,0 +1,134 @@
+"""离线评估复杂度分流：重放会话存储中的聊天记录，估算简单问题改用轻量模型后节省的延迟与费用。
+
+聊天记录通过 get_chat_store() 读取，与页面使用同一个存储后端（[chat_store] backend）。
+
+用法：python -m tools.eval_prompt_router [--provider Zhipu] [--model glm-4-alltools] [--json]
+"""
+import argparse
+import json
+import sys
+
+from tools.chat_histor import get_chat_store
+from tools.metrics import estimate_tokens
+from tools.prompt_router import LIGHT_MODELS, choose_model
+
+# 估算用的模型参数：每千 token 价格（元，输入/输出）、首字延迟（秒）与吞吐（token/秒），
+# 取自各服务商公开价目与经验值，只用于相对比较
+MODEL_PROFILES = {
+    "glm-4-alltools": {"input": 0.1, "output": 0.1, "ttft": 3.0, "tokens_per_sec": 25},
+    "glm-4-flash": {"input": 0.0001, "output": 0.0001, "ttft": 0.6, "tokens_per_sec": 70},
+    "yi-large": {"input": 0.02, "output": 0.02, "ttft": 1.8, "tokens_per_sec": 30},
+    "yi-large-rag": {"input": 0.025, "output": 0.025, "ttft": 3.5, "tokens_per_sec": 30},
+    "yi-spark": {"input": 0.001, "output": 0.001, "ttft": 0.5, "tokens_per_sec": 80},
+    "deepseek-chat": {"input": 0.001, "output": 0.002, "ttft": 1.2, "tokens_per_sec": 40},
+    "gpt-4o": {"input": 0.035, "output": 0.105, "ttft": 1.0, "tokens_per_sec": 60},
+    "gpt-3.5-turbo": {"input": 0.0035, "output": 0.0105, "ttft": 0.5, "tokens_per_sec": 90},
+    "moonshot-v1-32k": {"input": 0.024, "output": 0.024, "ttft": 1.5, "tokens_per_sec": 35},
+    "moonshot-v1-8k": {"input": 0.012, "output": 0.012, "ttft": 1.0, "tokens_per_sec": 40},
+    "Baichuan4": {"input": 0.1, "output": 0.1, "ttft": 2.0, "tokens_per_sec": 30},
+    "Baichuan3-Turbo": {"input": 0.012, "output": 0.012, "ttft": 0.8, "tokens_per_sec": 50},
+}
+# 没有记录回答时假定的回答长度（token）
+DEFAULT_OUTPUT_TOKENS = 300
+
+
+def split_model(recorded):
+    """助手消息中记录的 "服务商/模型" 拆成 (服务商, 模型)；没有记录时返回 (None, None)"""
+    if not recorded:
+        return None, None
+    provider, _, model = recorded.rpartition("/")
+    return provider or None, model
+
+
+def iter_turns(store):
+    """依次产出 (用户/会话, 用户问题之前的历史, 用户问题, 随后的回答, 回答记录的 "服务商/模型")"""
+    for user in store.usernames():
+        for info in store.chat_index(user):
+            try:
+                history = store.load(user, info.chat)
+            except (OSError, ValueError, KeyError):
+                continue
+            for i, message in enumerate(history):
+                if message.get("role") != "user":
+                    continue
+                reply = history[i + 1] if i + 1 < len(history) and history[i + 1].get("role") == "assistant" else {}
+                yield (f"{user}/{info.chat}", history[:i + 1], message.get("content") or "", reply.get("content"),
+                       reply.get("model"))
+
+
+def estimate(model, input_tokens, output_tokens):
+    """返回 (预计总耗时秒, 预计费用元)；没有参数的模型返回 None"""
+    profile = MODEL_PROFILES.get(model)
+    if profile is None:
+        return None
+    latency = profile["ttft"] + output_tokens / profile["tokens_per_sec"]
+    cost = (input_tokens * profile["input"] + output_tokens * profile["output"]) / 1000
+    return latency, cost
+
+
+def evaluate(store, provider, default_model, task=None):
+    summary = {"turns": 0, "light": 0, "heavy": 0, "skipped": 0,
+               "baseline_latency": 0.0, "routed_latency": 0.0, "baseline_cost": 0.0, "routed_cost": 0.0}
+    for chat, history, prompt, reply, recorded in iter_turns(store):
+        # 记录中带有模型名（故障转移后写入）的回答以实际使用的服务商与模型为基线
+        used_provider, used_model = split_model(recorded)
+        if used_model in MODEL_PROFILES:
+            turn_provider, baseline = used_provider if used_provider in LIGHT_MODELS else provider, used_model
+        else:
+            turn_provider, baseline = provider, default_model
+        routed, complexity = choose_model(turn_provider, baseline, prompt, task, history)
+        input_tokens = sum(estimate_tokens(m.get("content") or "") for m in history)
+        output_tokens = estimate_tokens(reply) if reply else DEFAULT_OUTPUT_TOKENS
+        before = estimate(baseline, input_tokens, output_tokens)
+        after = estimate(routed, input_tokens, output_tokens)
+        if before is None or after is None:
+            summary["skipped"] += 1
+            continue
+        summary["turns"] += 1
+        summary["light" if routed == LIGHT_MODELS.get(turn_provider) else "heavy"] += 1
+        summary["baseline_latency"] += before[0]
+        summary["routed_latency"] += after[0]
+        summary["baseline_cost"] += before[1]
+        summary["routed_cost"] += after[1]
+    summary["latency_saved"] = summary["baseline_latency"] - summary["routed_latency"]
+    summary["cost_saved"] = summary["baseline_cost"] - summary["routed_cost"]
+    for key in ("baseline_latency", "routed_latency", "latency_saved"):
+        summary[key] = round(summary[key], 2)
+    for key in ("baseline_cost", "routed_cost", "cost_saved"):
+        summary[key] = round(summary[key], 4)
+    return summary
+
+
+def to_markdown(summary, provider, model):
+    turns = summary["turns"] or 1
+    lines = [
+        f"## 复杂度分流离线评估（{provider} / {model}）",
+        "",
+        "| 指标 | 数值 |",
+        "| --- | --- |",
+        f"| 评估轮数 | {summary['turns']}（跳过 {summary['skipped']}） |",
+        f"| 分流到轻量模型 | {summary['light']}（{summary['light'] / turns:.0%}） |",
+        f"| 保留原模型 | {summary['heavy']} |",
+        f"| 预计总耗时 | {summary['baseline_latency']}s → {summary['routed_latency']}s（节省 {summary['latency_saved']}s） |",
+        f"| 预计费用 | {summary['baseline_cost']}元 → {summary['routed_cost']}元（节省 {summary['cost_saved']}元） |",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="重放聊天记录，评估复杂度分流节省的延迟与费用")
+    parser.add_argument("--provider", default="Zhipu", choices=sorted(LIGHT_MODELS))
+    parser.add_argument("--model", default="glm-4-alltools", help="不分流时使用的模型")
+    parser.add_argument("--task", default=None, help="页面功能或场景，如 AI翻译、推荐就诊科室")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是 Markdown")
+    args = parser.parse_args(argv)
+    summary = evaluate(get_chat_store(), args.provider, args.model, args.task)
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(to_markdown(summary, args.provider, args.model))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import namedtuple
+
+import streamlit as st
+
+from tools.async_client import get_async_client
+from tools.metrics import start_completion
+
+
+def _failover_setting(name, default):
+    """读取 secrets.toml 中 [failover] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("failover", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 连续失败多少次后熔断，以及熔断后多久放行一次半开探测（秒）
+FAILURE_THRESHOLD = int(_failover_setting("failure_threshold", 3))
+RESET_TIMEOUT = float(_failover_setting("reset_timeout", 30))
+
+# 需要切换到下一个服务商的状态码：限流与服务端错误
+FAILOVER_STATUS = (429, 500, 502, 503, 504)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """单个服务商的熔断器：连续失败达到阈值后熔断，冷却结束后只放行一个探测请求"""
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """当前是否可以向该服务商发请求；熔断冷却结束后转为半开并放行一次探测"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """放行的请求没有得出结果（如对冲中落败被取消）时归还半开探测的名额"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "provider": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def _breakers():
+    return {}
+
+
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """按服务商名称取得进程内共享的熔断器"""
+    breakers = _breakers()
+    with _breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name)
+        return breakers[name]
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers().values())
+    return [b.stats() for b in sorted(breakers, key=lambda b: b.name)]
+
+
+# 一次带故障转移的流式请求的结果：最终使用的服务商与模型，以及每次切换的原因
+FailoverResult = namedtuple("FailoverResult", ["response", "provider", "model", "timer", "reasons"])
+
+
+def stream_with_failover(candidates, payload, page, username=None):
+    """按顺序尝试 candidates 中的 (服务商, 模型, URL, API Key)，返回第一个成功建立的流
+
+    熔断中的服务商直接跳过；连接失败、限流或 5xx 时记一次失败并切换到下一个。
+    其余错误（如 400/401）属于请求本身的问题，不再切换，原样返回给页面显示。
+    所有候选都失败时 response 为最后一次的响应（可能为 None）。
+    """
+    client = get_async_client()
+    reasons = []
+    last = FailoverResult(None, None, None, None, reasons)
+    for provider, model, url, api_key in candidates:
+        breaker = get_breaker(provider)
+        if not breaker.allow():
+            reasons.append(f"{provider} 熔断中，已跳过")
+            continue
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        timer = start_completion(provider, model, page, username)
+        try:
+            response = client.stream("POST", url, headers=headers, json=dict(payload, model=model), timer=timer)
+            status = response.wait_status()
+        except Exception as e:
+            timer.fail("connect_error")
+            breaker.record_failure(str(e))
+            reasons.append(f"{provider} 连接失败: {e}")
+            continue
+        last = FailoverResult(response, provider, model, timer, reasons)
+        if status == 200:
+            breaker.record_success()
+            return last
+        timer.fail(status)
+        if status not in FAILOVER_STATUS:
+            # 服务商能正常应答，熔断器按成功处理
+            breaker.record_success()
+            return last
+        breaker.record_failure(f"HTTP {status}")
+        reasons.append(f"{provider} 返回 HTTP {status}")
+    return last
+
+
+def assistant_message(content, result):
+    """助手消息附带实际使用的模型；发生过切换时一并记录原因"""
+    message = {"role": "assistant", "content": content, "model": f"{result.provider}/{result.model}"}
+    if result.reasons:
+        message["failover"] = "；".join(result.reasons)
+    return message
@@ -1,4 +1,4 @@
-import requests
+from tools import http_client
 import streamlit as st
 from tools.chat_histor import save_data
 
@@ -11,14 +11,14 @@ def upload_and_extract_file(api_key, base_url, file, username, message_history):
     }
 
     # 上传文件
-    response = requests.post(f"{base_url}/files", headers=headers, files=files)
+    response = http_client.post(f"{base_url}/files", headers=headers, files=files)
 
     if response.status_code == 200:
         file_object = response.json()
         file_id = file_object['id']
 
         # 获取文件内容
-        response = requests.get(f"{base_url}/files/{file_id}/content", headers=headers)
+        response = http_client.get(f"{base_url}/files/{file_id}/content", headers=headers)
         if response.status_code == 200:
             file_content = response.text
 
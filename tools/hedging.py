@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import namedtuple
+
+import streamlit as st
+
+from tools.async_client import get_async_client
+from tools.failover import FAILOVER_STATUS, FailoverResult, get_breaker
+from tools.metrics import get_registry, percentile, start_completion
+
+
+def _hedging_setting(name, default):
+    """读取 secrets.toml 中 [hedging] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("hedging", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 首字等待预算取该模型最近成功请求首字延迟的第几百分位；样本不足时使用默认预算（秒）
+HEDGE_PERCENTILE = float(_hedging_setting("percentile", 95))
+HEDGE_MIN_SAMPLES = int(_hedging_setting("min_samples", 20))
+HEDGE_DEFAULT_BUDGET = float(_hedging_setting("default_budget", 3.0))
+HEDGE_MIN_BUDGET = float(_hedging_setting("min_budget", 0.5))
+# 两路请求竞速时轮询各自队列的间隔（秒）
+POLL_INTERVAL = 0.02
+
+# 对冲请求的目标：服务商、模型、URL、API Key 与完整请求体
+HedgeTarget = namedtuple("HedgeTarget", ["provider", "model", "url", "api_key", "payload"])
+
+
+def hedge_budget(provider, model):
+    """该模型首字延迟的百分位预算，超过预算仍未收到首字才发出对冲请求"""
+    records = get_registry().records(provider=provider, model=model, status="ok")
+    ttfts = [r["ttft"] for r in records if r["ttft"] is not None]
+    if len(ttfts) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_BUDGET
+    return max(HEDGE_MIN_BUDGET, percentile(ttfts, HEDGE_PERCENTILE))
+
+
+class HedgeStats:
+    """按模型统计：作为首选的请求数、触发对冲的次数，以及在对冲竞速中胜出的次数"""
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def _row(self, provider, model):
+        return self._rows.setdefault((provider, model), {"requests": 0, "hedged": 0, "wins": 0})
+
+    def record(self, primary, hedged=False, winner=None):
+        with self._lock:
+            row = self._row(*primary)
+            row["requests"] += 1
+            if hedged:
+                row["hedged"] += 1
+                if winner is not None:
+                    self._row(*winner)["wins"] += 1
+
+    def summary(self):
+        with self._lock:
+            rows = []
+            for (provider, model), row in sorted(self._rows.items()):
+                rate = row["hedged"] / row["requests"] if row["requests"] else None
+                rows.append(dict(provider=provider, model=model, hedge_rate=round(rate, 3) if rate is not None else None, **row))
+            return rows
+
+
+@st.cache_resource(show_spinner=False)
+def get_hedge_stats():
+    return HedgeStats()
+
+
+class _Racer:
+    def __init__(self, provider, model, handle, timer):
+        self.provider = provider
+        self.model = model
+        self.handle = handle
+        self.timer = timer
+        self.buffer = []
+        self.finished = False
+
+    def poll(self, timeout):
+        """取一个事件放入缓冲，收到文本增量返回 True"""
+        delta = self.handle.get(timeout=timeout)
+        if delta is None:
+            return False
+        self.buffer.append(delta)
+        if delta.kind == "done":
+            self.finished = True
+        return delta.kind == "content"
+
+    def cancel(self):
+        self.handle.close()
+        status = self.handle.status_code
+        self.timer.finish(status="hedge_lost" if status in (None, 200) else status)
+
+
+def _record_backup(breaker, handle):
+    """按对冲请求的结果更新熔断器，判定与 stream_with_failover 一致；还没拿到响应头就被取消时不计结果"""
+    try:
+        status = handle.wait_status(0)
+    except Exception as e:
+        breaker.record_failure(str(e))
+        return
+    if status is None:
+        breaker.release()
+    elif status in FAILOVER_STATUS:
+        breaker.record_failure(f"HTTP {status}")
+    else:
+        breaker.record_success()
+
+
+class ReplayStream:
+    """胜出的流：先重放竞速期间缓冲的事件，再继续消费原来的流"""
+
+    def __init__(self, handle, buffered):
+        self.handle = handle
+        self.buffered = buffered
+
+    @property
+    def status_code(self):
+        return self.handle.status_code
+
+    @property
+    def text(self):
+        return self.handle.text
+
+    def wait_status(self, timeout=None):
+        return self.handle.wait_status(timeout)
+
+    def __iter__(self):
+        for delta in self.buffered:
+            yield delta
+        if self.buffered and self.buffered[-1].kind == "done":
+            return
+        for delta in self.handle:
+            yield delta
+
+    def close(self):
+        self.handle.close()
+
+
+def hedge(result, backups, page, username=None, budget=None):
+    """在已建立的流 result 上做对冲：首字超过预算时向 backups 中第一个未熔断的目标再发一份请求，
+    先产出文本的一路胜出，另一路立即取消。对冲请求的结果计入该服务商的熔断器。返回胜出一路的 FailoverResult。"""
+    stats = get_hedge_stats()
+    primary = _Racer(result.provider, result.model, result.response, result.timer)
+    budget = budget if budget is not None else hedge_budget(result.provider, result.model)
+    deadline = time.monotonic() + budget
+    while not primary.finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if primary.poll(remaining):
+            stats.record((primary.provider, primary.model))
+            return result._replace(response=ReplayStream(primary.handle, primary.buffer))
+    # 只向熔断器放行的服务商发对冲请求，找到第一个即停止，避免占用其他服务商的半开探测名额
+    target = None if primary.finished else next((t for t in backups if get_breaker(t.provider).allow()), None)
+    if target is None:
+        stats.record((primary.provider, primary.model))
+        return result._replace(response=ReplayStream(primary.handle, primary.buffer))
+
+    breaker = get_breaker(target.provider)
+    timer = start_completion(target.provider, target.model, page, username)
+    headers = {"Authorization": f"Bearer {target.api_key}", "Content-Type": "application/json"}
+    try:
+        handle = get_async_client().stream("POST", target.url, headers=headers,
+                                           json=dict(target.payload, model=target.model), timer=timer)
+    except Exception as e:
+        timer.fail("connect_error")
+        breaker.record_failure(str(e))
+        stats.record((primary.provider, primary.model))
+        return result._replace(response=ReplayStream(primary.handle, primary.buffer))
+    backup = _Racer(target.provider, target.model, handle, timer)
+    racers = [primary, backup]
+    winner = None
+    while winner is None and not all(r.finished for r in racers):
+        for racer in racers:
+            if not racer.finished and racer.poll(POLL_INTERVAL):
+                winner = racer
+                break
+    # 两路都没有产出文本时仍以首选的结果为准
+    winner = winner or primary
+    for racer in racers:
+        if racer is not winner:
+            racer.cancel()
+    _record_backup(breaker, backup.handle)
+    stats.record((primary.provider, primary.model), hedged=True, winner=(winner.provider, winner.model))
+    reasons = list(result.reasons)
+    reasons.append(f"{primary.provider} 首字超过 {budget:.1f}s，对冲请求 {target.provider}，{winner.provider} 胜出")
+    return FailoverResult(ReplayStream(winner.handle, winner.buffer), winner.provider, winner.model, winner.timer, reasons)
@@ -0,0 +1,129 @@
+import os
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from tools import cassette, rate_limit
+from tools.retry import call_with_retry
+
+
+def _http_setting(name, default):
+    """读取 secrets.toml 中 [http] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("http", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 每个服务商主机保持的长连接数量，以及连接/读取超时（秒）
+POOL_SIZE = int(_http_setting("pool_size", 16))
+CONNECT_TIMEOUT = float(_http_setting("connect_timeout", 5))
+READ_TIMEOUT = float(_http_setting("read_timeout", 120))
+# 把服务商地址改写到其他地址（如本地模拟服务）的环境变量，等同于 [http] base_urls 中的 "*"
+BASE_URL_ENV = "PROVIDER_BASE_URL"
+
+
+def base_url_overrides():
+    """主机名 -> 替换用的基础地址；[http] base_urls 按主机配置，"*" 匹配所有主机"""
+    overrides = dict(_http_setting("base_urls", {}))
+    if os.environ.get(BASE_URL_ENV):
+        overrides["*"] = os.environ[BASE_URL_ENV]
+    return overrides
+
+
+def rewrite_url(url):
+    """按配置把请求地址的协议与主机换成替换地址，路径与查询参数保持不变；未配置时原样返回"""
+    overrides = base_url_overrides()
+    if not overrides:
+        return url
+    parts = urlsplit(url)
+    base = overrides.get(parts.netloc) or overrides.get("*")
+    if not base:
+        return url
+    target = urlsplit(base)
+    if target.netloc == parts.netloc:
+        return url
+    return urlunsplit((target.scheme, target.netloc, target.path.rstrip("/") + parts.path, parts.query, parts.fragment))
+
+
+class ProviderSession(requests.Session):
+    """单个服务商主机共用的 keep-alive 会话，未显式传入 timeout 时使用默认超时"""
+
+    def __init__(self, host, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        super().__init__()
+        self.host = host
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.mount("https://", self.adapter)
+        self.mount("http://", self.adapter)
+
+    def request(self, method, url, **kwargs):
+        """统一的重试入口：连接失败、限流与网关错误按退避策略重试，流式请求只在收到响应头之前重试"""
+        kwargs.setdefault("timeout", self.timeout)
+        return call_with_retry(method, url, lambda: self._send_limited(method, url, kwargs), kwargs)
+
+    def _send_limited(self, method, url, kwargs):
+        """发请求前先经过服务商限流；流式响应在关闭后才归还并发配额
+
+        限流、重试预算与连接池仍按原始地址的服务商统计，只有真正发出的请求才改写地址。
+        """
+        slot = rate_limit.acquire(url, rate_limit.model_of(kwargs))
+        try:
+            response = cassette.send(method, url, kwargs,
+                                     lambda: requests.Session.request(self, method, rewrite_url(url), **kwargs))
+        except BaseException:
+            slot.release()
+            raise
+        if kwargs.get("stream") and response.status_code == 200:
+            return rate_limit.release_with(response, slot)
+        slot.release()
+        return response
+
+    def stats(self):
+        """统计连接池新建与复用的连接数"""
+        opened = requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            "host": self.host,
+            "requests": requests_sent,
+            "opened": opened,
+            "reused": max(requests_sent - opened, 0),
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def _provider_session(host):
+    return ProviderSession(host)
+
+
+@st.cache_resource(show_spinner=False)
+def _known_hosts():
+    return set()
+
+
+def get_session(url):
+    """按 URL 的主机名取得进程内共享的会话，同一服务商的请求复用 TCP+TLS 连接"""
+    host = urlsplit(url).netloc
+    _known_hosts().add(host)
+    return _provider_session(host)
+
+
+def post(url, **kwargs):
+    return get_session(url).post(url, **kwargs)
+
+
+def get(url, **kwargs):
+    return get_session(url).get(url, **kwargs)
+
+
+def pool_stats():
+    """返回所有服务商连接池的复用统计"""
+    return [_provider_session(host).stats() for host in sorted(_known_hosts())]
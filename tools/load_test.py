@@ -0,0 +1,318 @@
+"""并发会话压测：在本地模拟服务商上模拟 N 个用户同时进行多轮对话，统计首字延迟、整轮耗时与资源占用。
+
+每个 worker 进程相当于一个 Streamlit 副本，进程内用线程模拟并发会话。各场景按页面的方式组装请求，
+走页面共用的同一套请求链路：连接池、限流、重试、故障转移、SSE 解析、指标计时与节流渲染。
+
+用法：python -m tools.load_test --users 40 --workers 4 --turns 3 --scenario all --out load_report
+不传 --base-url 时在本进程内启动 tools.mock_provider，传入时压测已在运行的模拟服务。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+
+from tools.http_client import BASE_URL_ENV
+
+# 与各页面使用的地址一致，请求会被 PROVIDER_BASE_URL 改写到模拟服务
+CHAT_URLS = {
+    "Deepseek": "https://api.deepseek.com/v1/chat/completions",
+    "Moonshot": "https://api.moonshot.cn/v1/chat/completions",
+    "Yi": "https://api.lingyiwanwu.com/v1/chat/completions",
+    "Baichuan": "https://api.baichuan-ai.com/v1/chat/completions",
+}
+MOCK_KEY = "mock-key"
+QUESTIONS = [
+    "最近总是头痛，还有点发烧，应该挂什么科？",
+    "帮我解释一下什么是梯度下降。",
+    "知识库里关于报销流程是怎么规定的？",
+    "今天心情不太好，陪我聊聊天吧。",
+    "用 Python 写一个快速排序。",
+    "这份文档的主要结论是什么？",
+]
+PERCENTILES = (50, 95, 99)
+
+
+class _NullPlaceholder:
+    """代替 st.empty() 的占位符，只统计刷新次数，保留 TokenRenderer 的合并与节流开销"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def markdown(self, text):
+        self.calls += 1
+
+
+def _consume(deltas, started, timer, transform=None):
+    """与 render_deltas 相同的消费方式：计时器记录每个增量，TokenRenderer 节流刷新"""
+    from tools.stream_render import TokenRenderer
+
+    renderer = TokenRenderer(_NullPlaceholder(), transform=transform)
+    ttft = None
+    status = "error"
+    try:
+        for delta in deltas:
+            timer.on_delta(delta)
+            if delta.kind == "content":
+                if ttft is None:
+                    ttft = time.monotonic() - started
+                renderer.push(delta.content)
+            elif delta.kind == "done":
+                renderer.flush()
+        status = "ok"
+    finally:
+        content = renderer.close()
+        timer.finish(status=status, content=content)
+    return ttft, content
+
+
+def _post_stream(provider, model, page, url, payload, user, extract_kwargs=None, transform=None):
+    from tools import http_client
+    from tools.metrics import start_completion
+    from tools.sse_stream import iter_deltas
+
+    headers = {"Authorization": f"Bearer {MOCK_KEY}", "Content-Type": "application/json"}
+    started = time.monotonic()
+    timer = start_completion(provider, model, page, user)
+    response = http_client.post(url, headers=headers, json=payload, stream=True)
+    if response.status_code != 200:
+        timer.fail(response.status_code)
+        response.close()
+        return f"HTTP {response.status_code}", None, ""
+    ttft, content = _consume(iter_deltas(response, timer=timer, **(extract_kwargs or {})), started, timer, transform)
+    return "ok", ttft, content
+
+
+def multimodel_turn(user, history):
+    """MultiModelAI：按故障转移链经异步客户端建立流"""
+    from tools.failover import stream_with_failover
+
+    candidates = [("Deepseek", "deepseek-chat", CHAT_URLS["Deepseek"], MOCK_KEY),
+                  ("Moonshot", "moonshot-v1-32k", CHAT_URLS["Moonshot"], MOCK_KEY)]
+    payload = {"messages": history, "max_tokens": 512, "top_p": 0.8, "temperature": 0.7, "stream": True}
+    started = time.monotonic()
+    result = stream_with_failover(candidates, payload, "MultiModelAI", user)
+    if result.response is None or result.response.status_code != 200:
+        status = result.response.status_code if result.response is not None else "unavailable"
+        return f"HTTP {status}", None, ""
+    ttft, content = _consume(result.response, started, result.timer)
+    return "ok", ttft, content
+
+
+def knowledge_turn(user, history):
+    """Knowledge：只发送当前问题，附带知识库检索工具"""
+    payload = {
+        "model": "Baichuan4",
+        "messages": [history[-1]],
+        "tools": [{"type": "retrieval", "retrieval": {"kb_ids": ["kb-mock"]}}],
+        "stream": True,
+    }
+    return _post_stream("Baichuan", "Baichuan4", "Knowledge", CHAT_URLS["Baichuan"], payload, user)
+
+
+def characters_turn(user, history):
+    """CharactersAi：百川角色大模型，附带 character_profile"""
+    payload = {
+        "model": "Baichuan-NPC-Turbo",
+        "character_profile": {"character_id": 1},
+        "messages": history,
+        "temperature": 0.9,
+        "top_p": 0.3,
+        "stream": True,
+    }
+    return _post_stream("Baichuan", "Baichuan-NPC-Turbo", "CharactersAi", CHAT_URLS["Baichuan"], payload, user)
+
+
+def doctor_turn(user, history):
+    """Doctor：零一万物 yi-large-rag，渲染时去掉引用角标"""
+    payload = {"model": "yi-large-rag", "messages": history, "temperature": 0.9, "top_p": 0.3, "stream": True}
+    return _post_stream("Yi", "yi-large-rag", "Doctor", CHAT_URLS["Yi"], payload, user,
+                        transform=lambda text: re.sub(r"<sup>\d+</sup>", "", text))
+
+
+SCENARIOS = {
+    "MultiModelAI": multimodel_turn,
+    "Knowledge": knowledge_turn,
+    "CharactersAi": characters_turn,
+    "Doctor": doctor_turn,
+}
+
+
+def _simulate_user(user, scenario, turns, think_time, results, lock):
+    rng = random.Random(user)
+    history = [{"role": "system", "content": "你是一个乐于助人的助手。"}]
+    for _ in range(turns):
+        history.append({"role": "user", "content": rng.choice(QUESTIONS)})
+        started = time.monotonic()
+        try:
+            status, ttft, content = SCENARIOS[scenario](user, history)
+        except Exception as e:
+            status, ttft, content = type(e).__name__, None, ""
+        record = {"scenario": scenario, "status": status, "ttft": ttft,
+                  "e2e": time.monotonic() - started, "chars": len(content)}
+        with lock:
+            results.append(record)
+        if content:
+            history.append({"role": "assistant", "content": content})
+        else:
+            history.pop()
+        time.sleep(rng.uniform(0, think_time))
+
+
+def run_worker(worker_id, users, scenarios, turns, think_time, base_url):
+    """一个 worker 进程：每个模拟用户一个线程，结束后返回每轮记录与本进程的资源占用"""
+    os.environ[BASE_URL_ENV] = base_url
+    results = []
+    lock = threading.Lock()
+    # CPU 只统计压测期间的增量，不含进程启动与模块导入
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    threads = [threading.Thread(target=_simulate_user,
+                                args=(f"load-{worker_id}-{user}", scenarios[user % len(scenarios)], turns,
+                                      think_time, results, lock), daemon=True)
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - before.ru_utime - before.ru_stime
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    from tools.rate_limit import limiter_stats
+    return {
+        "worker": worker_id,
+        "users": len(users),
+        "turns": len(results),
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / wall, 1) if wall else None,
+        "max_rss_mb": round(rss_mb, 1),
+        "throttled": sum(row["throttled"] for row in limiter_stats()),
+        "records": results,
+    }
+
+
+def _summarize(records, wall):
+    from tools.metrics import percentile
+
+    ok = [r for r in records if r["status"] == "ok"]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    e2es = [r["e2e"] for r in ok]
+    summary = {"turns": len(records), "errors": len(records) - len(ok),
+               "turns_per_sec": round(len(ok) / wall, 3) if wall else None,
+               "chars_per_sec": round(sum(r["chars"] for r in ok) / wall, 1) if wall else None}
+    for q in PERCENTILES:
+        value = percentile(ttfts, q)
+        summary[f"ttft_p{q}"] = round(value, 3) if value is not None else None
+    for q in PERCENTILES:
+        value = percentile(e2es, q)
+        summary[f"e2e_p{q}"] = round(value, 3) if value is not None else None
+    return summary
+
+
+def build_report(workers, wall, config):
+    records = [r for w in workers for r in w["records"]]
+    scenarios = sorted({r["scenario"] for r in records})
+    errors = {}
+    for r in records:
+        if r["status"] != "ok":
+            errors[r["status"]] = errors.get(r["status"], 0) + 1
+    return {
+        "config": config,
+        "wall_seconds": round(wall, 3),
+        "overall": _summarize(records, wall),
+        "scenarios": {name: _summarize([r for r in records if r["scenario"] == name], wall) for name in scenarios},
+        "errors": errors,
+        "workers": [{k: v for k, v in w.items() if k != "records"} for w in workers],
+    }
+
+
+def _table(rows, columns):
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    for row in rows:
+        lines.append("| " + " | ".join("" if row.get(c) is None else str(row.get(c)) for c in columns) + " |")
+    return lines
+
+
+def to_markdown(report):
+    config = report["config"]
+    columns = ["name", "turns", "errors", "ttft_p50", "ttft_p95", "ttft_p99", "e2e_p50", "e2e_p95", "e2e_p99",
+               "turns_per_sec", "chars_per_sec"]
+    rows = [dict(name="全部", **report["overall"])]
+    rows += [dict(name=name, **summary) for name, summary in report["scenarios"].items()]
+    lines = [
+        "## 压测报告",
+        "",
+        f"{config['users']} 个用户，{config['workers']} 个 worker，每人 {config['turns']} 轮，"
+        f"思考时间 ≤{config['think_time']}s，总耗时 {report['wall_seconds']}s（时间单位：秒）",
+        "",
+    ]
+    lines += _table(rows, columns)
+    lines += ["", "### 各 worker 资源占用", ""]
+    lines += _table(report["workers"], ["worker", "users", "turns", "wall_seconds", "cpu_seconds", "cpu_percent",
+                                        "max_rss_mb", "throttled"])
+    if report["errors"]:
+        lines += ["", "### 错误", ""]
+        lines += _table([{"status": k, "count": v} for k, v in sorted(report["errors"].items())], ["status", "count"])
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发会话压测")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2, help="worker 进程数，相当于 Streamlit 副本数")
+    parser.add_argument("--turns", type=int, default=3, help="每个用户的对话轮数")
+    parser.add_argument("--think-time", type=float, default=1.0, help="两轮之间的最长思考时间（秒）")
+    parser.add_argument("--scenario", default="all", choices=["all"] + sorted(SCENARIOS))
+    parser.add_argument("--base-url", default=None, help="已在运行的模拟服务地址")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default=None, help="报告文件名前缀，生成 .json 与 .md")
+    args = parser.parse_args(argv)
+
+    scenarios = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    mock = None
+    base_url = args.base_url
+    if base_url is None:
+        from tools.mock_provider import MockProvider
+        mock = MockProvider(tokens_per_sec=args.tokens_per_sec, first_token_delay=args.first_token_delay,
+                            response_tokens=args.response_tokens, error_rate=args.error_rate,
+                            error_status=502).start()
+        base_url = mock.base_url
+
+    users = list(range(args.users))
+    shards = [users[i::args.workers] for i in range(args.workers)]
+    started = time.monotonic()
+    try:
+        # spawn 启动的 worker 与 Streamlit 副本一样各自持有连接池、限流器与指标注册表
+        with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+            workers = pool.starmap(run_worker, [(i, shard, scenarios, args.turns, args.think_time, base_url)
+                                                for i, shard in enumerate(shards) if shard])
+    finally:
+        if mock is not None:
+            mock.stop()
+    wall = time.monotonic() - started
+
+    config = {k: v for k, v in vars(args).items() if k != "out"}
+    config["base_url"] = base_url
+    report = build_report(workers, wall, config)
+    markdown = to_markdown(report)
+    if args.out:
+        with open(f"{args.out}.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(f"{args.out}.md", "w", encoding="utf-8") as f:
+            f.write(markdown + "\n")
+    print(markdown)
+
+
+if __name__ == "__main__":
+    main()
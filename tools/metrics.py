@@ -0,0 +1,227 @@
+import re
+import threading
+import time
+from collections import deque
+
+import streamlit as st
+
+# 注册表只保留最近的若干条补全记录
+MAX_RECORDS = 2000
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿]")
+
+
+def estimate_tokens(text):
+    """服务商未返回 usage 时的粗略估算：汉字按 1 token，其余字符按 4 个字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def percentile(values, q):
+    """线性插值百分位，q 取 0~100"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class CompletionTimer:
+    """记录一次补全从发起请求到最后一个增量的各个时间点"""
+
+    def __init__(self, provider, model, page, user, registry=None):
+        self.provider = provider
+        self.model = model
+        self.page = page
+        self.user = user
+        self.registry = registry
+        self.started = time.monotonic()
+        self.first_byte = None
+        self.first_delta = None
+        self.last_delta = None
+        self.chunks = 0
+        self.chars = 0
+        self.usage_tokens = None
+        self.record = None
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = time.monotonic()
+
+    def on_delta(self, delta):
+        now = time.monotonic()
+        usage = delta.data.get("usage") if isinstance(delta.data, dict) else None
+        if usage and usage.get("completion_tokens"):
+            self.usage_tokens = usage["completion_tokens"]
+        if delta.kind != "content":
+            return
+        self.mark_first_byte()
+        if self.first_delta is None:
+            self.first_delta = now
+        self.last_delta = now
+        self.chunks += 1
+        self.chars += len(delta.content)
+
+    def finish(self, status="ok", content=""):
+        """结束计时并写入注册表，重复调用只记录一次"""
+        if self.record is not None:
+            return self.record
+        ended = time.monotonic()
+        tokens = self.usage_tokens if self.usage_tokens is not None else estimate_tokens(content)
+        generation = (self.last_delta - self.first_delta) if self.first_delta and self.last_delta else 0.0
+        self.record = {
+            "provider": self.provider,
+            "model": self.model,
+            "page": self.page,
+            "user": self.user,
+            "status": str(status),
+            "timestamp": time.time(),
+            "ttfb": _since(self.started, self.first_byte),
+            "ttft": _since(self.started, self.first_delta),
+            "total": ended - self.started,
+            "chunks": self.chunks,
+            "chars": self.chars,
+            "tokens": tokens,
+            "tokens_per_sec": tokens / generation if generation > 0 else None,
+        }
+        (self.registry or get_registry()).add(self.record)
+        return self.record
+
+    def fail(self, status):
+        return self.finish(status=status)
+
+
+def _since(start, mark):
+    return mark - start if mark is not None else None
+
+
+class MetricsRegistry:
+    """进程内共享的补全指标注册表，所有会话写入同一份数据"""
+
+    def __init__(self, max_records=MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(record)
+
+    def subscribe(self, listener):
+        """注册回调，每条新记录写入后调用一次"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def records(self, **filters):
+        with self._lock:
+            records = list(self._records)
+        return [r for r in records if all(r.get(k) == v for k, v in filters.items())]
+
+    def summary(self, keys=("provider", "model")):
+        """按 provider/model 汇总：请求数、错误率、首字延迟 p50/p95、平均吞吐"""
+        groups = {}
+        for record in self.records():
+            groups.setdefault(tuple(record[k] for k in keys), []).append(record)
+        rows = []
+        for group_key, records in sorted(groups.items()):
+            ok = [r for r in records if r["status"] == "ok"]
+            ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+            rates = [r["tokens_per_sec"] for r in ok if r["tokens_per_sec"]]
+            row = dict(zip(keys, group_key))
+            row.update({
+                "requests": len(records),
+                "error_rate": round(1 - len(ok) / len(records), 3),
+                "ttft_p50": _round(percentile(ttfts, 50)),
+                "ttft_p95": _round(percentile(ttfts, 95)),
+                "tokens_per_sec": _round(sum(rates) / len(rates)) if rates else None,
+            })
+            rows.append(row)
+        return rows
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_registry():
+    return MetricsRegistry()
+
+
+def current_user():
+    """登录组件把用户名保存在 cookies 中，没有显式传入用户名的调用点从这里取"""
+    try:
+        return st.session_state["cookies"]["__streamlit_login_signup_ui_username__"]
+    except (KeyError, TypeError):
+        return None
+
+
+def start_completion(provider, model, page, user=None):
+    """页面在发起请求前调用，返回的计时器交给流式解析与渲染环节填充"""
+    return CompletionTimer(provider, model, page, user or current_user())
+
+
+def show_metrics_sidebar():
+    """侧边栏可选的性能指标面板"""
+    from tools.chat_cache import get_conversation_cache
+    from tools.chat_histor import get_write_queue
+    from tools.failover import breaker_stats
+    from tools.hedging import get_hedge_stats
+    from tools.http_client import pool_stats
+    from tools.rate_limit import limiter_stats
+    from tools.response_cache import get_response_cache
+    from tools.retry import retry_stats
+    from tools.semantic_cache import semantic_stats
+    from tools.single_flight import get_single_flight
+
+    if not st.sidebar.checkbox("显示性能指标", value=False):
+        return
+    with st.sidebar.expander("性能指标", expanded=True):
+        rows = get_registry().summary()
+        if rows:
+            st.table(rows)
+        else:
+            st.write("暂无补全记录")
+        if st.session_state.get("render_stats"):
+            st.write("上一次回答的渲染统计:", st.session_state["render_stats"])
+        stats = pool_stats()
+        if stats:
+            st.write("连接池复用统计:")
+            st.table(stats)
+        limits = limiter_stats()
+        if limits:
+            st.write("服务商限流:")
+            st.table(limits)
+        retries = retry_stats()
+        if retries:
+            st.write("重试统计:")
+            st.table(retries)
+        hedges = get_hedge_stats().summary()
+        if hedges:
+            st.write("对冲请求统计:")
+            st.table(hedges)
+        cache = get_response_cache().stats()
+        if cache["hits"] or cache["misses"]:
+            st.write("回答缓存:", cache)
+        semantic = semantic_stats()
+        if semantic:
+            st.write("语义缓存:")
+            st.table(semantic)
+        conversations = get_conversation_cache().stats()
+        if conversations["hits"] or conversations["misses"]:
+            st.write("会话缓存:", conversations)
+        queue = get_write_queue()
+        if queue is not None and queue.stats()["enqueued"]:
+            st.write("会话写入队列:", queue.stats())
+        flights = get_single_flight().stats()
+        if flights["coalesced"]:
+            st.write("合并的相同请求:", flights)
+        breakers = breaker_stats()
+        if breakers:
+            st.write("服务商熔断状态:")
+            st.table(breakers)
@@ -0,0 +1,341 @@
+"""本地模拟服务商：实现页面用到的 OpenAI 兼容接口以及天工、讯飞智文等接口的响应格式，用于测试与压测。
+
+进程内使用：
+    with MockProvider(tokens_per_sec=80) as mock:
+        os.environ["PROVIDER_BASE_URL"] = mock.base_url
+
+作为子进程使用：python -m tools.mock_provider --port 8765 --tokens-per-sec 50 --first-token-delay 0.3
+然后设置环境变量 PROVIDER_BASE_URL=http://127.0.0.1:8765，所有服务商请求都会被改写到这里。
+
+单个请求可以用请求头覆盖配置：X-Mock-Error（返回指定状态码）、X-Mock-Truncate（流式响应中途断开）、
+X-Mock-Tokens（回答长度）。
+"""
+import argparse
+import base64
+import itertools
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# 回答文本循环使用的片段，每个片段视为一个 token
+SAMPLE_TOKENS = ["这是", "一段", "来自", "本地", "模拟", "服务", "的", "回答", "，", "用于",
+                 "测试", "流式", "渲染", "与", "延迟", "指标", "。", "\n"]
+# 1x1 透明 PNG，模拟图片生成的下载地址返回它
+PNG_PIXEL = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+class MockConfig:
+    """模拟服务的行为参数"""
+
+    def __init__(self, tokens_per_sec=50.0, first_token_delay=0.3, response_tokens=200, error_rate=0.0,
+                 error_status=429, truncate_rate=0.0, seed=None):
+        self.tokens_per_sec = tokens_per_sec
+        self.first_token_delay = first_token_delay
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.truncate_rate = truncate_rate
+        self.random = random.Random(seed)
+
+
+def sample_text(tokens):
+    return list(itertools.islice(itertools.cycle(SAMPLE_TOKENS), tokens))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockProvider/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    # ---- 基础工具 ----
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        try:
+            return json.loads(self._body() or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _injected_error(self):
+        """按请求头或配置的错误率返回要注入的错误状态码"""
+        forced = self.headers.get("X-Mock-Error")
+        if forced:
+            return int(forced)
+        if self.config.error_rate and self.config.random.random() < self.config.error_rate:
+            return self.config.error_status
+        return None
+
+    def _send_error_status(self, status):
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        data = json.dumps({"error": {"message": f"mock error {status}", "code": status}}).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _tokens(self):
+        return sample_text(int(self.headers.get("X-Mock-Tokens") or self.config.response_tokens))
+
+    def _truncate_at(self, tokens):
+        truncate = self.headers.get("X-Mock-Truncate")
+        if truncate or (self.config.truncate_rate and self.config.random.random() < self.config.truncate_rate):
+            return len(tokens) // 2
+        return None
+
+    def _stream(self, events, truncate_at=None):
+        """以 SSE 分块发送事件：首个事件前等待首字延迟，之后按 token 速率发送；truncate_at 处直接断开连接"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec else 0.0
+        time.sleep(self.config.first_token_delay)
+        for i, event in enumerate(events):
+            if truncate_at is not None and i >= truncate_at:
+                self.close_connection = True
+                return
+            self._chunk(f"data: {event}\n\n".encode("utf-8"))
+            if interval:
+                time.sleep(interval)
+        self._chunk(b"")
+
+    # ---- 路由 ----
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def _route(self, method):
+        path = urlsplit(self.path).path
+        self.server.count(path)
+        status = self._injected_error() if method == "POST" else None
+        if status is not None:
+            self._body()
+            self._send_error_status(status)
+            return
+        if path.endswith("/chat/completions"):
+            self._chat_completions()
+        elif path.endswith("/sky-work/api/v1/chat"):
+            self._tiangong_chat()
+        elif path.endswith("/audio/transcriptions"):
+            self._body()
+            self._send_json({"text": "这是一段模拟的语音转写结果。"})
+        elif path.endswith("/images/generations"):
+            self._images()
+        elif path.startswith("/api/aippt/"):
+            self._aippt(path)
+        elif "/files" in path:
+            self._files(method, path)
+        elif "/kbs" in path:
+            self._kbs(method, path)
+        elif path.startswith("/mock/"):
+            self._assets(path)
+        else:
+            self._body()
+            self._send_json({"error": {"message": f"unknown path {path}"}}, status=404)
+
+    def _chat_completions(self):
+        request = self._json_body()
+        model = request.get("model", "mock-model")
+        tokens = self._tokens()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        usage = {"prompt_tokens": sum(len(m.get("content") or "") for m in request.get("messages", [])),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if not request.get("stream"):
+            time.sleep(self.config.first_token_delay)
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        def events():
+            for token in tokens:
+                yield json.dumps({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                                  "choices": [{"index": 0, "delta": {"content": token}}]}, ensure_ascii=False)
+            yield json.dumps({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                              "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+            yield "[DONE]"
+
+        self._stream(events(), self._truncate_at(tokens))
+
+    def _tiangong_chat(self):
+        """天工 sky-work：arguments[0].messages[].text，每个事件带一段新文本"""
+        self._json_body()
+        tokens = self._tokens()
+        # 天工的解析按文本去重，模拟数据按句子合并成互不相同的片段
+        pieces = [f"{''.join(tokens[i:i + 8])}[{i // 8}]" for i in range(0, len(tokens), 8)]
+
+        def events():
+            for piece in pieces:
+                yield json.dumps({"type": 1, "arguments": [{"messages": [{"text": piece}]}]}, ensure_ascii=False)
+            yield json.dumps({"type": 2, "arguments": [{"messages": []}]})
+
+        self._stream(events(), self._truncate_at(pieces))
+
+    def _images(self):
+        self._json_body()
+        time.sleep(self.config.first_token_delay)
+        self._send_json({"created": int(time.time()), "data": [{"url": f"{self.server.base_url}/mock/image.png"}]})
+
+    def _aippt(self, path):
+        if path.endswith("/create"):
+            self._json_body()
+            self._send_json({"flag": True, "code": 0, "desc": "成功", "data": {"sid": uuid.uuid4().hex}})
+        else:
+            sid = parse_qs(urlsplit(self.path).query).get("sid", [""])[0]
+            self._send_json({"flag": True, "code": 0, "desc": "成功", "data": {
+                "sid": sid, "process": 100, "pptUrl": f"{self.server.base_url}/mock/mock.pptx"}})
+
+    def _files(self, method, path):
+        if method == "POST":
+            body = self._body()
+            self._send_json({"id": f"file-{uuid.uuid4().hex[:12]}", "object": "file", "bytes": len(body),
+                             "created_at": int(time.time()), "filename": "upload", "purpose": "file-extract",
+                             "status": "ok"})
+        elif path.endswith("/content"):
+            content = "".join(self._tokens())
+            self._send_json({"content": content, "file_type": "text/plain", "filename": "mock.txt",
+                             "title": "", "type": "file"})
+        elif path.endswith("/parsed-content"):
+            self._send_json({"status": "online", "content": "".join(self._tokens())})
+        else:
+            self._send_json({"data": []})
+
+    def _kbs(self, method, path):
+        if method == "GET":
+            self._send_json({"data": [{"id": "kb-mock", "name": "模拟知识库"}]})
+        elif path.endswith("/files"):
+            self._json_body()
+            self._send_json({"data": {"status": "ok"}})
+        else:
+            request = self._json_body()
+            self._send_json({"id": f"kb-{uuid.uuid4().hex[:8]}", "name": request.get("name", "kb")})
+
+    def _assets(self, path):
+        if path.endswith(".png"):
+            self._send_bytes(PNG_PIXEL, "image/png")
+        else:
+            self._send_bytes(b"PK\x05\x06" + b"\x00" * 18, "application/octet-stream")
+
+
+class MockProvider(ThreadingHTTPServer):
+    """在后台线程中运行的模拟服务，port=0 时自动分配端口"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None, **config_kwargs):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig(**config_kwargs)
+        self.requests = {}
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path):
+        with self._count_lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-provider", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start_subprocess(port, **options):
+    """以子进程方式启动模拟服务，返回 (Popen, base_url)；options 对应命令行参数，如 tokens_per_sec=80"""
+    args = [sys.executable, "-m", "tools.mock_provider", "--port", str(port)]
+    for name, value in options.items():
+        args += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    # 子进程打印出监听地址即表示已就绪
+    base_url = process.stdout.readline().strip()
+    return process, base_url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟服务商")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--response-tokens", type=int, default=200, help="每个回答的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回错误的比例")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="流式响应中途断开的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    config = MockConfig(args.tokens_per_sec, args.first_token_delay, args.response_tokens, args.error_rate,
+                        args.error_status, args.truncate_rate, args.seed)
+    server = MockProvider(args.host, args.port, config)
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
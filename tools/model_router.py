@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import namedtuple
+
+import streamlit as st
+
+from tools.failover import OPEN, get_breaker
+from tools.metrics import estimate_tokens, get_registry
+
+# 模型目录：(类别, 模型) -> 能力档位（1 基础 / 2 标准 / 3 高级）与上下文窗口（token）
+MODEL_CATALOG = {
+    ("GPT", "gpt-3.5-turbo"): {"tier": 1, "context": 16385},
+    ("GPT", "gpt-4"): {"tier": 3, "context": 8192},
+    ("GPT", "gpt-4o"): {"tier": 3, "context": 128000},
+    ("GPT", "gpt-4-all"): {"tier": 3, "context": 128000},
+    ("Deepseek", "deepseek-chat"): {"tier": 2, "context": 32768},
+    ("Deepseek", "deepseek-coder"): {"tier": 2, "context": 16384},
+    ("Yi", "yi-large"): {"tier": 3, "context": 32768},
+    ("Yi", "yi-medium"): {"tier": 2, "context": 16384},
+    ("Yi", "yi-medium-200k"): {"tier": 2, "context": 200000},
+    ("Yi", "yi-spark"): {"tier": 1, "context": 16384},
+    ("Yi", "yi-large-rag"): {"tier": 2, "context": 16384},
+    ("Yi", "yi-large-turbo"): {"tier": 3, "context": 16384},
+    ("Yi", "yi-large-preview"): {"tier": 3, "context": 16384},
+    ("Moonshot", "moonshot-v1-8k"): {"tier": 2, "context": 8192},
+    ("Moonshot", "moonshot-v1-32k"): {"tier": 2, "context": 32768},
+    ("Moonshot", "moonshot-v1-128k"): {"tier": 2, "context": 131072},
+    ("Baichuan", "Baichuan4"): {"tier": 3, "context": 32768},
+    ("Baichuan", "Baichuan3-Turbo"): {"tier": 2, "context": 32768},
+    ("Baichuan", "Baichuan3-Turbo-128k"): {"tier": 2, "context": 131072},
+    ("Baichuan", "Baichuan2-Turbo"): {"tier": 1, "context": 32768},
+    ("Baichuan", "Baichuan2-Turbo-192k"): {"tier": 1, "context": 196608},
+}
+
+# EWMA 平滑系数，越大越偏向最近的请求
+EWMA_ALPHA = 0.3
+# 还没有样本的模型使用的先验值：首字延迟（秒）与吞吐（token/秒）
+PRIOR_TTFT = 2.0
+PRIOR_TOKENS_PER_SEC = 30.0
+# 估算总耗时时假定的回答长度上限（token）
+EXPECTED_TOKENS = 300
+# 错误率 EWMA 超过该值视为不健康
+MAX_ERROR_RATE = 0.5
+# 没有新样本时错误率按该半衰期（秒）衰减，不健康的模型过一段时间会重新获得流量
+ERROR_HALF_LIFE = 60.0
+
+
+class ModelHealth:
+    """单个模型的实时 EWMA：首字延迟、吞吐与错误率"""
+
+    def __init__(self):
+        self.ttft = None
+        self.tokens_per_sec = None
+        self._error_rate = 0.0
+        self._updated = time.monotonic()
+        self.samples = 0
+
+    @staticmethod
+    def _ewma(current, value):
+        return value if current is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * current
+
+    def update(self, record):
+        status = record["status"]
+        if status in ("cancelled", "hedge_lost"):
+            # 用户主动停止或对冲落败不代表模型有问题
+            return
+        self.samples += 1
+        ok = status == "ok"
+        self._error_rate = self._ewma(self.error_rate, 0.0 if ok else 1.0)
+        self._updated = time.monotonic()
+        if ok and record["ttft"] is not None:
+            self.ttft = self._ewma(self.ttft, record["ttft"])
+        if ok and record["tokens_per_sec"]:
+            self.tokens_per_sec = self._ewma(self.tokens_per_sec, record["tokens_per_sec"])
+
+    @property
+    def error_rate(self):
+        return self._error_rate * 0.5 ** ((time.monotonic() - self._updated) / ERROR_HALF_LIFE)
+
+    def expected_latency(self, max_tokens):
+        ttft = self.ttft if self.ttft is not None else PRIOR_TTFT
+        rate = self.tokens_per_sec or PRIOR_TOKENS_PER_SEC
+        return ttft + min(max_tokens, EXPECTED_TOKENS) / rate
+
+
+class ModelRegistry:
+    """订阅补全指标，按 (类别, 模型) 维护 ModelHealth"""
+
+    def __init__(self, metrics=None):
+        self._health = {}
+        self._lock = threading.Lock()
+        (metrics or get_registry()).subscribe(self.observe)
+
+    def observe(self, record):
+        key = (record["provider"], record["model"])
+        with self._lock:
+            self._health.setdefault(key, ModelHealth()).update(record)
+
+    def health(self, category, model):
+        with self._lock:
+            return self._health.setdefault((category, model), ModelHealth())
+
+
+@st.cache_resource(show_spinner=False)
+def get_model_registry():
+    return ModelRegistry()
+
+
+RoutingDecision = namedtuple("RoutingDecision", ["category", "model", "reason", "rows"])
+
+
+def route(available, tier, messages, max_tokens):
+    """在 available 的 (类别, 模型) 中，选出满足能力档位与上下文长度、且健康的预计最快模型"""
+    registry = get_model_registry()
+    needed = sum(estimate_tokens(m.get("content") or "") for m in messages) + max_tokens
+    rows = []
+    for category, model in available:
+        spec = MODEL_CATALOG.get((category, model))
+        if spec is None:
+            continue
+        health = registry.health(category, model)
+        breaker_open = get_breaker(category).state == OPEN
+        problems = []
+        if spec["tier"] < tier:
+            problems.append(f"能力档位 {spec['tier']} < {tier}")
+        if spec["context"] < needed:
+            problems.append(f"上下文 {spec['context']} < {needed}")
+        if breaker_open:
+            problems.append("熔断中")
+        if health.error_rate > MAX_ERROR_RATE:
+            problems.append(f"错误率 {health.error_rate:.0%}")
+        rows.append({
+            "category": category,
+            "model": model,
+            "tier": spec["tier"],
+            "context": spec["context"],
+            "ttft_ewma": round(health.ttft, 3) if health.ttft is not None else None,
+            "tokens_per_sec_ewma": round(health.tokens_per_sec, 1) if health.tokens_per_sec else None,
+            "error_rate_ewma": round(health.error_rate, 3),
+            "expected_latency": round(health.expected_latency(max_tokens), 3),
+            "eligible": not problems,
+            "note": "；".join(problems),
+        })
+    rows.sort(key=lambda r: (not r["eligible"], r["expected_latency"]))
+    if not rows:
+        return None
+    best = rows[0]
+    if best["eligible"]:
+        reason = f"满足档位 {tier}、上下文约 {needed} token 的模型中预计最快（{best['expected_latency']}s）"
+    else:
+        # 没有完全满足条件的模型时退而求其次，选预计最快的一个
+        reason = "没有完全满足条件的模型，选用预计最快的模型"
+    return RoutingDecision(best["category"], best["model"], reason, rows)
+
+
+def show_decision(decision):
+    """在页面上展示自动路由的结果与各候选模型的输入指标"""
+    st.caption(f"自动路由：{decision.category} - {decision.model}（{decision.reason}）")
+    with st.expander("路由决策详情", expanded=False):
+        st.table(decision.rows)
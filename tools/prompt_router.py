@@ -0,0 +1,143 @@
+import re
+from collections import namedtuple
+
+import streamlit as st
+
+# 各服务商的轻量模型与旗舰模型：简单问题降级到轻量模型，复杂问题升级到旗舰模型
+LIGHT_MODELS = {
+    "Zhipu": "glm-4-flash",
+    "Yi": "yi-spark",
+    "Deepseek": "deepseek-chat",
+    "GPT": "gpt-3.5-turbo",
+    "Moonshot": "moonshot-v1-8k",
+    "Baichuan": "Baichuan3-Turbo",
+}
+HEAVY_MODELS = {
+    "Zhipu": "glm-4-alltools",
+    "Yi": "yi-large",
+    "Deepseek": "deepseek-chat",
+    "GPT": "gpt-4o",
+    "Moonshot": "moonshot-v1-32k",
+    "Baichuan": "Baichuan4",
+}
+
+# 页面功能或任务类型对复杂度的加权，按子串匹配，负数表示偏简单
+TASK_WEIGHTS = {
+    "AI翻译": -2,
+    "概念解释": -1,
+    "生成注释": -1,
+    "新闻摘要": -1,
+    "客户支持": -1,
+    "日常对话": -1,
+    "短文本生成": -1,
+    "AI写作": 2,
+    "写代码": 2,
+    "公式推导": 2,
+    "解题": 1,
+    "技术问答": 1,
+    "长篇小说": 2,
+    "文章生成": 1,
+}
+
+_CODE = re.compile(r"```|^\s*(def |class |import |from \S+ import |#include|public |function |SELECT |for \(|if \()"
+                   r"|[{};]\s*$", re.M | re.I)
+_REASONING = re.compile(r"证明|推导|分析|比较|为什么|如何设计|优化|步骤|详细|原理|架构|评估|prove|derive|analy[sz]e|compare|why|design")
+_MATH = re.compile(r"[=∑∫√≤≥±^]|\\frac|\\sum|\d+\s*[+\-*/]\s*\d+")
+_CJK = re.compile(r"[㐀-鿿]")
+_LATIN = re.compile(r"[A-Za-z]")
+_OTHER_SCRIPT = re.compile(r"[぀-ヿ가-힯Ѐ-ӿÀ-ɏ]")
+
+# 得分不超过该阈值的请求视为简单请求
+SIMPLE_THRESHOLD = 0
+
+Complexity = namedtuple("Complexity", ["level", "score", "reasons"])
+
+
+def detect_language(text):
+    """粗略判断主要语言：zh / en / other"""
+    if len(_OTHER_SCRIPT.findall(text)) > max(len(text) // 20, 3):
+        return "other"
+    return "zh" if len(_CJK.findall(text)) >= len(_LATIN.findall(text)) / 4 else "en"
+
+
+def classify(prompt, task=None, history=None):
+    """根据长度、语言、是否含代码、推理类关键词与任务类型给请求打复杂度分"""
+    score = 0
+    reasons = []
+    length = len(prompt)
+    if length > 800:
+        score += 2
+        reasons.append("长文本")
+    elif length > 300:
+        score += 1
+        reasons.append("较长")
+    elif length < 80:
+        score -= 1
+        reasons.append("短问题")
+    if _CODE.search(prompt):
+        score += 2
+        reasons.append("包含代码")
+    if detect_language(prompt) == "other":
+        score += 1
+        reasons.append("小语种")
+    keywords = set(_REASONING.findall(prompt))
+    if keywords:
+        score += min(len(keywords), 2)
+        reasons.append("推理类关键词")
+    if len(_MATH.findall(prompt)) >= 3:
+        score += 1
+        reasons.append("数学公式")
+    if history and sum(len(m.get("content") or "") for m in history) > 4000:
+        score += 1
+        reasons.append("上下文较长")
+    for name, weight in TASK_WEIGHTS.items():
+        if task and name in task:
+            score += weight
+            reasons.append(f"任务：{name}")
+    level = "simple" if score <= SIMPLE_THRESHOLD else "complex"
+    return Complexity(level, score, reasons)
+
+
+def is_rag_model(model):
+    """检索增强模型（如 yi-large-rag）的回答依赖检索结果，不能换成普通模型"""
+    return "rag" in model.lower().split("-")
+
+
+def choose_model(provider, default_model, prompt, task=None, history=None):
+    """简单请求换成该服务商的轻量模型；复杂请求保留默认模型，默认模型本身是轻量模型时升级到旗舰模型。
+
+    default_model 应是页面的默认模型而不是用户明确选择的模型；检索增强模型原样保留。
+    """
+    complexity = classify(prompt, task, history)
+    if is_rag_model(default_model):
+        return default_model, complexity
+    light = LIGHT_MODELS.get(provider, default_model)
+    if complexity.level == "simple":
+        return light, complexity
+    if default_model == light:
+        return HEAVY_MODELS.get(provider, default_model), complexity
+    return default_model, complexity
+
+
+def light_routing_enabled():
+    """侧边栏开关，默认关闭，由用户主动开启"""
+    return st.session_state.get("light_routing", False)
+
+
+def light_routing_toggle():
+    st.session_state["light_routing"] = st.sidebar.checkbox(
+        "简单问题使用轻量模型", value=light_routing_enabled(),
+        help="按问题长度、语言、是否含代码与任务类型判断复杂度，简单问题改用更快更便宜的小模型；"
+             "只在使用默认模型或“自动”时生效，不替换手动选择的模型")
+
+
+def last_user_content(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def show_choice(model, complexity):
+    label = "简单" if complexity.level == "simple" else "复杂"
+    st.caption(f"复杂度分流：{label}（{complexity.score}分：{'、'.join(complexity.reasons) or '无'}）→ {model}")
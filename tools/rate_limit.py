@@ -0,0 +1,225 @@
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import urlsplit
+
+import streamlit as st
+
+# 各服务商主机对应的限流名称；同一个 API Key 下的模型共用一个限流器
+PROVIDER_HOSTS = {
+    "api.bianxieai.com": "Bianxie",
+    "api.deepseek.com": "Deepseek",
+    "api.lingyiwanwu.com": "Yi",
+    "api.moonshot.cn": "Moonshot",
+    "api.baichuan-ai.com": "Baichuan",
+    "open.bigmodel.cn": "Zhipu",
+    "api-maas.singularity-ai.com": "Tiangong",
+    "zwapi.xfyun.cn": "Xfyun",
+}
+
+# 未单独配置的服务商使用的默认限制：每秒请求数、突发容量、最大并发
+DEFAULT_LIMITS = {"rps": 5.0, "burst": 10, "max_in_flight": 16}
+# 排队等待时检查放行条件、刷新排队提示的最长间隔（秒）
+WAIT_POLL = 0.5
+
+
+def _limit_config(key):
+    """读取 secrets.toml 中 [rate_limits] 段，键为服务商名称或“服务商/模型”"""
+    try:
+        limits = st.secrets.get("rate_limits", {})
+        return dict(limits[key]) if key in limits else None
+    except Exception:
+        return None
+
+
+def provider_for_url(url):
+    host = urlsplit(url).netloc
+    return PROVIDER_HOSTS.get(host, host)
+
+
+class ProviderLimiter:
+    """令牌桶限速加最大并发数，等待者按先来后到依次放行，便于给出排队位置"""
+
+    def __init__(self, name, rps, burst, max_in_flight):
+        self.name = name
+        self.rate = float(rps)
+        self.burst = float(burst)
+        self.max_in_flight = int(max_in_flight)
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.admitted = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self._updated = time.monotonic()
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_admit(self, ticket):
+        """轮到 ticket 且并发与令牌都满足时放行并返回 None，否则返回建议等待的秒数"""
+        self._refill(time.monotonic())
+        if self._waiting[0] is not ticket or self.in_flight >= self.max_in_flight:
+            return WAIT_POLL
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate if self.rate > 0 else WAIT_POLL
+        self._waiting.popleft()
+        self.tokens -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        self._cond.notify_all()
+        return None
+
+    def acquire(self, on_wait=None):
+        """阻塞直到放行；排队期间反复以当前排队位置（前面还有几个请求）调用 on_wait"""
+        ticket = object()
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket)
+                    if delay is None:
+                        if waited:
+                            self.throttled += 1
+                            self.wait_time += time.monotonic() - started
+                        return
+                    position = self._waiting.index(ticket)
+                    self._cond.wait(min(delay, WAIT_POLL))
+                waited = True
+                if on_wait is not None:
+                    on_wait(position)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._cond.notify_all()
+            raise
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limiter": self.name,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiting),
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "avg_wait": round(self.wait_time / self.throttled, 3) if self.throttled else None,
+            }
+
+
+class Slot:
+    """一次请求占用的配额，release() 可重复调用"""
+
+    def __init__(self, limiters):
+        self._limiters = limiters
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            limiters, self._limiters = self._limiters, []
+        for limiter in reversed(limiters):
+            limiter.release()
+
+
+@st.cache_resource(show_spinner=False)
+def _limiters():
+    return {}
+
+
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(key, model_level=False):
+    """进程内共享的限流器；模型级限流器只在 secrets 中单独配置了才会创建"""
+    limiters = _limiters()
+    with _limiters_lock:
+        if key not in limiters:
+            config = _limit_config(key)
+            if config is None and model_level:
+                return None
+            limits = dict(DEFAULT_LIMITS, **(_limit_config("default") or {}))
+            limits.update(config or {})
+            limiters[key] = ProviderLimiter(key, limits["rps"], limits["burst"], limits["max_in_flight"])
+        return limiters[key]
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters().values())
+    return [limiter.stats() for limiter in sorted(limiters, key=lambda l: l.name)]
+
+
+def queue_indicator():
+    """在页面中显示排队提示的回调，只在 Streamlit 脚本线程中可用；放行后调用 clear() 移除提示"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx() is None:
+            return None
+    except Exception:
+        return None
+    holder = []
+
+    def on_wait(position):
+        if not holder:
+            holder.append(st.empty())
+        if position:
+            holder[0].info(f"⏳ 请求排队中，前面还有 {position} 个请求…")
+        else:
+            holder[0].info("⏳ 已达到服务商限流速率，马上就轮到您…")
+
+    on_wait.clear = lambda: holder[0].empty() if holder else None
+    return on_wait
+
+
+def model_of(kwargs):
+    """从请求参数的 JSON 请求体中取出模型名"""
+    payload = kwargs.get("json")
+    return payload.get("model") if isinstance(payload, dict) else None
+
+
+def acquire(url, model=None):
+    """按 URL 对应的服务商（以及单独配置的模型）申请配额，等待期间在页面上显示排队位置"""
+    provider = provider_for_url(url)
+    limiters = [get_limiter(provider)]
+    if model:
+        model_limiter = get_limiter(f"{provider}/{model}", model_level=True)
+        if model_limiter is not None:
+            limiters.append(model_limiter)
+    on_wait = queue_indicator()
+    acquired = []
+    try:
+        for limiter in limiters:
+            limiter.acquire(on_wait)
+            acquired.append(limiter)
+    except BaseException:
+        Slot(acquired).release()
+        raise
+    if on_wait is not None:
+        on_wait.clear()
+    return Slot(acquired)
+
+
+def release_with(response, slot):
+    """流式响应关闭或被回收时归还配额"""
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            slot.release()
+
+    response.close = close_and_release
+    weakref.finalize(response, slot.release)
+    return response
@@ -0,0 +1,170 @@
+"""启动时的数据文件恢复扫描。
+
+旧版本直接以 'w' 模式覆盖写文件，进程在写入中途崩溃会留下残缺的 JSON。扫描在服务启动时（Main.py
+第一次运行时）执行一次：
+- 清理超过一分钟仍未被替换的临时文件；
+- 会话快照无法解析时，快照连同追加日志改名隔离（<文件>.corrupt-<时间戳>），不再出现在会话列表中；
+- 追加日志末尾写了一半的行截掉；中间出现无法解析的行时先保留一份隔离副本，再截断到该行之前；
+- 会话清单损坏时删除，下次列出会话时自动重建；
+- 角色与账号等 JSON 文件损坏时，有可解析的 .bak 备份就用备份还原，否则隔离；
+- SQLite 会话库执行 quick_check，发现问题只记录不改动。
+
+命令行：python -m tools.recovery
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+import streamlit as st
+
+from tools.atomic_io import atomic_write, file_lock, quarantine
+from tools.chat_histor import CHATS_DB, CHATS_DIR, FileChatStore
+from tools.chat_manifest import MANIFEST_NAME
+
+logger = logging.getLogger(__name__)
+
+# 由页面整体读改写的 JSON 数据文件
+DATA_FILES = ["static/characters/characters.json", "_secret_auth_.json"]
+# 修改时间早于该秒数的临时文件视为崩溃遗留
+STALE_TMP_SECONDS = 60
+
+
+def _parses(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            json.load(f)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def _clean_tmp(directory, actions):
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".tmp") and now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+            os.remove(path)
+            actions.append(("removed", path, "stale temp file"))
+
+
+def _check_log(log_path, actions):
+    """逐行检查追加日志，返回是否做了修复"""
+    good_bytes = 0
+    with open(log_path, "rb") as f:
+        lines = f.readlines()
+    for index, line in enumerate(lines):
+        try:
+            json.loads(line)
+            complete = line.endswith(b"\n")
+        except ValueError:
+            complete = False
+        if not complete:
+            if index < len(lines) - 1:
+                copy = f"{log_path}.corrupt-{time.strftime('%Y%m%d%H%M%S')}"
+                shutil.copyfile(log_path, copy)
+                actions.append(("quarantined", copy, f"unparsable log line {index + 1}"))
+            os.truncate(log_path, good_bytes)
+            actions.append(("repaired", log_path, f"truncated at line {index + 1}"))
+            return True
+        good_bytes += len(line)
+    return False
+
+
+def scan_chats(root=CHATS_DIR):
+    """检查 root 下所有用户的会话文件，返回 [(动作, 路径, 原因)]"""
+    actions = []
+    if not os.path.isdir(root):
+        return actions
+    store = FileChatStore(root)
+    for username in sorted(os.listdir(root)):
+        directory = os.path.join(root, username)
+        if not os.path.isdir(directory):
+            continue
+        _clean_tmp(directory, actions)
+        manifest = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest) and not _parses(manifest):
+            os.remove(manifest)
+            actions.append(("removed", manifest, "corrupt manifest, will be rebuilt"))
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            chat = name[:-5]
+            snapshot, log = store._paths(username, chat)
+            with file_lock(store._lock_path(username, chat)):
+                if not _parses(snapshot):
+                    actions.append(("quarantined", quarantine(snapshot), "unparsable snapshot"))
+                    if os.path.exists(log):
+                        actions.append(("quarantined", quarantine(log), "log of unparsable snapshot"))
+                    continue
+                if os.path.exists(log):
+                    _check_log(log, actions)
+    return actions
+
+
+def scan_data_file(path):
+    """检查整体读写的 JSON 文件，损坏时用 .bak 还原或隔离"""
+    actions = []
+    if not os.path.exists(path) or _parses(path):
+        return actions
+    with file_lock(path):
+        if _parses(path):
+            return actions
+        bak = path + ".bak"
+        moved = quarantine(path)
+        actions.append(("quarantined", moved, "unparsable JSON"))
+        if _parses(bak):
+            with open(bak, "rb") as f:
+                atomic_write(path, f.read())
+            actions.append(("restored", path, f"from {bak}"))
+    return actions
+
+
+def scan_database(path=CHATS_DB):
+    if not os.path.exists(path):
+        return []
+    try:
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            result = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return [("failed", path, f"quick_check error: {e}")]
+    if result == ["ok"]:
+        return []
+    return [("failed", path, "quick_check: " + "; ".join(result[:5]))]
+
+
+def scan_all():
+    actions = scan_chats()
+    for path in DATA_FILES:
+        actions += scan_data_file(path)
+    actions += scan_database()
+    return actions
+
+
+@st.cache_resource(show_spinner=False)
+def run_recovery_scan():
+    """每个服务进程只在第一次运行时扫描一次"""
+    try:
+        actions = scan_all()
+    except Exception as e:
+        logger.exception("recovery scan failed: %s", e)
+        return []
+    for action, path, reason in actions:
+        logger.warning("recovery: %s %s (%s)", action, path, reason)
+    return actions
+
+
+def main():
+    actions = scan_all()
+    for action, path, reason in actions:
+        print(f"{action}\t{path}\t{reason}")
+    print(f"{len(actions)} action(s)")
+
+
+if __name__ == "__main__":
+    main()
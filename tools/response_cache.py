@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from tools.sse_stream import StreamDelta
+
+
+def _cache_setting(name, default):
+    """读取 secrets.toml 中 [response_cache] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("response_cache", {}).get(name, default)
+    except Exception:
+        return default
+
+
+CACHE_DIR = _cache_setting("dir", "cache/responses")
+# 缓存条目的有效期（秒）、最多条目数与磁盘占用上限（字节），超出时按最近最少使用淘汰
+CACHE_TTL = float(_cache_setting("ttl", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(_cache_setting("max_entries", 2000))
+CACHE_MAX_BYTES = int(_cache_setting("max_bytes", 50 * 1024 * 1024))
+# 温度不高于该值的请求输出基本确定，默认可以缓存；更高温度的请求需要调用方显式标记
+CACHE_MAX_TEMPERATURE = float(_cache_setting("max_temperature", 0.3))
+# 重放缓存回答时每个增量的字符数
+REPLAY_CHUNK = 256
+
+
+def _normalize(messages):
+    """只保留角色与内容，并去掉首尾空白，避免无关字段或空格差异导致缓存未命中"""
+    return [{"role": m.get("role"), "content": (m.get("content") or "").strip()} for m in messages]
+
+
+def cache_key(payload):
+    """按 (模型, 规范化后的消息, temperature, top_p, max_tokens) 计算缓存键"""
+    material = {
+        "model": payload.get("model"),
+        "messages": _normalize(payload.get("messages") or []),
+        "temperature": payload.get("temperature"),
+        "top_p": payload.get("top_p"),
+        "max_tokens": payload.get("max_tokens"),
+    }
+    raw = json.dumps(material, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def eligible(payload, cacheable=False):
+    """低温度或调用方显式标记为可缓存的请求才走缓存"""
+    if cacheable:
+        return True
+    temperature = payload.get("temperature")
+    return temperature is not None and temperature <= CACHE_MAX_TEMPERATURE
+
+
+class ResponseCache:
+    """磁盘上的精确匹配回答缓存，每个条目一个 JSON 文件，内存中按访问顺序维护 LRU 索引"""
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> 文件大小，越靠后越是最近使用
+        self._index = OrderedDict()
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        """启动时按文件修改时间恢复 LRU 顺序"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+
+    def _remove(self, key):
+        self._bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._index)))
+            self.evictions += 1
+
+    def get(self, key):
+        """返回缓存的回答文本，不存在或已过期时返回 None"""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is None or time.time() - entry["created"] > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            try:
+                os.utime(self._path(key))
+            except OSError:
+                pass
+            self.hits += 1
+            return entry["content"]
+
+    def put(self, key, content, model=None):
+        entry = {"content": content, "model": model, "created": time.time()}
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            # 先写临时文件再替换，其他线程不会读到写了一半的条目
+            tmp = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache()
+
+
+def replay(content, chunk=REPLAY_CHUNK):
+    """把缓存的回答拆成增量事件，交给 render_deltas 按正常流程渲染"""
+    for start in range(0, len(content), chunk):
+        yield StreamDelta("content", content[start:start + chunk], None)
+    yield StreamDelta("done", "", None)
+
+
+def lookup(payload, cacheable=False):
+    """请求可缓存时返回 (缓存键, 缓存的回答)；不可缓存时缓存键为 None"""
+    if not payload.get("stream") or not eligible(payload, cacheable):
+        return None, None
+    key = cache_key(payload)
+    return key, get_response_cache().get(key)
+
+
+def store(key, payload, content):
+    if key is not None and content.strip():
+        get_response_cache().put(key, content, payload.get("model"))
@@ -0,0 +1,200 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import httpx
+import requests
+import streamlit as st
+
+from tools.rate_limit import provider_for_url
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_setting(name, default):
+    """读取 secrets.toml 中 [retry] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("retry", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 单次调用最多尝试几次，以及指数退避的基准与上限（秒）
+MAX_ATTEMPTS = int(_retry_setting("max_attempts", 3))
+BASE_DELAY = float(_retry_setting("base_delay", 0.5))
+MAX_DELAY = float(_retry_setting("max_delay", 8.0))
+# 服务端要求的 Retry-After 超过这个值就不再等待，直接返回错误
+MAX_RETRY_AFTER = float(_retry_setting("max_retry_after", 30.0))
+# 重试预算：每个请求为所属服务商积攒 ratio 次重试额度，额度用完后不再重试，避免故障时重试放大流量
+BUDGET_RATIO = float(_retry_setting("budget_ratio", 0.2))
+BUDGET_MIN = float(_retry_setting("budget_min", 3))
+BUDGET_MAX = float(_retry_setting("budget_max", 20))
+
+# 网关或限流类错误，请求多半没有被处理，重试是安全的
+RETRY_STATUS = (429, 502, 503, 504)
+# 连接没有建立或连接在发送请求前就已失效，任何方法都可以重试
+CONNECT_ERRORS = (requests.exceptions.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout,
+                  httpx.RemoteProtocolError)
+# 读取超时时服务端可能已经处理了请求，只对幂等的 GET 重试
+READ_TIMEOUTS = (requests.exceptions.ReadTimeout, httpx.ReadTimeout)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RetryBudget:
+    """按服务商累计的重试额度"""
+
+    def __init__(self, ratio=BUDGET_RATIO, minimum=BUDGET_MIN, maximum=BUDGET_MAX):
+        self.ratio = ratio
+        self.maximum = maximum
+        self.tokens = minimum
+        self.retries = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                self.exhausted += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+
+@st.cache_resource(show_spinner=False)
+def _budgets():
+    return {}
+
+
+_budgets_lock = threading.Lock()
+
+
+def get_budget(provider):
+    budgets = _budgets()
+    with _budgets_lock:
+        if provider not in budgets:
+            budgets[provider] = RetryBudget()
+        return budgets[provider]
+
+
+def retry_stats():
+    with _budgets_lock:
+        items = sorted(_budgets().items())
+    return [{"provider": name, "retries": b.retries, "budget_exhausted": b.exhausted, "tokens": round(b.tokens, 2)}
+            for name, b in items]
+
+
+def retry_after(headers):
+    """解析 Retry-After 头（秒数或 HTTP 日期），没有时返回 None"""
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """指数退避加完全抖动：第 n 次重试等待 [0, min(max_delay, base_delay * 2^n)] 内的随机时长"""
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 max_retry_after=MAX_RETRY_AFTER):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def retryable(self, method, response=None, error=None):
+        if error is not None:
+            if isinstance(error, CONNECT_ERRORS) and not isinstance(error, READ_TIMEOUTS):
+                return True
+            return isinstance(error, READ_TIMEOUTS) and method.upper() in IDEMPOTENT_METHODS
+        return response is not None and response.status_code in RETRY_STATUS
+
+    def delay(self, attempt, response=None):
+        """第 attempt 次失败后的等待时长；Retry-After 超过上限时返回 None 表示放弃"""
+        wait = retry_after(response.headers) if response is not None else None
+        if wait is not None:
+            return wait if wait <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, method, url, attempt, budget, response=None, error=None):
+        """判断是否还要重试，要重试时返回等待秒数，否则返回 None"""
+        if attempt + 1 >= self.max_attempts or not self.retryable(method, response, error):
+            return None
+        wait = self.delay(attempt, response)
+        if wait is None or not budget.withdraw():
+            return None
+        reason = error if error is not None else f"HTTP {response.status_code}"
+        logger.warning("retrying %s %s in %.2fs (attempt %d/%d): %s",
+                       method, url, wait, attempt + 2, self.max_attempts, reason)
+        return wait
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def _rewind(kwargs):
+    """重试前把要上传的文件对象倒回开头"""
+    for value in (kwargs.get("files") or {}).values():
+        stream = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+
+
+def call_with_retry(method, url, send, kwargs=None, policy=DEFAULT_POLICY):
+    """同步调用 send()，按策略重试；流式请求在拿到响应头之前才会重试"""
+    budget = get_budget(provider_for_url(url))
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            response, error = send(), None
+        except Exception as e:
+            response, error = None, e
+        wait = policy.next_delay(method, url, attempt, budget, response, error)
+        if wait is None:
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            response.close()
+        time.sleep(wait)
+        if kwargs:
+            _rewind(kwargs)
+        attempt += 1
+
+
+async def call_with_retry_async(method, url, send, policy=DEFAULT_POLICY):
+    """call_with_retry 的协程版本，send 为返回 httpx.Response 的协程函数"""
+    budget = get_budget(provider_for_url(url))
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            response, error = await send(), None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            response, error = None, e
+        wait = policy.next_delay(method, url, attempt, budget, response, error)
+        if wait is None:
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            await response.aclose()
+        await asyncio.sleep(wait)
+        attempt += 1
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import streamlit as st
+
+
+def _semantic_setting(name, default):
+    """读取 secrets.toml 中 [semantic_cache] 段的配置，缺省时使用默认值"""
+    try:
+        return st.secrets.get("semantic_cache", {}).get(name, default)
+    except Exception:
+        return default
+
+
+# 哈希向量的维度与字符 n-gram 的长度范围
+VECTOR_DIM = int(_semantic_setting("dim", 4096))
+NGRAM_RANGE = (1, 2)
+# 每个缓存最多保存的问题数，满了以后淘汰最久未命中的条目；条目的有效期（秒）
+CAPACITY = int(_semantic_setting("capacity", 1000))
+TTL = float(_semantic_setting("ttl", 24 * 3600))
+# 向量矩阵的初始行数，写满后按两倍扩容直到 CAPACITY
+INITIAL_ROWS = 16
+# 进程内最多保留的缓存（页面与作用域的组合）个数，超出时淘汰最久未使用的作用域
+MAX_SCOPES = int(_semantic_setting("max_scopes", 32))
+TOP_K = 5
+# 各页面命中所需的最低余弦相似度；字符 n-gram 向量对改动一两个字的问题仍给出 0.85~0.93 的相似度，
+# 阈值需要高于这一区间
+DEFAULT_THRESHOLD = 0.95
+PAGE_THRESHOLDS = {"Knowledge": 0.95}
+PAGE_THRESHOLDS.update(_semantic_setting("thresholds", {}))
+
+_PUNCT = re.compile(r"[\s\W_]+")
+# 否定词、数字与性别词改变问题陈述的事实（“发烧”与“不发烧”、“38度”与“39度”），向量再相似，
+# 这些词不完全一致的问题也不能互相命中
+_GUARD_PATTERNS = [
+    re.compile(r"[不没无非未别勿否]|\b(?:not|no|never|without)\b|n't"),
+    re.compile(r"\d+(?:\.\d+)?|[零一二两三四五六七八九十百千万半]+"),
+    re.compile(r"[男女孕]|\b(?:male|female|man|men|woman|women|pregnant)\b"),
+]
+
+SemanticHit = namedtuple("SemanticHit", ["answer", "question", "score"])
+
+
+def _normalize(text):
+    return _PUNCT.sub(" ", text.lower()).strip()
+
+
+def guard_terms(text):
+    """问题中出现的否定词、数字与性别词（保留重复），排序后的元组"""
+    text = text.lower()
+    return tuple(sorted(m.group() for pattern in _GUARD_PATTERNS for m in pattern.finditer(text)))
+
+
+def context_digest(messages):
+    """影响回答的对话上下文（此前的消息）的摘要，没有上下文时为 None"""
+    if not messages:
+        return None
+    body = json.dumps(messages, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def embed(text, dim=VECTOR_DIM, ngram_range=NGRAM_RANGE):
+    """字符 n-gram 哈希向量：n-gram 经 crc32 映射到维度并带符号累加，次线性缩放后做 L2 归一化"""
+    vector = np.zeros(dim, dtype=np.float32)
+    low, high = ngram_range
+    # 按标点与空白切分后在片段内取 n-gram，语序或标点不同的同一问题仍能得到相近的向量
+    for segment in _normalize(text).split():
+        for n in range(low, high + 1):
+            for i in range(len(segment) - n + 1):
+                h = zlib.crc32(segment[i:i + n].encode("utf-8"))
+                vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    np.copysign(np.log1p(np.abs(vector)), vector, out=vector)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """保存已回答问题的归一化向量矩阵，按余弦相似度查找措辞不同但含义相同的问题。
+
+    只有否定词、数字、性别词与对话上下文都和缓存条目完全一致时，相似的问题才算命中。
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, capacity=CAPACITY, ttl=TTL, dim=VECTOR_DIM):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.dim = dim
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._used = np.zeros(0, dtype=np.float64)
+        self._created = np.zeros(0, dtype=np.float64)
+        self._questions = []
+        self._answers = []
+        self._keys = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def _grow(self):
+        """矩阵写满时按两倍扩容（不超过 capacity），已有的行原样复制"""
+        rows = min(self.capacity, max(INITIAL_ROWS, 2 * len(self._matrix)))
+        matrix = np.zeros((rows, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        self._used = np.resize(self._used, rows)
+        self._created = np.resize(self._created, rows)
+
+    def _live(self, now):
+        """未过期条目的掩码"""
+        return now - self._created[:self._size] <= self.ttl
+
+    def top_k(self, question, k=TOP_K):
+        """返回相似度最高的 k 个 (相似度, 问题, 回答)，按相似度从高到低排列"""
+        vector = embed(question, self.dim)
+        with self._lock:
+            return [(score, self._questions[i], self._answers[i]) for score, i in self._top_k(vector, k, time.time())]
+
+    def _top_k(self, vector, k, now):
+        """对整个矩阵做一次矩阵向量乘法，再用 argpartition 取前 k 个 (相似度, 下标)"""
+        if not self._size:
+            return []
+        scores = self._matrix[:self._size] @ vector
+        scores[~self._live(now)] = -1.0
+        k = min(k, self._size)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        order = candidates[np.argsort(-scores[candidates])]
+        return [(float(scores[i]), int(i)) for i in order if scores[i] > -1.0]
+
+    def _match(self, vector, key, now, threshold):
+        """相似度不低于 threshold 且精确键一致的最相似条目 (相似度, 下标)，没有时返回 None"""
+        for score, index in self._top_k(vector, TOP_K, now):
+            if score < threshold:
+                break
+            if self._keys[index] == key:
+                return score, index
+        return None
+
+    def lookup(self, question, context=None):
+        """相似度超过阈值时返回 SemanticHit 并刷新该条目的使用时间，否则返回 None。
+
+        context 为生成回答时一同发给模型的此前消息，必须与缓存条目的完全一致。
+        """
+        vector = embed(question, self.dim)
+        key = (guard_terms(question), context_digest(context))
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            best = self._match(vector, key, now, self.threshold)
+            if best is None:
+                return None
+            score, index = best
+            self.hits += 1
+            self._used[index] = now
+            return SemanticHit(self._answers[index], self._questions[index], score)
+
+    def add(self, question, answer, context=None):
+        vector = embed(question, self.dim)
+        key = (guard_terms(question), context_digest(context))
+        now = time.time()
+        with self._lock:
+            best = self._match(vector, key, now, 0.999)
+            if best is not None:
+                # 几乎相同的问题直接覆盖原条目
+                index = best[1]
+            elif self._size < self.capacity:
+                if self._size == len(self._matrix):
+                    self._grow()
+                index = self._size
+                self._size += 1
+                self._questions.append(None)
+                self._answers.append(None)
+                self._keys.append(None)
+            else:
+                # 优先复用已过期的位置，否则淘汰最久未使用的条目
+                expired = np.flatnonzero(~self._live(now))
+                index = int(expired[0]) if expired.size else int(np.argmin(self._used[:self._size]))
+                self.evictions += 1
+            self._matrix[index] = vector
+            self._used[index] = now
+            self._created[index] = now
+            self._questions[index] = question
+            self._answers[index] = answer
+            self._keys[index] = key
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": self._size,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+                "evictions": self.evictions,
+                "threshold": self.threshold,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def _caches():
+    return OrderedDict()
+
+
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(page, scope=""):
+    """按页面与作用域（功能、模型、知识库等会影响回答的设置）隔离的进程内语义缓存。
+
+    作用域的组合随模型与知识库增多，最多保留 MAX_SCOPES 个，超出时丢弃最久未使用的缓存。
+    """
+    caches = _caches()
+    key = (page, scope)
+    with _caches_lock:
+        cache = caches.get(key)
+        if cache is None:
+            cache = caches[key] = SemanticCache(threshold=float(PAGE_THRESHOLDS.get(page, DEFAULT_THRESHOLD)))
+            while len(caches) > MAX_SCOPES:
+                caches.popitem(last=False)
+        else:
+            caches.move_to_end(key)
+        return cache
+
+
+def semantic_stats():
+    with _caches_lock:
+        items = sorted(_caches().items())
+    return [dict(page=page, scope=scope, **cache.stats()) for (page, scope), cache in items]
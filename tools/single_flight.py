@@ -0,0 +1,190 @@
+import logging
+import threading
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# 跟随者等待领头请求拿到响应头的最长时间（秒），超时后自己发请求
+JOIN_TIMEOUT = 30.0
+
+PENDING = "pending"
+STREAMING = "streaming"
+DONE = "done"
+FAILED = "failed"
+# 所有订阅者都已离开、上游已断开，缓冲中的回答不完整
+CANCELLED = "cancelled"
+
+
+class Flight:
+    """一次正在进行的上游请求：后台线程消费上游增量写入缓冲，所有订阅者从缓冲中按各自进度读取"""
+
+    def __init__(self, key, on_finish):
+        self.key = key
+        self.state = PENDING
+        self.error = None
+        self.buffer = []
+        self.subscribers = 0
+        self._upstream = None
+        self._on_finish = on_finish
+        self._cond = threading.Condition()
+
+    def start(self, deltas):
+        """领头请求拿到 200 响应后调用，启动后台线程把上游增量广播给订阅者，返回领头自己的订阅。
+
+        领头的订阅在流对外可见之前计入，跟随者先行离开不会让流被取消。
+        """
+        with self._cond:
+            self._upstream = deltas
+            self.state = STREAMING
+            self.subscribers += 1
+            self._cond.notify_all()
+        threading.Thread(target=self._pump, name="single-flight", daemon=True).start()
+        return Subscription(self)
+
+    def fail(self):
+        """领头请求没能建立流，等待中的跟随者改为自己发请求"""
+        with self._cond:
+            self.state = FAILED
+            self._cond.notify_all()
+        self._on_finish(self)
+
+    def _pump(self):
+        try:
+            for delta in self._upstream:
+                with self._cond:
+                    self.buffer.append(delta)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.error = e
+        finally:
+            with self._cond:
+                if self.state == STREAMING:
+                    self.state = DONE
+                self._cond.notify_all()
+            self._on_finish(self)
+
+    def subscribe(self, timeout=JOIN_TIMEOUT):
+        """返回从头重放缓冲再跟随上游的 Subscription；流没能建立、已结束或已取消时返回 None"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.state != PENDING, timeout):
+                return None
+            if self.state != STREAMING:
+                return None
+            self.subscribers += 1
+        return Subscription(self)
+
+    def _leave(self):
+        """订阅者提前退出；最后一个订阅者离开时取消这次请求：不再接受新的订阅者并断开上游连接"""
+        with self._cond:
+            self.subscribers -= 1
+            cancel = self.subscribers <= 0 and self.state == STREAMING
+            if cancel:
+                self.state = CANCELLED
+                self._cond.notify_all()
+        if not cancel:
+            return
+        self._on_finish(self)
+        if hasattr(self._upstream, "close"):
+            self._upstream.close()
+
+
+class Subscription:
+    """单个订阅者的增量迭代器，接口与 iter_deltas 的返回值一致，可直接交给 render_deltas"""
+
+    def __init__(self, flight):
+        self.flight = flight
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        flight = self.flight
+        position = 0
+        try:
+            while not self._closed:
+                with flight._cond:
+                    flight._cond.wait_for(
+                        lambda: self._closed or position < len(flight.buffer) or flight.state in (DONE, CANCELLED))
+                    pending = flight.buffer[position:]
+                    finished = flight.state in (DONE, CANCELLED)
+                    error = flight.error
+                position += len(pending)
+                for delta in pending:
+                    yield delta
+                if finished and position >= len(flight.buffer):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        with self.flight._cond:
+            self.flight._cond.notify_all()
+        self.flight._leave()
+
+
+class SingleFlight:
+    """按缓存键合并同时进行的相同请求：第一个请求成为领头，其余请求订阅它的增量"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _finish(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def join(self, key, open_stream):
+        """返回 (订阅, 是否领头)。
+
+        领头请求调用 open_stream() 建立上游流，返回 None 表示失败（由 open_stream 自行提示错误），
+        此时返回的订阅也是 None。跟随者等待领头建立流后从头重放已缓冲的增量；领头失败时
+        跟随者会重新竞争成为领头，等待超时则自己单独请求。已结束或已取消的请求不再接受订阅，
+        相同键的新请求另起一次上游请求。
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None or flight.state in (DONE, FAILED, CANCELLED)
+                if leader:
+                    flight = self._flights[key] = Flight(key, self._finish)
+                    self.leaders += 1
+            if not leader:
+                subscription = flight.subscribe()
+                if subscription is not None:
+                    with self._lock:
+                        self.coalesced += 1
+                    logger.info("coalesced request %s onto in-flight stream", key[:12])
+                    return subscription, False
+                if flight.state in (DONE, FAILED, CANCELLED):
+                    # 领头请求失败，或请求在订阅前结束、被取消，重新竞争成为领头
+                    continue
+                # 等待领头拿到响应头超时，不再合并，自己单独发请求
+                return open_stream(), True
+            try:
+                deltas = open_stream()
+            except BaseException:
+                flight.fail()
+                raise
+            if deltas is None:
+                flight.fail()
+                return None, True
+            return flight.start(deltas), True
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    return SingleFlight()
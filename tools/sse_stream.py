@@ -0,0 +1,188 @@
+import json
+import socket
+from collections import namedtuple
+
+# 流式增量事件：kind 为 "content"（文本增量）、"usage"（用量统计）、"error"（无法解析的帧）或 "done"（流结束）
+StreamDelta = namedtuple("StreamDelta", ["kind", "content", "data"])
+
+
+class SSEDecoder:
+    """增量 SSE 解析器，直接在字节缓冲区上切分事件，支持多行 data 与注释心跳"""
+
+    def __init__(self, lenient=False):
+        # lenient 模式下，不带 "data:" 前缀的裸 JSON 行也视为一个完整事件（天工 sky-work 接口）
+        self.lenient = lenient
+        self._buffer = bytearray()
+        self._data = []
+
+    def feed(self, chunk):
+        """喂入一段字节，返回其中已完整的事件数据列表"""
+        self._buffer += chunk
+        events = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self._buffer[start:end])
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            events.extend(self._process_line(line))
+        if start:
+            del self._buffer[:start]
+        return events
+
+    def flush(self):
+        """连接关闭时调用，返回缓冲区中剩余的事件"""
+        events = []
+        if self._buffer:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._buffer.clear()
+            events.extend(self._process_line(line))
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _dispatch(self):
+        if not self._data:
+            return None
+        data = b"\n".join(self._data).decode("utf-8", errors="replace")
+        self._data = []
+        return data
+
+    def _process_line(self, line):
+        if not line:
+            event = self._dispatch()
+            return [event] if event is not None else []
+        if line.startswith(b":"):
+            # 注释行，一般是服务端的 keep-alive 心跳
+            return []
+        field, sep, value = line.partition(b":")
+        if sep and field == b"data":
+            if value.startswith(b" "):
+                value = value[1:]
+            self._data.append(value.strip())
+            return []
+        if self.lenient:
+            stripped = line.strip()
+            if stripped.startswith(b"{") or stripped == b"[DONE]":
+                # 裸 JSON 行自成一个事件，先交出之前累积的 data
+                events = []
+                pending = self._dispatch()
+                if pending is not None:
+                    events.append(pending)
+                events.append(stripped.decode("utf-8", errors="replace"))
+                return events
+        # event / id / retry 等字段目前用不到，直接忽略
+        return []
+
+
+def iter_sse(response, lenient=False, chunk_size=None, timer=None):
+    """从 requests 流式响应中逐个产出 SSE 事件的 data 字符串"""
+    decoder = SSEDecoder(lenient=lenient)
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if chunk:
+            if timer is not None:
+                timer.mark_first_byte()
+            for event in decoder.feed(chunk):
+                yield event
+    for event in decoder.flush():
+        yield event
+
+
+def _loads(data):
+    try:
+        return [json.loads(data)]
+    except json.JSONDecodeError:
+        if "\n" not in data:
+            raise
+    # 部分服务商在相邻的 data 行之间不发空行，按行拆开再解析
+    return [json.loads(line) for line in data.split("\n") if line.strip()]
+
+
+def openai_delta(chunk_json):
+    """OpenAI 兼容格式：choices[0].delta.content"""
+    choices = chunk_json.get("choices")
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def tiangong_extractor():
+    """天工 sky-work 格式：arguments[0].messages[].text，同一段文本会被重复推送，需要去重"""
+    seen_texts = set()
+
+    def extract(chunk_json):
+        arguments = chunk_json.get("arguments")
+        if not arguments or "messages" not in arguments[0]:
+            return ""
+        content = ""
+        for message in arguments[0]["messages"]:
+            text = message.get("text")
+            if text and text not in seen_texts:
+                seen_texts.add(text)
+                content += text
+        return content
+
+    return extract
+
+
+def parse_event(data, extract=openai_delta):
+    """把一个 SSE 事件的 data 解析为 StreamDelta 列表"""
+    try:
+        chunks = _loads(data)
+    except json.JSONDecodeError:
+        return [StreamDelta("error", "", data)]
+    deltas = []
+    for chunk_json in chunks:
+        content = extract(chunk_json) if isinstance(chunk_json, dict) else ""
+        if content:
+            deltas.append(StreamDelta("content", content, chunk_json))
+        elif isinstance(chunk_json, dict) and chunk_json.get("usage"):
+            # 末尾只携带 usage 的帧，供指标统计使用
+            deltas.append(StreamDelta("usage", "", chunk_json))
+    return deltas
+
+
+class DeltaStream:
+    """对 requests 流式响应的增量事件迭代器，close() 可从其他线程调用以断开上游连接"""
+
+    def __init__(self, response, extract=openai_delta, lenient=False, timer=None):
+        self.response = response
+        self.extract = extract
+        self.lenient = lenient
+        self.timer = timer
+
+    def __iter__(self):
+        events = iter_sse(self.response, lenient=self.lenient, timer=self.timer)
+        try:
+            for data in events:
+                if data == "[DONE]":
+                    break
+                for delta in parse_event(data, self.extract):
+                    yield delta
+            yield StreamDelta("done", "", None)
+            # [DONE] 之后服务端通常随即结束响应，读完剩余字节才能让连接回到连接池复用
+            for _ in events:
+                pass
+        finally:
+            # 读完的响应 close 时会把连接放回连接池；中途退出则直接关闭套接字
+            self.response.close()
+
+    def close(self):
+        """中途取消：先关闭底层套接字让阻塞中的读取立即返回，再释放响应"""
+        connection = getattr(self.response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.response.close()
+
+
+def iter_deltas(response, extract=openai_delta, lenient=False, timer=None):
+    """解析流式响应，产出 StreamDelta 事件，所有聊天页面共用这一条热路径"""
+    return DeltaStream(response, extract=extract, lenient=lenient, timer=timer)
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+
+import streamlit as st
+
+from tools.chat_histor import save_data
+from tools.metrics import current_user
+
+logger = logging.getLogger(__name__)
+
+# 后台巡检线程检查浏览器会话是否仍然在线的间隔（秒）
+WATCH_INTERVAL = 2.0
+# 流式回答写入聊天记录检查点的间隔（秒）
+CHECKPOINT_INTERVAL = 3.0
+# 只在本地聊天记录中使用的消息字段，发给模型前去掉
+LOCAL_MESSAGE_KEYS = ("partial", "model", "failover")
+# “继续生成”时追加给模型的指令
+CONTINUE_PROMPT = "请从上一条回答中断的地方继续，不要重复已经输出的内容。"
+
+
+def current_session_id():
+    """当前脚本运行所属的 Streamlit 会话 id，不在脚本线程中时返回 None"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+    except Exception:
+        return None
+    return ctx.session_id if ctx is not None else None
+
+
+def _session_alive(session_id):
+    try:
+        from streamlit.runtime import Runtime
+        return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        # 没有运行时（例如离线脚本）时无法判断，按在线处理
+        return True
+
+
+class ActiveStream:
+    """一次正在进行的流式回答，cancel() 可从任意线程调用以关闭上游连接"""
+
+    def __init__(self, session_id, closer):
+        self.session_id = session_id
+        self.reason = None
+        self._closer = closer
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, reason="stopped"):
+        if self._cancelled.is_set():
+            return
+        self.reason = reason
+        self._cancelled.set()
+        if self._closer is not None:
+            try:
+                self._closer()
+            except Exception as e:
+                logger.debug("close upstream stream failed: %s", e)
+
+
+class StreamRegistry:
+    """进程内所有进行中的流，按会话登记；巡检线程发现会话断开后自动取消对应的流"""
+
+    def __init__(self, interval=WATCH_INTERVAL):
+        self.interval = interval
+        self._streams = set()
+        self._lock = threading.Lock()
+        self._watcher = threading.Thread(target=self._watch, name="stream-watchdog", daemon=True)
+        self._watcher.start()
+
+    def register(self, closer, session_id=None):
+        stream = ActiveStream(session_id or current_session_id(), closer)
+        with self._lock:
+            self._streams.add(stream)
+        return stream
+
+    def unregister(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def cancel_session(self, session_id, reason="stopped"):
+        """取消某个会话下所有进行中的流，返回取消的数量"""
+        with self._lock:
+            streams = [s for s in self._streams if s.session_id == session_id]
+        for stream in streams:
+            stream.cancel(reason)
+        return len(streams)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                streams = [s for s in self._streams if s.session_id is not None]
+            for stream in streams:
+                if not _session_alive(stream.session_id):
+                    logger.info("session %s disconnected, cancelling stream", stream.session_id)
+                    stream.cancel("disconnected")
+
+
+@st.cache_resource(show_spinner=False)
+def get_stream_registry():
+    return StreamRegistry()
+
+
+def request_stop():
+    """“停止生成”按钮的回调：取消当前会话的所有流"""
+    session_id = current_session_id()
+    if session_id is not None:
+        get_stream_registry().cancel_session(session_id)
+
+
+class AnswerCheckpoint:
+    """流式回答的检查点：生成过程中定期把部分回答（标记为 partial）写入聊天记录，
+    脚本重跑、连接断开或进程退出后都不会丢失已生成的内容"""
+
+    def __init__(self, username=None, interval=CHECKPOINT_INTERVAL):
+        self.messages = st.session_state.get("messages")
+        self.chat_name = st.session_state.get("chat_name")
+        self.username = username or current_user()
+        self.interval = interval
+        # 点击“继续生成”后的这一轮回答接在最后一条 partial 消息后面
+        self.resuming = bool(st.session_state.pop("resume_partial", False)) and _ends_with_partial(self.messages)
+        self._last_saved = time.monotonic()
+        self._saved_chars = len(self.prefix)
+
+    @property
+    def prefix(self):
+        return self.messages[-1]["content"] if self.resuming else ""
+
+    def _history(self):
+        return self.messages[:-1] if self.resuming else self.messages
+
+    def update(self, content):
+        """按间隔写入检查点，只改动磁盘上的记录，不改动会话中的消息列表"""
+        if self.messages is None or not (self.username and self.chat_name):
+            return
+        now = time.monotonic()
+        if now - self._last_saved < self.interval or len(content) == self._saved_chars:
+            return
+        self._last_saved = now
+        self._saved_chars = len(content)
+        save_data(self.username, self.chat_name, self._history() + [_partial_message(content)])
+
+    def keep(self, content):
+        """回答被中断：把部分回答作为 partial 消息放进会话并保存"""
+        if self.messages is None:
+            return
+        if self.resuming:
+            self.messages[-1]["content"] = content
+        else:
+            self.messages.append(_partial_message(content))
+        if self.username and self.chat_name:
+            save_data(self.username, self.chat_name, self.messages)
+
+    def commit(self):
+        """回答正常结束：移除被续写的 partial 消息，由页面追加合并后的完整回答"""
+        if self.resuming:
+            self.messages.pop()
+
+
+def _partial_message(content):
+    return {"role": "assistant", "content": content, "partial": True}
+
+
+def _ends_with_partial(messages):
+    return bool(messages) and bool(messages[-1].get("partial"))
+
+
+def continue_button():
+    """最后一条回答是被中断的部分回答时显示“继续生成”按钮，点击后返回 True"""
+    if not _ends_with_partial(st.session_state.get("messages")):
+        return False
+    if st.button("▶继续生成", key="continue_partial"):
+        st.session_state["resume_partial"] = True
+        return True
+    return False
+
+
+def api_messages(messages):
+    """去掉 partial 等本地字段后的消息列表；点击了“继续生成”时追加续写指令"""
+    cleaned = [{k: v for k, v in message.items() if k not in LOCAL_MESSAGE_KEYS} for message in messages]
+    if st.session_state.get("resume_partial") and _ends_with_partial(messages):
+        cleaned.append({"role": "user", "content": CONTINUE_PROMPT})
+    return cleaned
@@ -0,0 +1,139 @@
+import logging
+import time
+
+import streamlit as st
+
+from tools.stream_control import AnswerCheckpoint, get_stream_registry, request_stop
+
+logger = logging.getLogger(__name__)
+
+# 默认每秒最多刷新 10 帧；累计的新内容超过 512 字节时提前刷新
+RENDER_FPS = 10
+RENDER_MIN_BYTES = 512
+
+
+class TokenRenderer:
+    """合并流式增量，按帧率或字节阈值批量刷新到占位符，避免每个 token 都重新渲染整段 Markdown"""
+
+    def __init__(self, placeholder, fps=RENDER_FPS, min_bytes=RENDER_MIN_BYTES, transform=None, prefix=""):
+        self.placeholder = placeholder
+        self.interval = 1.0 / fps if fps else 0.0
+        self.min_bytes = min_bytes
+        self.transform = transform
+        self.render_calls = 0
+        self.bytes_pushed = 0
+        # 续写时以已有的部分回答开头，第一次刷新就把它一并显示出来
+        self._parts = [prefix] if prefix else []
+        self._pending_bytes = len(prefix.encode("utf-8"))
+        self._last_flush = time.monotonic()
+
+    @property
+    def content(self):
+        return "".join(self._parts)
+
+    def push(self, text):
+        """追加一段增量文本，达到帧间隔或字节阈值时才真正刷新"""
+        if not text:
+            return
+        self._parts.append(text)
+        self._pending_bytes += len(text.encode("utf-8"))
+        now = time.monotonic()
+        if self._pending_bytes >= self.min_bytes or now - self._last_flush >= self.interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """把缓冲的增量合并后推送到占位符"""
+        if not self._pending_bytes:
+            return
+        content = "".join(self._parts)
+        self._parts = [content]
+        self._pending_bytes = 0
+        self._last_flush = now if now is not None else time.monotonic()
+        if self.placeholder is None:
+            return
+        rendered = self.transform(content) if self.transform else content
+        self.placeholder.markdown(rendered)
+        self.render_calls += 1
+        self.bytes_pushed += len(rendered.encode("utf-8"))
+
+    def close(self):
+        """流结束时的最后一次刷新，并记录本次回答的渲染次数与推送字节数"""
+        self.flush()
+        logger.info("stream rendered: %d chars, %d render calls, %d bytes pushed",
+                    len(self.content), self.render_calls, self.bytes_pushed)
+        return self.content
+
+    def stats(self):
+        return {"render_calls": self.render_calls, "bytes_pushed": self.bytes_pushed}
+
+
+def _stop_button(renderer):
+    """回答生成期间显示的“停止生成”按钮；点击会触发重跑，正在执行的渲染随之中断"""
+    slot = st.empty()
+    slot.button("⏹停止生成", key=f"stop_generating_{id(renderer)}", on_click=request_stop)
+    return slot
+
+
+def render_deltas(deltas, placeholder, transform=None, timer=None, on_partial=None, resumable=True, **renderer_kwargs):
+    """消费 iter_deltas 产出的事件并节流渲染，返回完整的回答文本；传入 timer 时顺带记录时延指标
+
+    生成过程中定期把部分回答写入聊天记录作为检查点。用户点击“停止生成”、会话断开或中途出错时
+    立即关闭上游连接，已生成的部分交给 on_partial 保存（默认作为 partial 消息写入聊天记录），
+    此时返回空字符串，调用方不会再重复追加这条回答。续写时返回的是拼接后的完整回答。
+    没有“继续生成”按钮的页面传入 resumable=False：不写检查点，中断时丢弃部分回答。
+    """
+    checkpoint = AnswerCheckpoint() if placeholder is not None and resumable else None
+    prefix = checkpoint.prefix if checkpoint is not None else ""
+    renderer = TokenRenderer(placeholder, transform=transform, prefix=prefix, **renderer_kwargs)
+    stop_slot = _stop_button(renderer) if placeholder is not None else None
+    registry = get_stream_registry()
+    active = registry.register(getattr(deltas, "close", None))
+    status = "error"
+    interrupted = False
+    try:
+        for delta in deltas:
+            if active.cancelled:
+                break
+            if timer is not None:
+                timer.on_delta(delta)
+            if delta.kind == "content":
+                renderer.push(delta.content)
+                if checkpoint is not None:
+                    checkpoint.update(renderer.content)
+            elif delta.kind == "error":
+                st.error(f"JSONDecodeError: {delta.data}")
+            elif delta.kind == "done":
+                renderer.flush()
+        status = "cancelled" if active.cancelled else "ok"
+    except Exception:
+        # 上游连接被巡检线程关闭时，阻塞中的读取会以异常结束
+        if not active.cancelled:
+            raise
+        status = "cancelled"
+    except BaseException:
+        # Streamlit 因点击按钮重跑或会话结束而中断脚本，此时不能再调用 st 组件
+        interrupted = True
+        status = "cancelled"
+        raise
+    finally:
+        registry.unregister(active)
+        if status != "ok" and hasattr(deltas, "close"):
+            deltas.close()
+        if interrupted:
+            renderer.placeholder = None
+        renderer.close()
+        if timer is not None:
+            timer.finish(status=status, content=renderer.content[len(prefix):])
+        if status == "ok":
+            if checkpoint is not None and renderer.content != prefix:
+                checkpoint.commit()
+        elif renderer.content.strip():
+            if on_partial is not None:
+                on_partial(renderer.content)
+            elif checkpoint is not None:
+                checkpoint.keep(renderer.content)
+        if stop_slot is not None and not interrupted:
+            stop_slot.empty()
+    st.session_state["render_stats"] = renderer.stats()
+    # 续写没有产出新内容时保留原来的 partial 消息
+    return renderer.content if status == "ok" and renderer.content != prefix else ""